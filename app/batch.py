@@ -0,0 +1,147 @@
+"""Headless batch calculation of .guv project files."""
+
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+import warnings
+import functools
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from guv_calcs import Room
+from app.calculation import calculate_room
+from app.room_utils import disable_irrelevant_limits, summarize_room
+
+
+def find_projects(patterns):
+    """expand directories and glob patterns into a sorted list of .guv files"""
+    paths = []
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            paths += sorted(path.glob("*.guv"))
+        else:
+            paths += sorted(Path(p) for p in glob.glob(pattern, recursive=True))
+    return list(dict.fromkeys(paths))
+
+
+def run_project(path, refine=False):
+    """load, calculate and summarize a single .guv file"""
+    start = time.perf_counter()
+    summary = {"project": str(path)}
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            room = Room.load(Path(path).read_text())
+            disable_irrelevant_limits(room)
+            calculate_room(room, workers=1)
+        summary.update(summarize_room(room, refine=refine))
+        summary["error"] = None
+    except Exception as e:
+        summary["error"] = f"{type(e).__name__}: {e}"
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def run_batch(paths, workers=None, progress=None, refine=False):
+    """
+    summarize every project, in order. `progress(i, summary)` is called as
+    each one finishes, if given
+    """
+    workers = os.cpu_count() if workers is None else workers
+    run = functools.partial(run_project, refine=refine)
+    if workers <= 1 or len(paths) <= 1:
+        results = map(run, paths)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=min(workers, len(paths)),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        results = executor.map(run, paths)
+    summaries = []
+    try:
+        for i, summary in enumerate(results):
+            summaries.append(summary)
+            if progress is not None:
+                progress(i, summary)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return summaries
+
+
+def write_summaries(summaries, output, fmt=None):
+    """write to a .csv or .json file, by extension unless `fmt` is given"""
+    fmt = fmt or ("json" if str(output).lower().endswith(".json") else "csv")
+    if fmt == "json":
+        with open(output, "w") as f:
+            json.dump(summaries, f, indent=2)
+        return
+    # a failed project has fewer fields, so take them from every row
+    first, last = ["project"], ["error", "seconds"]
+    keys = dict.fromkeys(k for s in summaries for k in s.keys())
+    fieldnames = first + [k for k in keys if k not in first + last] + last
+    with open(output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(summaries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.batch",
+        description="Calculate and summarize many .guv projects.",
+    )
+    parser.add_argument(
+        "projects", nargs="+", help="directories, .guv files or glob patterns"
+    )
+    parser.add_argument(
+        "-o", "--output", default="summary.csv", help="output .csv or .json file"
+    )
+    parser.add_argument("--format", choices=["csv", "json"], default=None)
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="number of processes; defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--refine",
+        action="store_true",
+        help="refine the skin and eye dose maxima off the regular grid",
+    )
+    args = parser.parse_args(argv)
+
+    paths = find_projects(args.projects)
+    if len(paths) == 0:
+        parser.error("no .guv files found")
+
+    def progress(i, summary):
+        status = "ok" if summary["error"] is None else summary["error"]
+        print(
+            f"[{i + 1}/{len(paths)}] {summary['project']}: {status} "
+            f"({summary['seconds']} s)",
+            file=sys.stderr,
+        )
+
+    summaries = run_batch(
+        paths, workers=args.workers, progress=progress, refine=args.refine
+    )
+    write_summaries(summaries, args.output, args.format)
+    failed = sum(summary["error"] is not None for summary in summaries)
+    print(
+        f"Wrote {len(summaries)} summaries to {args.output}"
+        + (f" ({failed} failed)" if failed else ""),
+        file=sys.stderr,
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Calculation benchmarks over canonical rooms."""
+
+import sys
+import json
+import time
+import platform
+import argparse
+import warnings
+import subprocess
+from pathlib import Path
+import numpy as np
+import guv_calcs
+from guv_calcs import Room, Lamp
+from guv_calcs.lamp import VALID_LAMPS
+from app.compliance import check_compliance
+
+IES_DIR = Path(__file__).resolve().parents[1] / "data" / "ies_files"
+
+# the lamp of the single lamp scenarios, which has a spectrum for compliance
+ONE_LAMP = "ushio_b1"
+
+OPERATIONS = ["calculate", "check_lamps", "export_zip", "disinfection_table"]
+
+
+def get_sources():
+    """the vendored lamps: local .ies files, then guv-calcs keywords"""
+    return sorted(IES_DIR.glob("*.ies")) + list(VALID_LAMPS)
+
+
+def get_lamp(source, lamp_id):
+    """a lamp from a local .ies file, with its spectrum if there is one, or a keyword"""
+    if isinstance(source, Path):
+        spectrum = source.with_name(f"{source.stem}_spectrum.csv")
+        return Lamp(
+            lamp_id=lamp_id,
+            name=source.stem,
+            filedata=source,
+            guv_type="krcl",
+            spectra_source=spectrum if spectrum.exists() else None,
+        )
+    return Lamp.from_keyword(source, lamp_id=lamp_id)
+
+
+def get_room(sources, **kwargs):
+    """the default room with the standard zones and a grid of lamps on the ceiling"""
+    room = Room(**kwargs)
+    room.add_standard_zones()
+    cols = int(np.ceil(np.sqrt(len(sources))))
+    rows = int(np.ceil(len(sources) / cols))
+    for i, source in enumerate(sources):
+        x = room.x * ((i % cols) + 0.5) / cols
+        y = room.y * ((i // cols) + 0.5) / rows
+        lamp = get_lamp(source, f"Lamp{i + 1}")
+        lamp.move(x, y, room.z - 0.1)
+        room.add_lamp(lamp)
+    return room
+
+
+def get_scenarios():
+    """scenario name: function building its room"""
+    sources = get_sources()
+    one = [ONE_LAMP]
+    grid = [sources[i % len(sources)] for i in range(10)]
+
+    def fine_fluence():
+        room = get_room(one, enable_reflectance=False)
+        room.calc_zones["WholeRoomFluence"].set_spacing(0.05, 0.05, 0.05)
+        return room
+
+    scenarios = {
+        "one_lamp": lambda: get_room(one, enable_reflectance=False),
+        "grid_10": lambda: get_room(grid, enable_reflectance=False),
+    }
+    for passes in [1, 10, 100]:
+        scenarios[f"reflectance_{passes}"] = lambda passes=passes: get_room(
+            one, enable_reflectance=True, reflectance_max_num_passes=passes
+        )
+    scenarios["fine_fluence"] = fine_fluence
+    return scenarios
+
+
+def time_room(room):
+    """seconds taken by each operation on a freshly built room"""
+    operations = {
+        "calculate": room.calculate,
+        "check_lamps": lambda: check_compliance(room),
+        "export_zip": room.export_zip,
+        "disinfection_table": lambda: room.disinfection_table(
+            zone_id="WholeRoomFluence"
+        ),
+    }
+    times = {}
+    for name in OPERATIONS:
+        start = time.perf_counter()
+        operations[name]()
+        times[name] = time.perf_counter() - start
+    return times
+
+
+def run_benchmarks(names=None, repeat=3):
+    """a list of rows of timings, one per scenario and operation"""
+    scenarios = get_scenarios()
+    names = list(scenarios) if names is None else names
+    rows = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for name in names:
+            times = [time_room(scenarios[name]()) for _ in range(repeat)]
+            for operation in OPERATIONS:
+                samples = [t[operation] for t in times]
+                rows.append(
+                    {
+                        "scenario": name,
+                        "operation": operation,
+                        "min": min(samples),
+                        "median": float(np.median(samples)),
+                        "times": samples,
+                    }
+                )
+    return rows
+
+
+def get_environment():
+    """what the timings were taken on"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=IES_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "guv_calcs": guv_calcs.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+def compare(rows, baseline):
+    """rows with the baseline's median, and the ratio of this run's to it"""
+    medians = {(r["scenario"], r["operation"]): r["median"] for r in baseline}
+    compared = []
+    for row in rows:
+        base = medians.get((row["scenario"], row["operation"]))
+        compared.append(
+            {
+                "scenario": row["scenario"],
+                "operation": row["operation"],
+                "median": row["median"],
+                "baseline": base,
+                "ratio": None if not base else row["median"] / base,
+            }
+        )
+    return compared
+
+
+def format_rows(rows, columns):
+    """a plain text table"""
+    cells = [columns] + [
+        [f"{row[c]:.4f}" if isinstance(row[c], float) else str(row[c]) for c in columns]
+        for row in rows
+    ]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(line, widths))
+        for line in cells
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.benchmark",
+        description="Time calculations, compliance checks and exports of canonical rooms.",
+    )
+    parser.add_argument("-o", "--output", help="write the timings to this .json file")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="times to run each scenario (default 3)"
+    )
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        default=None,
+        choices=list(get_scenarios()),
+        help="scenarios to run; all by default",
+    )
+    parser.add_argument(
+        "--compare", help="a .json file from an earlier run to compare against"
+    )
+    args = parser.parse_args(argv)
+
+    rows = run_benchmarks(args.scenarios, max(1, args.repeat))
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())["results"]
+        columns = ["scenario", "operation", "median", "baseline", "ratio"]
+        print(format_rows(compare(rows, baseline), columns))
+    else:
+        print(format_rows(rows, ["scenario", "operation", "min", "median"]))
+    if args.output:
+        output = {"environment": get_environment(), "results": rows}
+        Path(args.output).write_text(json.dumps(output, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
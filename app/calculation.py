@@ -0,0 +1,538 @@
+"""Incremental calculation of a Room's lamp x calc zone grid."""
+
+import os
+import copyreg
+import warnings
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from photompy.ies import IESFile
+from guv_calcs.calc_manager import LampCacheEntry, ZoneCache, LightingCalculator
+from app.result_cache import RESULT_CACHE, result_key, filtered_key
+from app.retention import retain, is_held
+
+# number of worker processes used for the lamp x zone grid. 1 means serial
+NUM_WORKERS = int(os.environ.get("ILLUMINATE_CALC_WORKERS", 1))
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+# IESFile's attribute passthrough recurses when pickle probes for __setstate__,
+# so lamps can't be sent to worker processes without rebuilding it by hand
+copyreg.pickle(IESFile, lambda ies: (IESFile, (ies.source, ies.header, ies.photometry)))
+
+
+def get_stale_pairs(room):
+    """
+    return two lists of the (lamp_id, zone_id) pairs whose cached values are
+    out of date: those that need recalculating, because the lamp or the zone
+    has changed since they were last calculated, and those that only need
+    their filters (units, field of view and so on) applied again
+    """
+    valid_lamps = room.scene.get_valid_lamps()
+    recalc, update = [], []
+    for zone_id, zone in room.calc_zones.items():
+        if not zone.enabled:
+            continue
+        cache = zone.calculator.cache
+        for lamp_id, lamp in valid_lamps.items():
+            if cache.needs_recalc(zone.calc_state, lamp_id, lamp.calc_state):
+                recalc.append((lamp_id, zone_id))
+            elif cache.needs_update(zone.update_state, lamp_id, lamp.update_state):
+                update.append((lamp_id, zone_id))
+    return recalc, update
+
+
+def get_stale_zones(room):
+    """
+    return the ids of the enabled calc zones that need any work at all: a
+    stale lamp x zone pair, a lamp that was removed or disabled, or a change
+    to the reflectance settings
+    """
+    valid_lamps = room.scene.get_valid_lamps()
+    ref_dirty = _reflectance_is_stale(room)
+    zone_ids = []
+    for zone_id, zone in room.calc_zones.items():
+        if not zone.enabled:
+            continue
+        cache = zone.calculator.cache
+        if (
+            ref_dirty
+            or zone.values is None
+            or set(cache.lamp_cache.keys()) != set(valid_lamps.keys())
+            or any(_pair_is_stale(cache, zone, lamp) for lamp in valid_lamps.values())
+        ):
+            zone_ids.append(zone_id)
+    return zone_ids
+
+
+class CalculationCancelled(Exception):
+    """raised inside a calculation when its cancel event is set"""
+
+
+def calculate_room(
+    room, hard=False, workers=None, on_pair_done=None, on_zone_done=None, cancel=None
+):
+    """
+    Drop-in replacement for `Room.calculate()` that only recalculates the
+    calc zones with stale lamp x zone pairs, and within each of those zones
+    only the stale pairs. If `hard` is True, everything is recalculated.
+
+    `workers` is the number of processes to spread the stale pairs over;
+    defaults to NUM_WORKERS. Output is identical for any number of workers,
+    and to `Room.calculate()` but for sums over three or more lamps, which are
+    accumulated in float64 (see `aggregate_zone`) and may round differently.
+
+    Zones are finished one at a time. `on_pair_done(lamp_id, zone_id)` and
+    `on_zone_done(zone_id)` are called as pairs and zones are finished, and if
+    the `cancel` event is set the calculation stops at the next pair with
+    CalculationCancelled. Zones finished before that keep their new values,
+    but the room's calc state is only updated once every zone is done.
+    """
+    valid_lamps = room.scene.get_valid_lamps()
+    zones = {
+        zone_id: room.calc_zones[zone_id]
+        for zone_id in plan_calculation(room, hard=hard)[0]
+    }
+
+    # calculate incidence on the surfaces if the reflectances or lamps have changed
+    if room.recalculate_incidence or hard:
+        room.ref_manager.calculate_incidence(valid_lamps, hard=hard)
+
+    for zone_id, zone in zones.items():
+        _check_cancel(cancel)
+        calculate_zone(
+            zone,
+            valid_lamps,
+            ref_manager=room.ref_manager,
+            hard=hard,
+            workers=workers,
+            on_pair_done=on_pair_done,
+            cancel=cancel,
+        )
+        if on_zone_done is not None:
+            on_zone_done(zone_id)
+
+    # update calc states.
+    room.calc_state = room.get_calc_state()
+    room.update_state = room.get_update_state()
+
+    if len(valid_lamps) == 0:
+        msg = "No valid lamps are present in the room--either lamps have been disabled, or filedata has not been provided."
+        if len(room.lamps) == 0:
+            msg = "No lamps are present in the room."
+        warnings.warn(msg, stacklevel=2)
+
+    return room
+
+
+def calculate_by_id(room, zone_id, hard=False):
+    """drop-in replacement for `Room.calculate_by_id()`, through `calculate_zone`"""
+    valid_lamps = room.scene.get_valid_lamps()
+    if len(valid_lamps) > 0:
+        if room.recalculate_incidence or hard:
+            room.ref_manager.calculate_incidence(valid_lamps, hard=hard)
+        calculate_zone(
+            room.calc_zones[zone_id],
+            valid_lamps,
+            ref_manager=room.ref_manager,
+            hard=hard,
+        )
+        room.calc_state = room.get_calc_state()
+        room.update_state = room.get_update_state()
+    return room
+
+
+def plan_calculation(room, hard=False):
+    """
+    return the ids of the zones `calculate_room` will touch, and the
+    (lamp_id, zone_id) pairs within them that need ray work
+    """
+    valid_lamps = room.scene.get_valid_lamps()
+    zone_ids = list(room.calc_zones.keys()) if hard else get_stale_zones(room)
+    zone_ids = [zone_id for zone_id in zone_ids if room.calc_zones[zone_id].enabled]
+    pairs = []
+    for zone_id in zone_ids:
+        zone = room.calc_zones[zone_id]
+        cache = zone.calculator.cache
+        for lamp_id, lamp in valid_lamps.items():
+            if hard or cache.needs_recalc(zone.calc_state, lamp_id, lamp.calc_state):
+                pairs.append((lamp_id, zone_id))
+    return zone_ids, pairs
+
+
+def calculate_zone(
+    zone,
+    lamps,
+    ref_manager=None,
+    hard=False,
+    workers=None,
+    on_pair_done=None,
+    cancel=None,
+):
+    """
+    calculate a single calc zone, reusing the cached values of every lamp
+    whose contribution to this zone is still current
+    """
+    if not zone.enabled:
+        return zone.get_values()
+
+    zv = zone.to_view()
+    cache = zone.calculator.cache
+    pairs = [
+        (lamp_id, zv.zone_id)
+        for lamp_id, lamp in lamps.items()
+        if hard or cache.needs_recalc(zv.calc_state, lamp_id, lamp.calc_state)
+    ]
+    results = calculate_pairs(
+        pairs,
+        lamps,
+        {zv.zone_id: zv},
+        workers=workers,
+        hard=hard,
+        on_pair_done=on_pair_done,
+        cancel=cancel,
+    )
+    base_values = {lamp_id: values for (lamp_id, _), values in results.items()}
+    merge_zone(zone, zv, lamps, base_values)
+
+    if ref_manager is not None:
+        # calculate reflectance -- warning, may be expensive!
+        zone.result.reflected_values = ref_manager.calculate_reflectance(
+            zone.to_view(), hard=hard
+        )
+    return zone.get_values()
+
+
+def calculate_pairs(
+    pairs, lamps, views, workers=None, hard=False, on_pair_done=None, cancel=None
+):
+    """
+    calculate the base values of each (lamp_id, zone_id) pair, where `lamps`
+    and `views` map ids to Lamp and ZoneView objects. Returns a dict keyed
+    by pair.
+
+    Pairs already in the process-wide result cache are not recalculated
+    unless `hard` is True.
+    """
+    keys = {
+        (lamp_id, zone_id): result_key(lamps[lamp_id], views[zone_id])
+        for lamp_id, zone_id in pairs
+    }
+    results = {}
+    if not hard:
+        for pair, key in keys.items():
+            values = RESULT_CACHE.get(key)
+            if values is not None:
+                results[pair] = values
+                if on_pair_done is not None:
+                    on_pair_done(*pair)
+    todo = [pair for pair in pairs if pair not in results]
+
+    workers = NUM_WORKERS if workers is None else workers
+    if workers <= 1 or len(todo) <= 1:
+        for lamp_id, zone_id in todo:
+            _check_cancel(cancel)
+            values = calculate_lamp(lamps[lamp_id], views[zone_id])
+            results[(lamp_id, zone_id)] = RESULT_CACHE.put(
+                keys[(lamp_id, zone_id)], values
+            )
+            if on_pair_done is not None:
+                on_pair_done(lamp_id, zone_id)
+    else:
+        executor = get_executor(workers)
+        futures = {
+            executor.submit(calculate_lamp, lamps[lamp_id], views[zone_id]): (
+                lamp_id,
+                zone_id,
+            )
+            for lamp_id, zone_id in todo
+        }
+        try:
+            for future in as_completed(futures):
+                _check_cancel(cancel)
+                pair = futures[future]
+                results[pair] = RESULT_CACHE.put(keys[pair], future.result())
+                if on_pair_done is not None:
+                    on_pair_done(*pair)
+        except CalculationCancelled:
+            for future in futures:
+                future.cancel()
+            raise
+    return {pair: results[pair] for pair in pairs}
+
+
+def calculate_lamp(lamp, zv):
+    """the base values of a single lamp in a single zone. potentially expensive"""
+    return LightingCalculator().calculate_lamp(lamp, zv, hard=True)
+
+
+def get_executor(workers):
+    """return the shared process pool, (re)creating it if the worker count changed"""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False, cancel_futures=True)
+            # spawn rather than fork; the streamlit server is multithreaded
+            _executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _executor_workers = workers
+        return _executor
+
+
+def merge_zone(zone, zv, lamps, base_values):
+    """
+    write freshly calculated per-lamp base values into the zone's lamp cache,
+    reuse the cache entries of every other lamp, and re-sum the zone values.
+
+    `zv` must be the ZoneView the base values were calculated against.
+    """
+    calculator = zone.calculator
+    if len(lamps) == 0:
+        calculator.cache = ZoneCache()
+        zone.result.base_values = np.zeros(zv.num_points, dtype="float32")
+        return
+
+    old_cache = calculator.cache
+    lamp_cache = {}
+    for lamp_id, lamp in lamps.items():
+        entry = old_cache.lamp_cache.get(lamp_id)
+        if lamp_id in base_values:
+            base = base_values[lamp_id]
+        elif old_cache.needs_update(zv.update_state, lamp_id, lamp.update_state):
+            base = _resolve_entry(zone, entry, lamp, zv).base_values
+        else:
+            lamp_cache[lamp_id] = entry  # nothing has changed
+            continue
+        lamp_cache[lamp_id] = LampCacheEntry(
+            base_values=base,
+            values=filter_values(calculator, lamp, base, zv),
+            calc_state=lamp.calc_state,
+            update_state=lamp.update_state,
+        )
+
+    cache = ZoneCache(
+        lamp_cache=lamp_cache,
+        calc_state=zv.calc_state,
+        update_state=zv.update_state,
+    )
+    store_zone(zone, cache, lamps, zv)
+
+
+def store_zone(zone, cache, lamps, zv):
+    """
+    re-sum a zone's values from a new cache, then store the cache as the
+    zone's retention policy says
+    """
+    zone.calculator.cache = ZoneCache(
+        lamp_cache={
+            lamp_id: _resolve_entry(zone, cache.lamp_cache[lamp_id], lamp, zv)
+            for lamp_id, lamp in lamps.items()
+        },
+        calc_state=cache.calc_state,
+        update_state=cache.update_state,
+    )
+    zone.result.base_values = aggregate_zone(zone.calculator, lamps, zv)
+    zone.calculator.cache = retain(zone, cache)
+
+
+def get_lamp_entry(zone, lamp, zv=None):
+    """
+    the zone's lamp cache entry for a lamp, with arrays whatever the zone's
+    retention policy: unpacked if they were compressed, and recalculated
+    against the present lamp and zone if they were dropped. None if the zone
+    has no entry for the lamp
+    """
+    entry = zone.calculator.cache.lamp_cache.get(lamp.lamp_id)
+    if entry is None:
+        return None
+    return _resolve_entry(zone, entry, lamp, zv)
+
+
+@contextmanager
+def held_lamp_cache(room, zone_id):
+    """
+    hold a zone's per-lamp results as arrays for the duration of the block,
+    for guv-calcs code that reads the lamp cache itself, such as the efficacy
+    data. Dropped results of lamps no longer in the room are left out
+    """
+    zone = room.calc_zones[zone_id]
+    cache = zone.calculator.cache
+    lamp_cache = {}
+    for lamp_id, entry in cache.lamp_cache.items():
+        if is_held(entry) or entry.values is not None:
+            lamp_cache[lamp_id] = _resolve_entry(zone, entry, None)
+        elif lamp_id in room.lamps:
+            lamp_cache[lamp_id] = _resolve_entry(zone, entry, room.lamps[lamp_id])
+    zone.calculator.cache = ZoneCache(
+        lamp_cache=lamp_cache,
+        calc_state=cache.calc_state,
+        update_state=cache.update_state,
+    )
+    try:
+        yield zone
+    finally:
+        zone.calculator.cache = cache
+
+
+def _resolve_entry(zone, entry, lamp, zv=None):
+    if is_held(entry):
+        return entry
+    if entry.values is not None:
+        return LampCacheEntry(
+            base_values=entry.base_values.unpack(),
+            values=entry.values.unpack(),
+            calc_state=entry.calc_state,
+            update_state=entry.update_state,
+        )
+    zv = zone.to_view() if zv is None else zv
+    pair = (lamp.lamp_id, zv.zone_id)
+    base = calculate_pairs([pair], {lamp.lamp_id: lamp}, {zv.zone_id: zv}, workers=1)
+    return LampCacheEntry(
+        base_values=base[pair],
+        values=filter_values(zone.calculator, lamp, base[pair], zv),
+        calc_state=lamp.calc_state,
+        update_state=lamp.update_state,
+    )
+
+
+def filter_values(calculator, lamp, base, zv):
+    """
+    `calculator.apply_filters`, shared through the result cache if the base
+    values came from it. Base values that didn't, such as rescaled ones, are
+    filtered privately, so that only results calculated from scratch are
+    ever handed to other sessions
+    """
+    if base.flags.writeable:
+        return calculator.apply_filters(lamp, base.copy(), zv)
+    key = filtered_key(lamp, zv)
+    values = RESULT_CACHE.get(key)
+    if values is None:
+        values = RESULT_CACHE.put(key, calculator.apply_filters(lamp, base.copy(), zv))
+    return values
+
+
+def aggregate_zone(calculator, lamps, zv):
+    """
+    `calculator.aggregate`, but with a plain sum over lamps accumulated in
+    float64 before it is stored in float32. Points masked for any lamp, such
+    as one the lamp sits on, stay masked in the sum
+    """
+    if zv.is_plane() and zv.fov_horiz < 360 and len(lamps) > 1:
+        return calculator.aggregate(lamps, zv)
+    lamp_values = [calculator.cache.values(lamp_id) for lamp_id in lamps.keys()]
+    if any(isinstance(values, np.ma.MaskedArray) for values in lamp_values):
+        total = np.ma.zeros(zv.num_points, dtype="float64")
+    else:
+        total = np.zeros(zv.num_points, dtype="float64")
+    for values in lamp_values:
+        total += values
+    return total.astype("float32")
+
+
+def rescale_lamp(room, lamp, old_calc_state):
+    """
+    Rescale a lamp's cached contribution to every calc zone after its scaling
+    alone has changed (`lamp.scale`, `scale_to_total` and so on), rather than
+    recalculating it. `old_calc_state` is the lamp's calc state from before
+    the scaling was applied.
+
+    Zone values are re-summed in place for every zone that is otherwise up to
+    date. Dropped results (see `app.retention`) are only restamped, and are
+    recalculated at the new scaling when the zone is re-summed.
+    Interreflections are not per-lamp, so if any surface reflects, the cache
+    is left alone and the lamp must be recalculated as usual.
+
+    Returns True if the lamp's results were rescaled.
+    """
+    new_calc_state = lamp.calc_state
+    valid_lamps = room.scene.get_valid_lamps()
+    ref_manager = room.ref_manager
+    if (
+        lamp.lamp_id not in valid_lamps
+        or old_calc_state[1:-1] != new_calc_state[1:-1]  # more than scaling changed
+        or old_calc_state[-1] == 0
+        or (ref_manager.enabled and any(ref_manager.reflectances.values()))
+    ):
+        return False
+    ratio = new_calc_state[-1] / old_calc_state[-1]
+
+    for zone in room.calc_zones.values():
+        cache = zone.calculator.cache
+        entry = cache.lamp_cache.get(lamp.lamp_id)
+        if (
+            entry is None
+            or entry.calc_state != old_calc_state
+            or cache.calc_state != zone.calc_state
+        ):
+            continue  # this pair is stale regardless
+        lamp_cache = dict(cache.lamp_cache)
+        if entry.values is None:
+            lamp_cache[lamp.lamp_id] = LampCacheEntry(
+                base_values=None,
+                values=None,
+                calc_state=new_calc_state,
+                update_state=entry.update_state,
+            )
+        else:
+            entry = _resolve_entry(zone, entry, lamp)
+            lamp_cache[lamp.lamp_id] = LampCacheEntry(
+                base_values=entry.base_values * ratio,
+                values=entry.values * ratio,
+                calc_state=new_calc_state,
+                update_state=entry.update_state,
+            )
+        zone.calculator.cache = retain(
+            zone,
+            ZoneCache(
+                lamp_cache=lamp_cache,
+                calc_state=cache.calc_state,
+                update_state=cache.update_state,
+            ),
+        )
+        if (
+            zone.enabled
+            and zone.values is not None
+            and set(lamp_cache.keys()) == set(valid_lamps.keys())
+            and not any(
+                _pair_is_stale(zone.calculator.cache, zone, other)
+                for other in valid_lamps.values()
+            )
+        ):
+            zv = zone.to_view()
+            store_zone(zone, zone.calculator.cache, valid_lamps, zv)
+
+    # the room is as up to date for this lamp as it was before
+    if room.calc_state.get("lamps", {}).get(lamp.lamp_id) == old_calc_state:
+        lamps = dict(room.calc_state["lamps"])
+        lamps[lamp.lamp_id] = new_calc_state
+        room.calc_state = {**room.calc_state, "lamps": lamps}
+    return True
+
+
+def _check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise CalculationCancelled
+
+
+def _pair_is_stale(cache, zone, lamp):
+    """true if this lamp's contribution to the zone needs recalculating or updating"""
+    return cache.needs_recalc(
+        zone.calc_state, lamp.lamp_id, lamp.calc_state
+    ) or cache.needs_update(zone.update_state, lamp.lamp_id, lamp.update_state)
+
+
+def _reflectance_is_stale(room):
+    """true if the reflected contribution to every zone is out of date"""
+    REF_RECALC = room.calc_state.get("reflectance") != room.ref_manager.calc_state
+    REF_UPDATE = room.update_state.get("reflectance") != room.get_update_state().get(
+        "reflectance"
+    )
+    if REF_RECALC or REF_UPDATE:
+        return True
+    return room.ref_manager.enabled and room.recalculate_incidence
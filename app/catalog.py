@@ -0,0 +1,115 @@
+"""The catalog of characterized lamps on reports.osluv.org."""
+
+import os
+import json
+import time
+import logging
+import threading
+import requests
+from app.fetch import fetch
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = "https://reports.osluv.org/static/assay"
+INDEX_PATH = "./data/index_data.json"
+
+# seconds before the online index is fetched again
+TTL = float(os.environ.get("ILLUMINATE_CATALOG_TTL", 3600))
+
+_catalogs = {}  # online: Catalog
+_lock = threading.Lock()
+
+
+class Catalog:
+    """an immutable, indexed copy of the lamp index"""
+
+    def __init__(self, index_data, source=None, version=None):
+        self.index = index_data
+        self.source = source
+        self.version = version  # mtime of the local file, if any
+        self.loaded_at = time.monotonic()
+
+        self.by_guid = dict(index_data)
+        self.by_slug = {}
+        self.by_name = {}
+        self.ies_files = {}
+        self.spectra = {}
+        self.reports = {}
+        for guid, data in index_data.items():
+            self.by_slug[data["slug"]] = data
+            self.by_name.setdefault(data["reporting_name"], []).append(data)
+
+            filename = data["slug"]
+            name = data["reporting_name"]
+            if data.get("sketch", False):
+                name += " (PREVIEW)"
+            self.ies_files[name] = f"{BASE_URL}/{filename}.ies"
+            self.spectra[name] = f"{BASE_URL}/{filename}-spectrum.csv"
+            self.reports[name] = f"{BASE_URL}/{filename}.html"
+
+    def __repr__(self):
+        return f"Catalog(source={self.source}, lamps={len(self.index)})"
+
+    def __len__(self):
+        return len(self.index)
+
+    @classmethod
+    def from_file(cls, path=INDEX_PATH):
+        version = os.stat(path).st_mtime_ns
+        with open(path, "r") as j:
+            index_data = json.loads(j.read())
+        return cls(index_data, source=path, version=version)
+
+    @classmethod
+    def from_url(cls, url=f"{BASE_URL}/index.json"):
+        # always revalidate; the TTL already decides how often this is called
+        return cls(json.loads(fetch(url, max_age=0)), source=url)
+
+    def defaults(self, name):
+        """all index entries with this reporting name"""
+        return self.by_name.get(name, [])
+
+
+def get_catalog(online=False):
+    """
+    return the current catalog, first refreshing it if the local index file
+    has changed, or if the online index is older than TTL
+    """
+    catalog = _catalogs.get(online)
+    if catalog is not None and not _is_stale(catalog, online):
+        return catalog
+    with _lock:
+        catalog = _catalogs.get(online)  # may have been refreshed meanwhile
+        if catalog is None or _is_stale(catalog, online):
+            catalog = _load(online, old=catalog)
+            _catalogs[online] = catalog
+    return catalog
+
+
+def _load(online, old=None):
+    start = time.perf_counter()
+    try:
+        catalog = Catalog.from_url() if online else Catalog.from_file()
+    except (requests.RequestException, ValueError) as e:
+        if old is None:
+            raise
+        # keep serving the last good index rather than failing every session,
+        # as a new catalog, so that it isn't retried until the file changes
+        # again or the TTL is up
+        logger.warning(f"Could not refresh the lamp catalog, keeping the old one: {e}")
+        version = None if online else os.stat(old.source).st_mtime_ns
+        return Catalog(old.index, source=old.source, version=version)
+    logger.info(
+        f"Loaded lamp catalog of {len(catalog)} lamps from {catalog.source} "
+        f"in {time.perf_counter() - start:.3f} s"
+    )
+    return catalog
+
+
+def _is_stale(catalog, online):
+    if online:
+        return time.monotonic() - catalog.loaded_at > TTL
+    try:
+        return os.stat(catalog.source).st_mtime_ns != catalog.version
+    except OSError:
+        return False
@@ -0,0 +1,196 @@
+"""Photobiological safety compliance of a Room's luminaires."""
+
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.calculation import get_lamp_entry
+from app.refinement import refine_plane
+
+# dose, in mJ/cm2 weighted, that may not be exceeded over 8 hours
+WEIGHTED_LIMIT = 3
+
+MAX_ENTRIES = 64
+
+_results = OrderedDict()
+_tlvs = {}
+_lock = threading.Lock()
+
+
+class ComplianceResult:
+    """
+    the weighted skin and eye dose of an installation, and the dimming each
+    lamp would need to comply on its own
+
+    skin_dims and eye_dims are the fraction of its present power each lamp
+    may be run at; values above 1 mean no dimming is needed.
+    """
+
+    def __init__(self, lamp_ids, skin_dose, eye_dose, skin_tlvs, eye_tlvs):
+        self.lamp_ids = lamp_ids
+        self.skin_tlvs = skin_tlvs
+        self.eye_tlvs = eye_tlvs
+
+        skin_weighted = skin_dose * _along_lamps(WEIGHTED_LIMIT / skin_tlvs, skin_dose)
+        eye_weighted = eye_dose * _along_lamps(WEIGHTED_LIMIT / eye_tlvs, eye_dose)
+
+        self.skin_dims = skin_tlvs / _lampwise_max(skin_dose)
+        self.eye_dims = eye_tlvs / _lampwise_max(eye_dose)
+        total_dims = np.minimum(np.minimum(self.skin_dims, self.eye_dims), 1)
+
+        self.weighted_skin_dose = skin_weighted.sum(axis=0)
+        self.weighted_eye_dose = eye_weighted.sum(axis=0)
+        self.dimmed_weighted_skin_dose = (
+            skin_weighted * _along_lamps(total_dims, skin_dose)
+        ).sum(axis=0)
+        self.dimmed_weighted_eye_dose = (
+            eye_weighted * _along_lamps(total_dims, eye_dose)
+        ).sum(axis=0)
+
+        self.dimming_not_required = bool(
+            np.all(self.skin_dims > 1) and np.all(self.eye_dims > 1)
+        )
+        self.lamps_compliant = bool(
+            max(
+                self.weighted_skin_dose.max().round(2),
+                self.weighted_eye_dose.max().round(2),
+            )
+            <= WEIGHTED_LIMIT
+        )
+        self.dimmed_lamps_compliant = bool(
+            max(
+                self.dimmed_weighted_skin_dose.max().round(2),
+                self.dimmed_weighted_eye_dose.max().round(2),
+            )
+            <= WEIGHTED_LIMIT
+        )
+
+    def __repr__(self):
+        return (
+            f"ComplianceResult(lamps={len(self.lamp_ids)}, "
+            f"compliant={self.lamps_compliant}, "
+            f"dimmed_compliant={self.dimmed_lamps_compliant})"
+        )
+
+    def lamp_dims(self):
+        """dict of lamp_id: (skin_dim, eye_dim)"""
+        return {
+            lamp_id: (float(skin_dim), float(eye_dim))
+            for lamp_id, skin_dim, eye_dim in zip(
+                self.lamp_ids, self.skin_dims, self.eye_dims
+            )
+        }
+
+
+def check_compliance(room, refine=False):
+    """
+    assess the SkinLimits and EyeLimits zones of a calculated room. Only
+    lamps with a current contribution to both zones are considered.
+
+    If `refine` is True, the weighted dose maxima are refined off the regular
+    grid, and the dose arrays are flattened to (lamps x points).
+    """
+    skin = room.calc_zones["SkinLimits"]
+    eye = room.calc_zones["EyeLimits"]
+    skin_cache = skin.calculator.cache.lamp_cache
+    eye_cache = eye.calculator.cache.lamp_cache
+
+    lamp_ids, entries, tlvs = [], [], []
+    for lamp_id, lamp in room.lamps.items():
+        if lamp_id not in skin_cache or lamp_id not in eye_cache:
+            continue
+        skin_tlv, eye_tlv = get_lamp_tlvs(lamp, room.standard)
+        if skin_tlv is None or eye_tlv is None:
+            continue
+        lamp_ids.append(lamp_id)
+        entries.append((skin_cache[lamp_id], eye_cache[lamp_id]))
+        tlvs.append((skin_tlv, eye_tlv))
+
+    # entries are immutable and replaced on any change, so their identity
+    # stands in for the lamp and zone states. they are kept alive by the
+    # memo, so ids can't be reused while the key is stored
+    key = (
+        tuple(lamp_ids),
+        tuple((id(s), id(e)) for s, e in entries),
+        tuple(tlvs),
+        skin.hours,
+        eye.hours,
+        skin.get_values().shape,
+        eye.get_values().shape,
+        refine,
+    )
+    with _lock:
+        if key in _results:
+            _results.move_to_end(key)
+            return _results[key][1]
+
+    skin_tlvs = np.array([skin_tlv for skin_tlv, _ in tlvs], dtype="float64")
+    eye_tlvs = np.array([eye_tlv for _, eye_tlv in tlvs], dtype="float64")
+    if len(lamp_ids) > 0:
+        skin_irradiance = np.stack(
+            [get_lamp_entry(skin, room.lamps[lamp_id]).values for lamp_id in lamp_ids]
+        )
+        eye_irradiance = np.stack(
+            [get_lamp_entry(eye, room.lamps[lamp_id]).values for lamp_id in lamp_ids]
+        )
+        if refine:
+            lamps = {lamp_id: room.lamps[lamp_id] for lamp_id in lamp_ids}
+            skin_irradiance = _add_refined_points(
+                skin, lamps, skin_irradiance, skin_tlvs
+            )
+            eye_irradiance = _add_refined_points(eye, lamps, eye_irradiance, eye_tlvs)
+        skin_dose = skin_irradiance * 3.6 * skin.hours
+        eye_dose = eye_irradiance * 3.6 * eye.hours
+    else:
+        skin_dose = np.zeros((0,) + skin.get_values().shape)
+        eye_dose = np.zeros((0,) + eye.get_values().shape)
+    result = ComplianceResult(lamp_ids, skin_dose, eye_dose, skin_tlvs, eye_tlvs)
+
+    with _lock:
+        _results[key] = (entries, result)
+        while len(_results) > MAX_ENTRIES:
+            _results.popitem(last=False)
+    return result
+
+
+def get_lamp_tlvs(lamp, standard):
+    """`lamp.get_tlvs(standard)`, memoized on the spectrum's content"""
+    if lamp.spectra is not None:
+        digest = hashlib.sha1()
+        digest.update(np.asarray(lamp.spectra.wavelengths).tobytes())
+        digest.update(np.asarray(lamp.spectra.intensities).tobytes())
+        key = (standard, "spectra", digest.hexdigest())
+    elif lamp.wavelength is not None:
+        key = (standard, "wavelength", lamp.wavelength)
+    else:
+        return None, None
+    with _lock:
+        if key in _tlvs:
+            return _tlvs[key]
+    tlvs = lamp.get_tlvs(standard)
+    with _lock:
+        _tlvs[key] = tlvs
+    return tlvs
+
+
+def _add_refined_points(zone, lamps, irradiance, tlvs):
+    """
+    flatten a (lamps x grid) irradiance array and append each lamp's values at
+    the points added by refining the zone's weighted dose maximum
+    """
+    weights = dict(zip(lamps, WEIGHTED_LIMIT / tlvs))
+    refinement = refine_plane(zone, lamps, weights=weights)
+    flat = irradiance.reshape(irradiance.shape[0], -1)
+    return np.concatenate([flat, refinement.values], axis=1)
+
+
+def _lampwise_max(dose):
+    """the maximum of each lamp's dose array"""
+    if dose.shape[0] == 0:
+        return np.zeros(0)
+    return dose.reshape(dose.shape[0], -1).max(axis=1)
+
+
+def _along_lamps(per_lamp, dose):
+    """reshape a per-lamp vector to broadcast against a (lamps x ...) array"""
+    return per_lamp.reshape((-1,) + (1,) * (dose.ndim - 1))
@@ -0,0 +1,205 @@
+"""Cached fetching of lamp assets from reports.osluv.org."""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(
+    os.environ.get(
+        "ILLUMINATE_ASSET_CACHE", Path.home() / ".cache" / "illuminate" / "assets"
+    )
+)
+# seconds a cached asset is served without revalidating it
+MAX_AGE = float(os.environ.get("ILLUMINATE_ASSET_MAX_AGE", 300))
+# bytes of cached assets kept on disk
+MAX_BYTES = int(float(os.environ.get("ILLUMINATE_ASSET_CACHE_MB", 256)) * 1024**2)
+# (connect, read) timeouts in seconds
+TIMEOUT = (3.05, 15)
+POOL_SIZE = 16
+PREFETCH_WORKERS = 8
+
+_session = None
+_session_lock = threading.Lock()
+_prefetch_started = False
+
+# requests by how they were served: fresh or revalidated from the cache,
+# downloaded, or served stale because the server couldn't be reached
+_counts = {"fresh": 0, "revalidated": 0, "downloaded": 0, "stale": 0}
+_counts_lock = threading.Lock()
+
+
+def get_session():
+    """the shared, pooled http session"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                retries = Retry(
+                    total=2,
+                    backoff_factor=0.3,
+                    status_forcelist=[502, 503, 504],
+                    allowed_methods=["GET", "HEAD"],
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_SIZE,
+                    pool_maxsize=POOL_SIZE,
+                    max_retries=retries,
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def fetch(url, max_age=None, cache_dir=None):
+    """
+    return the content of `url` as bytes, from the disk cache if it is fresh,
+    revalidating or downloading it otherwise
+    """
+    max_age = MAX_AGE if max_age is None else max_age
+    body_path, meta_path = _cache_paths(url, cache_dir)
+    meta = _read_meta(meta_path) if body_path.exists() else None
+
+    if meta is not None and time.time() - meta.get("checked", 0) < max_age:
+        _count("fresh")
+        return body_path.read_bytes()
+
+    headers = {}
+    if meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = get_session().get(url, headers=headers, timeout=TIMEOUT)
+        if response.status_code == 304 and meta is not None:
+            meta["checked"] = time.time()
+            _write(meta_path, json.dumps(meta).encode())
+            _count("revalidated")
+            return body_path.read_bytes()
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if meta is not None:
+            logger.warning(f"Could not revalidate {url}, serving cached copy: {e}")
+            _count("stale")
+            return body_path.read_bytes()
+        raise
+
+    content = response.content
+    _write(body_path, content)
+    meta = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "checked": time.time(),
+    }
+    _write(meta_path, json.dumps(meta).encode())
+    _count("downloaded")
+    prune(cache_dir)
+    return content
+
+
+def prefetch(urls, max_workers=PREFETCH_WORKERS, cache_dir=None):
+    """
+    fetch many urls concurrently into the disk cache. returns a dict of
+    url: True if it is now cached, False if it could not be fetched
+    """
+    urls = list(dict.fromkeys(urls))
+
+    def _fetch(url):
+        try:
+            fetch(url, cache_dir=cache_dir)
+            return True
+        except (requests.RequestException, OSError) as e:
+            logger.warning(f"Could not prefetch {url}: {e}")
+            return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(zip(urls, executor.map(_fetch, urls)))
+    logger.info(
+        f"Prefetched {sum(results.values())} of {len(urls)} assets "
+        f"in {time.perf_counter() - start:.2f} s"
+    )
+    return results
+
+
+def start_prefetch(urls):
+    """prefetch in a background thread, once per process"""
+    global _prefetch_started
+    with _session_lock:
+        if _prefetch_started:
+            return
+        _prefetch_started = True
+    thread = threading.Thread(
+        target=prefetch, args=(list(urls),), name="illuminate-prefetch", daemon=True
+    )
+    thread.start()
+
+
+def prune(cache_dir=None, max_bytes=None):
+    """remove the assets checked least recently until the cache fits in `max_bytes`"""
+    cache_dir = CACHE_DIR if cache_dir is None else Path(cache_dir)
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for body_path in cache_dir.glob("*.body"):
+        meta_path = body_path.with_suffix(".json")
+        try:
+            checked = meta_path.stat().st_mtime
+            entries.append((checked, body_path.stat().st_size, body_path, meta_path))
+        except OSError:
+            continue  # removed by another thread
+    total = sum(size for _, size, _, _ in entries)
+    for _, size, body_path, meta_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        meta_path.unlink(missing_ok=True)
+        body_path.unlink(missing_ok=True)
+        total -= size
+
+
+def get_stats():
+    """counters for monitoring"""
+    with _counts_lock:
+        counts = dict(_counts)
+    total = sum(counts.values())
+    hits = counts["fresh"] + counts["revalidated"]
+    return {**counts, "hit_rate": hits / total if total else 0.0}
+
+
+def _count(how):
+    with _counts_lock:
+        _counts[how] += 1
+
+
+def _cache_paths(url, cache_dir=None):
+    cache_dir = CACHE_DIR if cache_dir is None else Path(cache_dir)
+    digest = hashlib.sha256(url.encode()).hexdigest()
+    return cache_dir / f"{digest}.body", cache_dir / f"{digest}.json"
+
+
+def _read_meta(path):
+    try:
+        return json.loads(path.read_bytes())
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, data):
+    """write atomically, so concurrent readers never see a partial file"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
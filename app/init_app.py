@@ -2,10 +2,15 @@ import streamlit as st
 import requests
 import matplotlib.pyplot as plt
 import plotly.graph_objs as go
-from guv_calcs import Room
+from guv_calcs import Room, Spectrum
+from photompy.ies import IESFile
 from app.lamp_utils import add_new_lamp, get_ies_files, get_defaults
+from app.lamp_library import get_library
+from app.fetch import start_prefetch
 from app.top_ribbon import calculate
 from app.widget import initialize_zone
+from app.uploads import UploadIndex
+from app.perf import span
 
 SELECT_LOCAL = "Select local file..."
 ss = st.session_state
@@ -20,15 +25,26 @@ def initialize():
     ss.show_room = True  # show the room plot once on load
     ss.error_message = None  # dynamic holder
     ss.warning_message = None
+    ss.calc_job = None  # background calculation in progress, if any
+    ss.profile_next = None  # what to profile next, with ?profile=1
+    ss.profile = None  # the last profile's files
 
     ss.selected_lamp_id = None  # no lamp initially selected
     ss.selected_zone_id = None  # no zone initially selected
-    ss.uploaded_files = {}
-    ss.uploaded_spectras = {}
+    # filename to digest in the process-wide upload store
+    ss.uploaded_files = UploadIndex(IESFile.read)
+    ss.uploaded_spectras = UploadIndex(Spectrum.from_file)
 
     # load lamp list
     ss.vendored_lamps, ss.vendored_spectra, ss.reports = get_ies_files()
     ss.lamp_options = [None] + list(ss.vendored_lamps.keys()) + [SELECT_LOCAL]
+    if ss.online:
+        # warm the asset cache, if no session has yet
+        start_prefetch(
+            list(ss.vendored_lamps.values()) + list(ss.vendored_spectra.values())
+        )
+    else:
+        get_library()  # parse the vendored lamps, if no session has yet
 
     # initialize figures
     ss.fig = go.Figure()
@@ -83,6 +99,7 @@ def is_internet_available(timeout=1):
         return False
 
 
+@span("room_plot")
 def room_plot():
     if ss.selected_lamp_id:
         select_id = ss.selected_lamp_id
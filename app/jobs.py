@@ -0,0 +1,335 @@
+"""Background calculation jobs."""
+
+import os
+import math
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from guv_calcs.calc_manager import LampCacheEntry, ZoneCache
+from app.calculation import (
+    calculate_room,
+    plan_calculation,
+    get_lamp_entry,
+    CalculationCancelled,
+)
+from app.retention import retain
+from app.memory import copy_room
+from app.perf import span
+
+# number of calculations that may run at the same time, across all sessions
+NUM_THREADS = int(os.environ.get("ILLUMINATE_CALC_THREADS", 2))
+
+# fractions of each zone's points per axis at which preview passes are run
+# before the full calculation, coarsest first. one coarse pass by default, so
+# that results show up quickly; empty for none
+PREVIEW_PASSES = [
+    float(fraction)
+    for fraction in os.environ.get("ILLUMINATE_PREVIEW_PASSES", "0.25").split(",")
+    if fraction.strip()
+]
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+_executor = ThreadPoolExecutor(
+    max_workers=NUM_THREADS, thread_name_prefix="illuminate-calc"
+)
+
+# jobs submitted and not yet collected, for monitoring. a queued or running
+# job is held by the pool until it is done
+_jobs = weakref.WeakSet()
+_jobs_lock = threading.Lock()
+_submitted = 0
+
+# zone caches published by preview passes, by id. zones aren't hashable, and
+# a cache replaced by any later calculation drops out by itself
+_previews = weakref.WeakValueDictionary()
+
+
+class CalcJob:
+    """a calculation of a snapshot of a room, running in the background"""
+
+    def __init__(self, room, hard=False, workers=None, passes=None):
+        self.room = copy_room(room)
+        self.hard = hard
+        self.workers = workers
+        zone_ids, pairs = plan_calculation(self.room, hard=hard)
+        self.zone_ids = zone_ids
+        self.zones_total = len(zone_ids)
+        self.pairs_total = len(pairs)
+        self.zones_done = []
+        self.pairs_done = 0
+        self.status = QUEUED
+        self.error = None
+        self._cancel = threading.Event()
+        self._published = set()
+        self._future = None
+
+        # preview passes, coarsest first; none if there is nothing to calculate
+        passes = PREVIEW_PASSES if passes is None else passes
+        self.previews = []
+        if len(pairs) > 0:
+            for fraction in sorted(set(f for f in passes if 0 < f < 1)):
+                preview = get_preview_room(self.room, zone_ids, fraction)
+                self.pairs_total += len(plan_calculation(preview, hard=hard)[1])
+                self.previews.append(preview)
+        self.previews_done = []  # (pass index, zone_id)
+        self.preview = len(self.previews) > 0
+
+    def __repr__(self):
+        return (
+            f"CalcJob(status={self.status}, "
+            f"zones={len(self.zones_done)}/{self.zones_total}, "
+            f"pairs={self.pairs_done}/{self.pairs_total})"
+        )
+
+    @property
+    def finished(self):
+        return self.status in [DONE, CANCELLED, FAILED]
+
+    @property
+    def progress(self):
+        """fraction of the work done, between 0 and 1"""
+        if self.pairs_total > 0:
+            return self.pairs_done / self.pairs_total
+        if self.zones_total > 0:
+            return len(self.zones_done) / self.zones_total
+        return 1.0 if self.finished else 0.0
+
+    def submit(self):
+        """queue the job on the shared thread pool"""
+        global _submitted
+        with _jobs_lock:
+            _jobs.add(self)
+            _submitted += 1
+        self._future = _executor.submit(span("calculation")(self.run))
+        return self
+
+    def run(self):
+        """calculate the room copy. called on a worker thread"""
+        if self._cancel.is_set():
+            self.status = CANCELLED
+            return
+        self.status = RUNNING
+        try:
+            for i, preview in enumerate(self.previews):
+                calculate_room(
+                    preview,
+                    hard=self.hard,
+                    workers=self.workers,
+                    on_pair_done=self._pair_done,
+                    on_zone_done=lambda zone_id, i=i: self.previews_done.append(
+                        (i, zone_id)
+                    ),
+                    cancel=self._cancel,
+                )
+            self.preview = False
+            calculate_room(
+                self.room,
+                hard=self.hard,
+                workers=self.workers,
+                on_pair_done=self._pair_done,
+                on_zone_done=self._zone_done,
+                cancel=self._cancel,
+            )
+        except CalculationCancelled:
+            self.status = CANCELLED
+        except Exception as e:
+            self.error = e
+            self.status = FAILED
+        else:
+            self.status = DONE
+
+    def cancel(self):
+        """stop the job at the next lamp x zone pair"""
+        self._cancel.set()
+        if self._future is not None and self._future.cancel():
+            self.status = CANCELLED
+
+    def wait(self, timeout=None):
+        """block until the job is finished"""
+        if self._future is not None:
+            self._future.exception(timeout=timeout)
+        return self
+
+    def publish(self, room):
+        """
+        copy zones finished since the last call into `room`, and once the whole
+        job is done, the reflectance incidence and the room calc state.
+        Returns the ids of the zones that were copied.
+
+        Zones finished by a preview pass are interpolated onto the zone's own
+        grid and copied over, unless a finer result has already been copied.
+        """
+        published = []
+        zones_done = list(self.zones_done)
+        for i, zone_id in list(self.previews_done):
+            if zone_id in zones_done or any(
+                (j, zone_id) in self._published for j in range(i, len(self.previews))
+            ):
+                continue  # superseded
+            self._published.add((i, zone_id))
+            if self._publish_preview(room, self.previews[i], zone_id):
+                published.append(zone_id)
+
+        for zone_id in zones_done:
+            if zone_id in self._published:
+                continue
+            self._published.add(zone_id)
+            src = self.room.calc_zones[zone_id]
+            dst = room.calc_zones.get(zone_id)
+            if (
+                dst is None
+                or dst.calc_state != src.calc_state
+                or dst.update_state != src.update_state
+            ):
+                continue  # zone was edited or removed in the meantime
+            dst.calculator.cache = src.calculator.cache
+            dst.result.base_values = src.result.base_values
+            dst.result.reflected_values = src.result.reflected_values
+            published.append(zone_id)
+
+        if self.status == DONE and DONE not in self._published:
+            self._published.add(DONE)
+            self._publish_reflectance(room)
+            room.calc_state = self.room.calc_state
+            room.update_state = self.room.update_state
+        return published
+
+    def _publish_preview(self, room, preview, zone_id):
+        """interpolate a zone finished by a preview pass into the live room"""
+        src = preview.calc_zones[zone_id]
+        full = self.room.calc_zones[zone_id]
+        dst = room.calc_zones.get(zone_id)
+        if (
+            dst is None
+            or dst.calc_state != full.calc_state
+            or dst.update_state != full.update_state
+        ):
+            return False  # zone was edited or removed in the meantime
+        coarse, fine = src.geometry, full.geometry
+        cache = src.calculator.cache
+        lamps = preview.scene.get_valid_lamps()
+        lamp_cache = {}
+        for lamp_id in cache.lamp_cache:
+            entry = get_lamp_entry(src, lamps[lamp_id])
+            lamp_cache[lamp_id] = LampCacheEntry(
+                base_values=upsample(entry.base_values, coarse, fine).reshape(-1),
+                values=upsample(entry.values, coarse, fine),
+                calc_state=entry.calc_state,
+                update_state=entry.update_state,
+            )
+        # the coarse calc state never matches the zone, so these are never
+        # taken for current results
+        dst.calculator.cache = retain(
+            dst,
+            ZoneCache(
+                lamp_cache=lamp_cache,
+                calc_state=cache.calc_state,
+                update_state=cache.update_state,
+            ),
+        )
+        dst.result.base_values = upsample(src.result.base_values, coarse, fine)
+        reflected = src.result.reflected_values
+        dst.result.reflected_values = (
+            None if reflected is None else upsample(reflected, coarse, fine)
+        )
+        _previews[id(dst.calculator.cache)] = dst.calculator.cache
+        return True
+
+    def _publish_reflectance(self, room):
+        """copy surface incidence over, if the reflectance settings are unchanged"""
+        src = self.room.ref_manager
+        dst = room.ref_manager
+        if (
+            src.calc_state != dst.calc_state
+            or src.reflectances != dst.reflectances
+            or src.keys != dst.keys
+        ):
+            return
+        for wall, surface in dst.surfaces.items():
+            surface.plane = src.surfaces[wall].plane
+            surface.zone_dict = src.surfaces[wall].zone_dict
+        dst.zone_dict = src.zone_dict
+
+    def _pair_done(self, lamp_id, zone_id):
+        self.pairs_done += 1
+
+    def _zone_done(self, zone_id):
+        self.zones_done.append(zone_id)
+
+
+def submit_calculation(room, hard=False, workers=None, passes=None):
+    """
+    start calculating a copy of `room` in the background and return the job.
+    `passes` are the preview fractions to run first; PREVIEW_PASSES by default
+    """
+    return CalcJob(room, hard=hard, workers=workers, passes=passes).submit()
+
+
+def get_stats():
+    """counters for monitoring"""
+    with _jobs_lock:
+        statuses = [job.status for job in _jobs]
+        submitted = _submitted
+    return {
+        "threads": NUM_THREADS,
+        "queued": statuses.count(QUEUED),
+        "running": statuses.count(RUNNING),
+        "submitted": submitted,
+    }
+
+
+def is_preliminary(zone):
+    """true if the zone's results come from a preview pass, and are still shown"""
+    cache = zone.calculator.cache
+    return zone.values is not None and _previews.get(id(cache)) is cache
+
+
+def get_preview_room(room, zone_ids, fraction):
+    """
+    a copy of `room` in which the given zones have `fraction` of their points
+    along each axis, though never fewer than 2
+    """
+    preview = copy_room(room)
+    for zone_id in zone_ids:
+        zone = preview.calc_zones[zone_id]
+        num_points = tuple(
+            n if n <= 2 else max(2, math.ceil(n * fraction)) for n in zone.num_points
+        )
+        # the spacing takes precedence over the number of points if it is set
+        zone.geometry = zone.geometry.update(spacing_init=None)
+        zone.set_num_points(*num_points)
+    return preview
+
+
+def upsample(values, coarse, fine):
+    """
+    interpolate values on a coarse grid onto a finer grid of the same extent,
+    extrapolating linearly beyond the outermost coarse points. Linear
+    interpolation is separable, so it is done one axis at a time
+    """
+    upsampled = np.asarray(values, dtype="float64").reshape(coarse.num_points)
+    for axis, (src, dst) in enumerate(zip(coarse.points, fine.points)):
+        weights = _interpolation_weights(np.asarray(src), np.asarray(dst))
+        upsampled = np.moveaxis(np.tensordot(weights, upsampled, (1, axis)), 0, axis)
+    upsampled = np.maximum(upsampled, 0)  # irradiance is never negative
+    return upsampled.reshape(fine.num_points).astype(values.dtype)
+
+
+def _interpolation_weights(src, dst):
+    """(dst x src) matrix of linear interpolation weights between 1d points"""
+    weights = np.zeros((len(dst), len(src)))
+    if len(src) == 1:
+        weights[:, 0] = 1
+        return weights
+    i = np.clip(np.searchsorted(src, dst) - 1, 0, len(src) - 2)
+    t = (dst - src[i]) / (src[i + 1] - src[i])
+    rows = np.arange(len(dst))
+    weights[rows, i] = 1 - t
+    weights[rows, i + 1] = t
+    return weights
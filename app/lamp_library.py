@@ -0,0 +1,89 @@
+"""In-process library of the vendored lamps."""
+
+import copy
+import time
+import logging
+import threading
+from guv_calcs import Lamp
+from app.catalog import get_catalog
+
+logger = logging.getLogger(__name__)
+
+_library = None
+_lock = threading.Lock()
+
+
+class LibraryLamp:
+    """the parsed data of a single vendored lamp. treat as read-only"""
+
+    def __init__(self, key):
+        lamp = Lamp.from_keyword(key)
+        self.key = key
+        self.ies = lamp._base_ies
+        self.spectra = lamp.spectra
+
+    def __repr__(self):
+        return f"LibraryLamp(key={self.key})"
+
+    def get_ies(self):
+        """a private copy of the photometry"""
+        return copy.deepcopy(self.ies)
+
+    def get_spectra(self):
+        """a private copy of the spectrum"""
+        return copy.deepcopy(self.spectra)
+
+
+class LampLibrary:
+    """
+    vendored lamps by the names of one version of the catalog. never modified.
+    lamps already parsed by an `old` library are reused
+    """
+
+    def __init__(self, lamp_keys, catalog, old=None):
+        start = time.perf_counter()
+        lamps = {}
+        self.names = {}
+        self.loaded_at = catalog.loaded_at
+        for name in catalog.ies_files.keys():
+            key = lamp_keys.get(name)
+            if key is None:
+                continue
+            if key not in lamps:
+                if old is not None and key in old.lamps:
+                    lamps[key] = old.lamps[key]
+                else:
+                    lamps[key] = LibraryLamp(key)
+            self.names[name] = lamps[key]
+        self.lamps = lamps
+        self.build_time = time.perf_counter() - start
+        logger.info(
+            f"Built lamp library of {len(self.lamps)} lamps "
+            f"({len(self.names)} catalog names) in {self.build_time:.2f} s"
+        )
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __getitem__(self, name):
+        return self.names[name]
+
+    def __len__(self):
+        return len(self.names)
+
+
+def get_library():
+    """
+    return the process-wide lamp library, building it on first use, and again
+    whenever the catalog is refreshed
+    """
+    global _library
+    catalog = get_catalog(online=False)
+    if _library is None or _library.loaded_at != catalog.loaded_at:
+        with _lock:
+            if _library is None or _library.loaded_at != catalog.loaded_at:
+                # imported here since lamp_utils imports this module
+                from app.lamp_utils import LAMP_KEYS
+
+                _library = LampLibrary(LAMP_KEYS, catalog, old=_library)
+    return _library
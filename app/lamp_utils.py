@@ -1,9 +1,12 @@
 import streamlit as st
 from pathlib import Path
-import requests
-import json
 import matplotlib.pyplot as plt
-from guv_calcs import Lamp, Spectrum, GUVType, new_lamp_position
+from guv_calcs import Lamp, GUVType, new_lamp_position
+from app.lamp_library import get_library
+from app.catalog import get_catalog
+from app.fetch import fetch
+from app.calculation import rescale_lamp
+from app.perf import span
 from app.widget import (
     set_val,
     initialize_lamp,
@@ -14,8 +17,6 @@ from app.widget import (
 ss = st.session_state
 SELECT_LOCAL = "Select local file..."
 
-BASE_URL = "https://reports.osluv.org/static/assay"
-
 LAMP_KEYS = {
     "Aerolamp DevKit": "aerolamp",
     "Beacon (PREVIEW)": "beacon",
@@ -79,6 +80,7 @@ def add_new_lamp(name=None, interactive=True, defaults={}):
         load_prepopulated_lamp(new_lamp, new_lamp.name)
 
 
+@span("load_lamp")
 def load_lamp(lamp):
     """update lamp filename from widget"""
     fname = set_val(f"file_{lamp.lamp_id}", lamp.filename)
@@ -90,9 +92,9 @@ def load_lamp(lamp):
     spectra_data = None
     if fname in ss.vendored_spectra.keys():
         load_prepopulated_lamp(lamp, fname)
-    elif fname in ss.uploaded_files.keys():
+    elif fname in ss.uploaded_files:
         # previously uploaded files
-        fdata = ss.uploaded_files[fname]
+        fdata = ss.uploaded_files.get_parsed(fname)
         _load_lamp(lamp, fname, fdata, spectra_data)
     # elif fname == SELECT_LOCAL:
     else:
@@ -102,17 +104,18 @@ def load_lamp(lamp):
 def load_prepopulated_lamp(lamp, fname):
     """load prepopulated lamp from osluv server"""
 
-    if ss.online:  # files from osluv server
-        fdata = requests.get(ss.vendored_lamps[fname]).content
-        spectra_data = requests.get(ss.vendored_spectra[fname]).content
-    else:  # get local files
-        temp_lamp = Lamp.from_keyword(LAMP_KEYS[fname])
-        fdata = temp_lamp.filedata
-        spectra_data = temp_lamp.spectra_source
+    if ss.online:  # files from osluv server, cached on disk
+        fdata = fetch(ss.vendored_lamps[fname])
+        spectra_data = fetch(ss.vendored_spectra[fname])
+    else:  # local files, parsed once per process
+        library_lamp = get_library()[fname]
+        fdata = library_lamp.get_ies()
+        spectra_data = library_lamp.get_spectra()
 
     _load_lamp(lamp, fname=fname, fdata=fdata, spectra_data=spectra_data)
 
 
+@span("load_lamp")
 def load_uploaded_lamp(lamp):
     """load the .ies file of a user-uploaded file"""
     uploaded_file = set_val(f"upload_{lamp.lamp_id}", None)
@@ -121,16 +124,15 @@ def load_uploaded_lamp(lamp):
         fname = uploaded_file.name
         lamp.name = fname
         ss[f"name_{lamp.lamp_id}"] = fname
-        if fname in ss.uploaded_files:
-            fdata = ss.uploaded_files[fname]
-        else:
-            fdata = uploaded_file.read()
-            # add the uploaded file to the session state
-            ss.uploaded_files[fname] = fdata
+        is_new = fname not in ss.uploaded_files
+        # add the uploaded file to the shared store; a different file of the
+        # same name replaces the old one
+        ss.uploaded_files.add(fname, uploaded_file.read())
+        if is_new:
             make_file_list()
         # load into lamp object
         lamp.filename = fname  # tmp
-        lamp.load_ies(fdata)
+        lamp.load_ies(ss.uploaded_files.get_parsed(fname))
         # load spectra if present
         load_uploaded_spectra(lamp)
         # harmonize units
@@ -164,15 +166,14 @@ def load_uploaded_spectra(lamp):
     """load the .csv file of a user-uploaded spectra"""
     # first check if we've loaded it already
     if lamp.filename in ss.uploaded_spectras:
-        spectra_data = ss.uploaded_spectras[lamp.filename]
+        spectra_data = ss.uploaded_spectras.get_parsed(lamp.filename)
     else:
         uploaded_spectra = set_val(f"spectra_upload_{lamp.lamp_id}", None)
         if uploaded_spectra is not None:
-            spectra_data = uploaded_spectra.read()
             try:
-                Spectrum.from_file(spectra_data)
                 # add to list if it can load successfully
-                ss.uploaded_spectras[lamp.filename] = spectra_data
+                ss.uploaded_spectras.add(lamp.filename, uploaded_spectra.read())
+                spectra_data = ss.uploaded_spectras.get_parsed(lamp.filename)
                 ss.warning_message = None
             except ValueError:  # if spectra cannot correctly load, set to zero
                 ss.warning_message = "Spectra file is not valid. Double check that it is a .csv with the first column corresponding to wavelengths, and the second column corresponding to relative intensities."
@@ -206,7 +207,7 @@ def _load_spectra(lamp, data=None):
 def make_file_list():
     """generate current list of lampfile options, both locally uploaded and from reports.osluv.org"""
     vendorfiles = list(ss.vendored_lamps.keys())
-    uploadfiles = list(ss.uploaded_files.keys())
+    uploadfiles = list(ss.uploaded_files)
     if ss.selected_lamp.guv_type == "krcl":
         ss.lamp_options = [None] + vendorfiles + uploadfiles + [SELECT_LOCAL]
     else:
@@ -224,41 +225,19 @@ def get_local_ies_files():
 
 def get_index():
     """get all the lamp data, either from the online page or locally"""
-    if ss.online:
-        index_data = requests.get(f"{BASE_URL}/index.json").json()
-    else:
-        with open("./data/index_data.json", "r") as j:
-            index_data = json.loads(j.read())
-    return index_data
+    return get_catalog(ss.online).index
 
 
 def get_defaults(name):
     """default properties of a lamp by name; position, tilt, etc"""
-    index_data = get_index()
-    vals = index_data.values()
-    return [x for x in vals if x["reporting_name"] == name]
+    return get_catalog(ss.online).defaults(name)
 
 
 def get_ies_files():
     """retrive ies files from osluv website"""
-
-    index_data = get_index()
-
-    ies_files = {}
-    spectra = {}
-    reports = {}
-
-    for guid, data in index_data.items():
-
-        filename = data["slug"]
-        name = data["reporting_name"]
-        if data.get("sketch", False):
-            name += " (PREVIEW)"
-        ies_files[name] = f"{BASE_URL}/{filename}.ies"
-        spectra[name] = f"{BASE_URL}/{filename}-spectrum.csv"
-        reports[name] = f"{BASE_URL}/{filename}.html"
-
-    return ies_files, spectra, reports
+    catalog = get_catalog(ss.online)
+    # copies, since these are kept in the session state
+    return dict(catalog.ies_files), dict(catalog.spectra), dict(catalog.reports)
 
 
 # widgets
@@ -441,7 +420,15 @@ def update_lamp_scaling(lamp):
     """scale the lamp's photometry by the current value and method"""
     mode = ss[f"scale_method_{lamp.lamp_id}"]
     value = ss[f"scale_value_{lamp.lamp_id}"]
+    scale_lamp(lamp, mode, value)
+
 
+def scale_lamp(lamp, mode, value):
+    """
+    scale the lamp's photometry, and rescale its existing results rather than
+    recalculating them where possible. returns True if they were rescaled
+    """
+    old_calc_state = lamp.calc_state
     if mode == "factor":
         lamp.scale(value)
     elif mode == "total":
@@ -451,6 +438,11 @@ def update_lamp_scaling(lamp):
     elif mode == "max":
         lamp.scale_to_max(value)
 
+    rescaled = rescale_lamp(ss.room, lamp, old_calc_state)
+    if rescaled and ss.show_results:
+        show_results()  # redo the disinfection table and plot
+    return rescaled
+
 
 def update_lamp_width(lamp):
     width = set_val(f"width_{lamp.lamp_id}", lamp.surface.width)
@@ -0,0 +1,190 @@
+"""Rerun latency of the app, through scripted user flows."""
+
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+import tracemalloc
+from pathlib import Path
+
+os.environ.setdefault("ILLUMINATE_BACKGROUND_CALC", "0")
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+from app.benchmark import format_rows  # noqa: E402
+
+SCRIPT = Path(__file__).resolve().parents[1] / "guv_app.py"
+TIMEOUT = 300
+
+# flow: seconds for the slowest rerun, and MB for the largest peak, with
+# memory traced
+BUDGETS = {
+    "add_lamp": {"seconds": 2.0, "peak_mb": 50},
+    "edit_position": {"seconds": 2.0, "peak_mb": 50},
+    "toggle_reflectance": {"seconds": 2.0, "peak_mb": 50},
+    "calculate": {"seconds": 20.0, "peak_mb": 100},
+    "open_project": {"seconds": 2.0, "peak_mb": 50},
+}
+
+
+def add_lamp(at):
+    """pick the last entry of the luminaire dropdown, which adds one"""
+    # its options are indices into the labels, so set the index itself
+    widget = at.selectbox(key="lamp_select")
+    widget.set_value(len(widget.options) - 1)
+
+
+def pick_file(at):
+    """load the first vendored lamp into the selected luminaire"""
+    lamp_id = at.session_state["selected_lamp_id"]
+    widget = at.selectbox(key=f"file_{lamp_id}")
+    widget.select(widget.options[1])
+
+
+def set_position(at, axis, value):
+    lamp_id = at.session_state["selected_lamp_id"]
+    at.number_input(key=f"pos_{axis}_{lamp_id}").set_value(value)
+
+
+def click(at, label):
+    next(button for button in at.button if button.label == label).click()
+
+
+def toggle(at, key):
+    widget = at.checkbox(key=key)
+    widget.set_value(not widget.value)
+
+
+def get_flows():
+    """flow name: list of (step name, action taken before the rerun)"""
+    load = ("load", lambda at: None)
+    with_lamp = [load, ("add lamp", add_lamp), ("pick lamp", pick_file)]
+    return {
+        "add_lamp": with_lamp,
+        "edit_position": with_lamp
+        + [
+            ("move x", lambda at: set_position(at, "x", 1.5)),
+            ("move y", lambda at: set_position(at, "y", 1.0)),
+            ("move z", lambda at: set_position(at, "z", 2.5)),
+        ],
+        "toggle_reflectance": [
+            load,
+            ("edit room", lambda at: click(at, "Edit Room")),
+            ("reflections on", lambda at: toggle(at, "enable_reflectance")),
+            ("reflections off", lambda at: toggle(at, "enable_reflectance")),
+        ],
+        "calculate": with_lamp + [("calculate", lambda at: click(at, "Calculate!"))],
+        "open_project": [load, ("project", lambda at: click(at, "Project"))],
+    }
+
+
+def run_flow(name, steps, memory=True):
+    """one row per rerun of a flow, in a new session"""
+    at = AppTest.from_file(str(SCRIPT), default_timeout=TIMEOUT)
+    rows = []
+    for step, action in steps:
+        row = {"flow": name, "step": step, "seconds": None, "peak_mb": None}
+        rows.append(row)
+        try:
+            action(at)
+            if memory:
+                tracemalloc.reset_peak()
+                current = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            at.run()
+            row["seconds"] = time.perf_counter() - start
+            if memory:
+                peak = tracemalloc.get_traced_memory()[1] - current
+                row["peak_mb"] = peak / 1024**2
+            if at.exception:
+                raise RuntimeError(at.exception[0].value)
+        except Exception as e:
+            row["error"] = f"{type(e).__name__}: {e}"
+            break
+    return rows
+
+
+def check_budgets(rows, budgets):
+    """a message for each flow over budget or failed"""
+    failures = []
+    for flow, budget in budgets.items():
+        flow_rows = [row for row in rows if row["flow"] == flow]
+        for row in flow_rows:
+            if "error" in row:
+                failures.append(f"{flow}: {row['step']} failed: {row['error']}")
+        seconds = [row["seconds"] for row in flow_rows if row["seconds"] is not None]
+        if seconds and max(seconds) > budget["seconds"]:
+            failures.append(
+                f"{flow}: slowest rerun took {max(seconds):.2f} s, "
+                f"over its budget of {budget['seconds']} s"
+            )
+        peaks = [row["peak_mb"] for row in flow_rows if row["peak_mb"] is not None]
+        if peaks and budget.get("peak_mb") and max(peaks) > budget["peak_mb"]:
+            failures.append(
+                f"{flow}: largest peak was {max(peaks):.0f} MB, "
+                f"over its budget of {budget['peak_mb']} MB"
+            )
+    return failures
+
+
+def run_latency(names=None, memory=True):
+    """rows of rerun timings for the given flows, all by default"""
+    flows = get_flows()
+    names = list(flows) if names is None else names
+    rows = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        AppTest.from_file(str(SCRIPT), default_timeout=TIMEOUT).run()
+        if memory:
+            tracemalloc.start()
+        try:
+            for name in names:
+                rows += run_flow(name, flows[name], memory=memory)
+        finally:
+            if memory:
+                tracemalloc.stop()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.latency",
+        description="Time the reruns of scripted user flows through the app.",
+    )
+    parser.add_argument("-o", "--output", help="write the timings to this .json file")
+    parser.add_argument(
+        "--flows",
+        nargs="+",
+        default=None,
+        choices=list(BUDGETS),
+        help="flows to run; all by default",
+    )
+    parser.add_argument(
+        "--budgets", help="a .json file of budgets by flow, overriding the defaults"
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="don't trace peak memory, which slows reruns down",
+    )
+    args = parser.parse_args(argv)
+
+    budgets = {flow: dict(budget) for flow, budget in BUDGETS.items()}
+    if args.budgets:
+        for flow, budget in json.loads(Path(args.budgets).read_text()).items():
+            budgets.setdefault(flow, {}).update(budget)
+    names = list(BUDGETS) if args.flows is None else args.flows
+
+    rows = run_latency(names, memory=not args.no_memory)
+    print(format_rows(rows, ["flow", "step", "seconds", "peak_mb"]))
+    if args.output:
+        Path(args.output).write_text(json.dumps(rows, indent=2))
+    failures = check_budgets(rows, {name: budgets[name] for name in names})
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""Load test of many concurrent sessions against a streamlit server."""
+
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+import urllib.parse
+import urllib.request
+from pathlib import Path
+import numpy as np
+from tornado.httpclient import HTTPRequest
+from tornado.websocket import websocket_connect
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.ClientState_pb2 import ClientState
+from streamlit.proto.WidgetStates_pb2 import WidgetState, WidgetStates
+from app.catalog import get_catalog
+from app.memory import get_rss
+from app.benchmark import format_rows
+
+SCRIPT = Path(__file__).resolve().parents[1] / "guv_app.py"
+
+# seconds before a rerun, or a whole calculation, is given up on
+TIMEOUT = 600
+# seconds to wait for a server to start
+STARTUP = 60
+
+# label of the project export, once it's built
+EXPORT = "Download illuminate.zip"
+
+# relative frequency of each action
+WORKLOAD = {"preview": 2, "calculate": 2, "export": 1}
+
+EARLY_FOR_RERUN = ForwardMsg.ScriptFinishedStatus.FINISHED_EARLY_FOR_RERUN
+FRAGMENT_RUN = ForwardMsg.ScriptFinishedStatus.FINISHED_FRAGMENT_RUN_SUCCESSFULLY
+
+
+class Connection:
+    """one session on a streamlit server, driven over its websocket"""
+
+    def __init__(self, url, query_string=""):
+        self.url = url.rstrip("/").replace("http", "ws", 1) + "/_stcore/stream"
+        self.query_string = query_string
+        self.page_script_hash = ""
+        self.elements = []  # (type, proto) of every element of the last full run
+        self.fragment = None  # (fragment id, interval) of the auto-rerunning fragment
+        self._ws = None
+        self._cache = {}  # messages by hash, which the server may send by reference
+
+    async def connect(self):
+        request = HTTPRequest(self.url, request_timeout=TIMEOUT)
+        self._ws = await websocket_connect(request, subprotocols=["streamlit"])
+
+    def close(self):
+        if self._ws is not None:
+            self._ws.close()
+            self._ws = None
+
+    async def rerun(self, widgets=(), fragment_id=""):
+        """rerun the script, or a fragment, with the given widget states"""
+        state = ClientState(
+            query_string=self.query_string,
+            widget_states=WidgetStates(widgets=list(widgets)),
+            page_script_hash=self.page_script_hash,
+            fragment_id=fragment_id,
+            is_auto_rerun=bool(fragment_id),
+        )
+        await self._ws.write_message(
+            BackMsg(rerun_script=state).SerializeToString(), binary=True
+        )
+        await asyncio.wait_for(self._read_run(), TIMEOUT)
+
+    async def _read_run(self):
+        """read messages until the script run, and any reruns it asks for, end"""
+        elements, fragment, full = [], None, True
+        while True:
+            data = await self._ws.read_message()
+            if data is None:
+                raise ConnectionError("the server closed the connection")
+            msg = self._dereference(ForwardMsg.FromString(data))
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                self.page_script_hash = msg.new_session.page_script_hash
+                full = not msg.new_session.fragment_ids_this_run
+                elements, fragment = [], None
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                element = msg.delta.new_element
+                elements.append((element.WhichOneof("type"), element))
+            elif kind == "auto_rerun":
+                fragment = (msg.auto_rerun.fragment_id, msg.auto_rerun.interval)
+            elif kind == "script_finished":
+                if msg.script_finished == EARLY_FOR_RERUN:
+                    continue
+                if full:
+                    self.elements, self.fragment = elements, fragment
+                errors = [
+                    e.exception.message for ty, e in elements if ty == "exception"
+                ]
+                if errors:
+                    raise RuntimeError(errors[0])
+                if msg.script_finished == FRAGMENT_RUN:
+                    for ty, e in elements:
+                        if ty == "alert" and "failed" in e.alert.body:
+                            raise RuntimeError(e.alert.body)
+                return
+
+    def _dereference(self, msg):
+        if msg.WhichOneof("type") == "ref_hash":
+            full = ForwardMsg()
+            full.CopyFrom(self._cache[msg.ref_hash])
+            full.metadata.CopyFrom(msg.metadata)
+            return full
+        if msg.metadata.cacheable:
+            self._cache[msg.hash] = msg
+        return msg
+
+    def find(self, ty, key=None, label=None):
+        """the proto of the last full run's widget of a type, by key or label"""
+        for element_type, element in self.elements:
+            widget = getattr(element, element_type)
+            if element_type == ty and (
+                (key is not None and widget.id.endswith(f"-{key}"))
+                or (label is not None and widget.label == label)
+            ):
+                return widget
+        raise LookupError(f"no {ty} {key or label!r}")
+
+    def click(self, label):
+        return WidgetState(id=self.find("button", label=label).id, trigger_value=True)
+
+
+class Stats:
+    """tallies of one stage"""
+
+    def __init__(self):
+        self.reruns = []
+        self.polls = 0
+        self.calculations = []
+        self.exports = 0
+        self.errors = []
+
+
+class User:
+    """one simulated user, who keeps a session open between actions"""
+
+    def __init__(self, url, stats, seed, think):
+        self.url = url
+        self.stats = stats
+        self.rng = random.Random(seed)
+        self.think = think
+        self.connection = None
+
+    async def run(self, stop):
+        while not stop.is_set():
+            action = self.rng.choices(list(WORKLOAD), list(WORKLOAD.values()))[0]
+            if self.connection is None:
+                action = "preview"
+            try:
+                await getattr(self, action)()
+            except Exception as e:
+                self.stats.errors.append(f"{action}: {type(e).__name__}: {e}")
+                self.close()
+            pause = self.rng.expovariate(1 / self.think) if self.think > 0 else 0
+            try:
+                await asyncio.wait_for(stop.wait(), pause)
+            except asyncio.TimeoutError:
+                pass
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    async def rerun(self, *widgets):
+        start = time.perf_counter()
+        await self.connection.rerun(widgets)
+        self.stats.reruns.append(time.perf_counter() - start)
+
+    async def wait_for_calculation(self, start):
+        """rerun the progress fragment while there is one, as a browser would"""
+        while self.connection.fragment is not None:
+            if time.perf_counter() - start > TIMEOUT:
+                raise TimeoutError("calculation timed out")
+            fragment_id, interval = self.connection.fragment
+            await asyncio.sleep(interval)
+            await self.connection.rerun(fragment_id=fragment_id)
+            self.stats.polls += 1
+        self.stats.calculations.append(time.perf_counter() - start)
+
+    async def preview(self):
+        catalog = get_catalog(online=False)
+        names = [name for name in catalog.ies_files if catalog.defaults(name)]
+        name = self.rng.choice(names)
+        self.close()
+        self.connection = Connection(
+            self.url, urllib.parse.urlencode({"preview_lamp": name})
+        )
+        await self.connection.connect()
+        start = time.perf_counter()
+        await self.rerun()
+        await self.wait_for_calculation(start)
+
+    async def calculate(self):
+        connection = self.connection
+        lamp_select = connection.find("selectbox", key="lamp_select")
+        await self.rerun(WidgetState(id=lamp_select.id, int_value=1))
+        pos_x = next(
+            widget
+            for ty, element in connection.elements
+            if ty == "number_input"
+            and (widget := element.number_input).id.split("-")[-1].startswith("pos_x_")
+        )
+        x = round(self.rng.uniform(0.5, pos_x.max - 0.5 if pos_x.has_max else 3), 2)
+        await self.rerun(WidgetState(id=pos_x.id, double_value=x))
+        start = time.perf_counter()
+        await self.rerun(connection.click("Calculate!"))
+        await self.wait_for_calculation(start)
+
+    async def export(self):
+        await self.rerun(self.connection.click("Project"))
+        # the export is offered straight away if the room hasn't changed since
+        # the last one
+        try:
+            self.connection.find("download_button", label=EXPORT)
+        except LookupError:
+            await self.rerun(self.connection.click("Export All"))
+            self.connection.find("download_button", label=EXPORT)
+        self.stats.exports += 1
+
+
+async def run_stage(url, sessions, duration, think, seed=0, pid=None, interval=1.0):
+    """run a number of users at once for `duration` seconds, and summarize"""
+    stats = Stats()
+    stop = asyncio.Event()
+    users = [User(url, stats, seed + i, think) for i in range(sessions)]
+    tasks = [asyncio.ensure_future(user.run(stop)) for user in users]
+    rss = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        nbytes = get_rss(pid)
+        if nbytes is not None:
+            rss.append((round(time.perf_counter() - start, 1), nbytes / 1024**2))
+        await asyncio.sleep(interval)
+    stop.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    def percentile(values, q):
+        return float(np.percentile(values, q)) if values else None
+
+    summary = {
+        "sessions": sessions,
+        "seconds": elapsed,
+        "calculations": len(stats.calculations),
+        "calcs_per_min": len(stats.calculations) * 60 / elapsed,
+        "exports": stats.exports,
+        "reruns": len(stats.reruns),
+        "polls": stats.polls,
+        "p50": percentile(stats.reruns, 50),
+        "p95": percentile(stats.reruns, 95),
+        "p99": percentile(stats.reruns, 99),
+        "calc_p50": percentile(stats.calculations, 50),
+        "calc_p95": percentile(stats.calculations, 95),
+        "peak_rss_mb": max((mb for _, mb in rss), default=None),
+        "errors": len(stats.errors),
+    }
+    return summary, {"rss_mb": rss, "error_messages": stats.errors}
+
+
+def start_server():
+    """start the app on a free port, and return the process and its url"""
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", str(SCRIPT)]
+        + ["--server.headless", "true", "--server.port", str(port)]
+        + ["--browser.gatherUsageStats", "false"],
+        cwd=SCRIPT.parent,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://localhost:{port}"
+    deadline = time.monotonic() + STARTUP
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/_stcore/health", timeout=1):
+                return process, url
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError("the streamlit server didn't start")
+
+
+async def run_load(url, stages, duration, think, seed=0, pid=None):
+    results = []
+    # one session first, so that imports and the lamp catalog aren't charged
+    # to the first stage
+    connection = Connection(url)
+    await connection.connect()
+    await connection.rerun()
+    connection.close()
+    for sessions in stages:
+        summary, detail = await run_stage(
+            url, sessions, duration, think, seed=seed, pid=pid
+        )
+        results.append({**summary, **detail})
+        print(
+            f"{sessions} sessions: {summary['calcs_per_min']:.1f} calculations/min, "
+            f"p95 rerun {summary['p95'] or 0:.2f} s, "
+            f"peak RSS {summary['peak_rss_mb'] or 0:.0f} MB",
+            file=sys.stderr,
+        )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.loadtest",
+        description="Run many simulated sessions at once against a streamlit server, and report throughput, latency and memory.",
+    )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="concurrent sessions of each stage (default 1 2 4 8)",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=60, help="seconds per stage (default 60)"
+    )
+    parser.add_argument(
+        "--think",
+        type=float,
+        default=2.0,
+        help="mean seconds a user pauses between actions (default 2)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--url", help="a running server; one is started otherwise")
+    parser.add_argument("--pid", type=int, help="process id of the --url server")
+    parser.add_argument("-o", "--output", help="also write the results to .json")
+    args = parser.parse_args(argv)
+
+    process = None
+    url, pid = args.url, args.pid
+    if url is None:
+        process, url = start_server()
+        pid = process.pid
+    try:
+        results = asyncio.run(
+            run_load(url, args.sessions, args.duration, args.think, args.seed, pid)
+        )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    columns = [
+        "sessions",
+        "calcs_per_min",
+        "reruns",
+        "p50",
+        "p95",
+        "p99",
+        "calc_p50",
+        "calc_p95",
+        "exports",
+        "peak_rss_mb",
+        "errors",
+    ]
+    print(format_rows(results, columns))
+    for result in results:
+        for error in result["error_messages"][:5]:
+            print(f"{result['sessions']} sessions: {error}", file=sys.stderr)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Memory footprint of a Room's calculation results."""
+
+import os
+import sys
+import copy
+import numpy as np
+from app.retention import PackedArray
+
+
+class Footprint:
+    """bytes held by a room's calc zones, private to it and shared with others"""
+
+    def __init__(self, zones):
+        self.zones = zones  # zone_id: (private, shared)
+
+    def __repr__(self):
+        return (
+            f"Footprint(private={self.private / 1024**2:.1f} MB, "
+            f"shared={self.shared / 1024**2:.1f} MB)"
+        )
+
+    @property
+    def private(self):
+        return sum(private for private, _ in self.zones.values())
+
+    @property
+    def shared(self):
+        return sum(shared for _, shared in self.zones.values())
+
+
+def get_footprint(room):
+    """the bytes of result arrays held by each of the room's calc zones"""
+    seen = set()
+    zones = {}
+    for zone_id, zone in room.calc_zones.items():
+        private, shared = 0, 0
+        for array in _get_arrays(zone):
+            owner = _get_owner(array)
+            if id(owner) in seen:
+                continue
+            seen.add(id(owner))
+            if owner.flags.writeable:
+                private += owner.nbytes
+            else:
+                shared += owner.nbytes
+        for entry in zone.calculator.cache.lamp_cache.values():
+            for packed in [entry.base_values, entry.values]:
+                if isinstance(packed, PackedArray):
+                    private += packed.nbytes
+        zones[zone_id] = (private, shared)
+    return Footprint(zones)
+
+
+def get_rss(pid=None):
+    """
+    resident bytes of this process, or of another process by id. None where
+    it can't be read, except for this process, whose peak is then returned
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        if pid is not None:
+            return None
+    try:
+        import resource
+    except ImportError:  # windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def copy_room(room):
+    """a deep copy of the room that shares, rather than copies, read-only arrays"""
+    memo = {}
+    for zone in room.calc_zones.values():
+        for array in _get_arrays(zone):
+            if not array.flags.writeable:
+                memo[id(array)] = array
+    return copy.deepcopy(room, memo)
+
+
+def _get_arrays(zone):
+    """every result array a calc zone refers to"""
+    arrays = [zone.result.base_values, zone.result.reflected_values]
+    for entry in zone.calculator.cache.lamp_cache.values():
+        arrays += [entry.base_values, entry.values]
+    return [array for array in arrays if isinstance(array, np.ndarray)]
+
+
+def _get_owner(array):
+    """the array that owns the memory of a view"""
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
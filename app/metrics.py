@@ -0,0 +1,317 @@
+"""Metrics and health endpoints of the app's process."""
+
+import os
+import sys
+import json
+import logging
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+PORT = int(os.environ.get("ILLUMINATE_METRICS_PORT", 9101))
+ADDRESS = os.environ.get("ILLUMINATE_METRICS_ADDRESS", "127.0.0.1")
+
+# calculations that may wait for a thread before the process is unhealthy
+MAX_QUEUED = int(os.environ.get("ILLUMINATE_MAX_QUEUED", 8))
+
+_server = None
+_lock = threading.Lock()
+
+
+def get_metrics():
+    """everything the endpoints report, as nested dicts"""
+    # imported here so that --check doesn't load the app
+    from app.sessions import SESSIONS
+    from app.jobs import get_stats as get_job_stats
+    from app.result_cache import RESULT_CACHE
+    from app.uploads import UPLOADS
+    from app.fetch import get_stats as get_asset_stats
+    from app.perf import get_histograms
+    from app.memory import get_rss
+
+    return {
+        "sessions": SESSIONS.stats(),
+        "calculations": get_job_stats(),
+        "stages": {name: h.snapshot() for name, h in get_histograms().items()},
+        "result_cache": RESULT_CACHE.stats(),
+        "uploads": UPLOADS.stats(),
+        "assets": get_asset_stats(),
+        "rss": get_rss(),
+    }
+
+
+def get_health(metrics):
+    """a list of reasons the process is unhealthy; empty if it isn't"""
+    reasons = []
+    queued = metrics["calculations"]["queued"]
+    if queued > MAX_QUEUED:
+        reasons.append(
+            f"calculation queue saturated: {queued} queued, "
+            f"over the limit of {MAX_QUEUED}"
+        )
+    return reasons
+
+
+def format_prometheus(metrics):
+    """Prometheus text exposition of the metrics"""
+    sessions = metrics["sessions"]
+    calculations = metrics["calculations"]
+    results = metrics["result_cache"]
+    uploads = metrics["uploads"]
+    assets = metrics["assets"]
+    families = [
+        (
+            "illuminate_sessions",
+            "gauge",
+            "Sessions, by whether their state is held in memory or spilled to disk.",
+            [
+                ({"state": "held"}, sessions["held"]),
+                ({"state": "spilled"}, sessions["spilled"]),
+            ],
+        ),
+        (
+            "illuminate_session_bytes",
+            "gauge",
+            "Approximate private bytes held by the sessions in memory.",
+            [({}, sessions["nbytes"])],
+        ),
+        (
+            "illuminate_session_budget_bytes",
+            "gauge",
+            "Bytes the sessions may hold before idle ones are spilled.",
+            [({}, sessions["budget"])],
+        ),
+        (
+            "illuminate_session_spills_total",
+            "counter",
+            "Sessions spilled to disk.",
+            [({}, sessions["spills"])],
+        ),
+        (
+            "illuminate_session_restores_total",
+            "counter",
+            "Sessions restored from disk.",
+            [({}, sessions["restores"])],
+        ),
+        (
+            "illuminate_calculations",
+            "gauge",
+            "Background calculations, by whether they are queued or running.",
+            [
+                ({"state": "queued"}, calculations["queued"]),
+                ({"state": "running"}, calculations["running"]),
+            ],
+        ),
+        (
+            "illuminate_calculation_threads",
+            "gauge",
+            "Background calculations that may run at the same time.",
+            [({}, calculations["threads"])],
+        ),
+        (
+            "illuminate_calculations_submitted_total",
+            "counter",
+            "Background calculations submitted.",
+            [({}, calculations["submitted"])],
+        ),
+        (
+            "illuminate_result_cache_requests_total",
+            "counter",
+            "Lookups in the result cache, by whether they hit.",
+            [
+                ({"result": "hit"}, results["hits"]),
+                ({"result": "miss"}, results["misses"]),
+            ],
+        ),
+        (
+            "illuminate_result_cache_evictions_total",
+            "counter",
+            "Entries evicted from the result cache.",
+            [({}, results["evictions"])],
+        ),
+        (
+            "illuminate_result_cache_entries",
+            "gauge",
+            "Entries in the result cache.",
+            [({}, results["entries"])],
+        ),
+        (
+            "illuminate_result_cache_bytes",
+            "gauge",
+            "Bytes held by the result cache.",
+            [({}, results["nbytes"])],
+        ),
+        (
+            "illuminate_upload_requests_total",
+            "counter",
+            "Uploaded lamp files added, by whether they were already stored.",
+            [
+                ({"result": "hit"}, uploads["hits"]),
+                ({"result": "miss"}, uploads["parses"]),
+            ],
+        ),
+        (
+            "illuminate_upload_entries",
+            "gauge",
+            "Distinct uploaded lamp files stored.",
+            [({}, uploads["entries"])],
+        ),
+        (
+            "illuminate_upload_bytes",
+            "gauge",
+            "Bytes of the uploaded lamp files stored.",
+            [({}, uploads["nbytes"])],
+        ),
+        (
+            "illuminate_asset_requests_total",
+            "counter",
+            "Lamp assets fetched, by how they were served.",
+            [
+                ({"result": how}, assets[how])
+                for how in ["fresh", "revalidated", "downloaded", "stale"]
+            ],
+        ),
+    ]
+    if metrics["rss"] is not None:
+        families.append(
+            (
+                "illuminate_resident_memory_bytes",
+                "gauge",
+                "Resident memory of the process.",
+                [({}, metrics["rss"])],
+            )
+        )
+
+    lines = []
+    for name, kind, text, samples in families:
+        lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+        lines += [f"{name}{_labels(labels)} {value}" for labels, value in samples]
+
+    name = "illuminate_stage_seconds"
+    lines += [
+        f"# HELP {name} Seconds taken by each timed stage.",
+        f"# TYPE {name} histogram",
+    ]
+    for stage, snapshot in sorted(metrics["stages"].items()):
+        for bound, count in snapshot["buckets"]:
+            labels = {"stage": stage, "le": "+Inf" if bound == float("inf") else bound}
+            lines.append(f"{name}_bucket{_labels(labels)} {count}")
+        lines.append(f"{name}_sum{_labels({'stage': stage})} {snapshot['sum']}")
+        lines.append(f"{name}_count{_labels({'stage': stage})} {snapshot['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _escape(value):
+    """a label value; stage names may hold user-given zone ids"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            self._send(
+                200, format_prometheus(get_metrics()), "text/plain; version=0.0.4"
+            )
+        elif path == "/health":
+            reasons = get_health(get_metrics())
+            body = json.dumps({"healthy": not reasons, "reasons": reasons})
+            self._send(503 if reasons else 200, body, "application/json")
+        else:
+            self._send(404, "not found\n", "text/plain")
+
+    def log_message(self, format, *args):
+        pass  # scraped every few seconds; don't fill the log
+
+    def _send(self, status, body, content_type):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_metrics_server(port=PORT, address=ADDRESS):
+    """serve the metrics in a background thread, once per process"""
+    global _server
+    if not port:
+        return None
+    with _lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((address, port), MetricsHandler)
+            except OSError as e:
+                logger.warning(f"Could not serve metrics on {address}:{port}: {e}")
+                _server = False  # don't try again
+            else:
+                thread = threading.Thread(
+                    target=_server.serve_forever, name="illuminate-metrics", daemon=True
+                )
+                thread.start()
+                logger.info(f"Serving metrics on http://{address}:{port}/metrics")
+    return _server or None
+
+
+def check(app_url, metrics_url, timeout=5):
+    """a list of reasons the app is unhealthy; empty if it isn't"""
+    try:
+        urllib.request.urlopen(app_url, timeout=timeout).close()
+    except (urllib.error.URLError, OSError) as e:
+        return [f"{app_url}: {e}"]
+    try:
+        urllib.request.urlopen(metrics_url, timeout=timeout).close()
+    except urllib.error.HTTPError as e:
+        try:
+            return json.loads(e.read())["reasons"]
+        except (ValueError, KeyError):
+            return [f"{metrics_url}: {e}"]
+    except (urllib.error.URLError, OSError):
+        pass  # no session has started the server yet, so nothing is queued
+    return []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.metrics",
+        description="Print the app's metrics, or check its health.",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="exit with 1 if the app is unhealthy, rather than printing metrics",
+    )
+    parser.add_argument(
+        "--app-url",
+        default="http://localhost:8501",
+        help="address of the app (default http://localhost:8501)",
+    )
+    parser.add_argument(
+        "--metrics-url",
+        default=f"http://localhost:{PORT}",
+        help=f"address of the metrics server (default http://localhost:{PORT})",
+    )
+    args = parser.parse_args(argv)
+
+    if args.check:
+        reasons = check(f"{args.app_url}/_stcore/health", f"{args.metrics_url}/health")
+        for reason in reasons:
+            print(reason, file=sys.stderr)
+        return 1 if reasons else 0
+    with urllib.request.urlopen(f"{args.metrics_url}/metrics", timeout=5) as f:
+        print(f.read().decode(), end="")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""Dimming and placement optimizer for photobiological compliance."""
+
+import copy
+import itertools
+from functools import lru_cache
+import numpy as np
+from scipy.optimize import milp, Bounds, LinearConstraint
+from guv_calcs.efficacy.data import Data
+from app.calculation import (
+    calculate_pairs,
+    calculate_room,
+    rescale_lamp,
+    get_lamp_entry,
+)
+from app.compliance import get_lamp_tlvs, WEIGHTED_LIMIT
+
+OBJECTIVES = {"fluence": "Average fluence", "each": "eACH-UV"}
+
+# aim just under the limit, so that round-off in the rescaled float32 results
+# can't put the optimized installation over it
+TARGET = WEIGHTED_LIMIT * (1 - 1e-5)
+
+# the lowest output a lamp is dimmed to, relative to its photometry, as on the
+# dimming sliders; a lamp scaled to 0 can't be rescaled again
+MIN_SCALE = 0.01
+
+
+class OptimizationResult:
+    """
+    the best output, and optionally pose, of each lamp
+
+    `scales` are scaling factors relative to each lamp's photometry, as taken
+    by `lamp.scale()`. `poses` are (tilt, orientation) pairs, only for the
+    lamps that should be moved. `before` and `after` are the objective at the
+    present and the optimal settings.
+    """
+
+    def __init__(self, scales, poses, objective, before, after, state):
+        self.scales = scales
+        self.poses = poses
+        self.objective = objective
+        self.before = before
+        self.after = after
+        self._state = state
+
+    def __repr__(self):
+        return (
+            f"OptimizationResult(lamps={len(self.scales)}, moved={len(self.poses)}, "
+            f"{self.objective}: {self.before:.4g} -> {self.after:.4g})"
+        )
+
+    def is_current(self, room):
+        """true if nothing the result depends on has changed since it was found"""
+        return self._state == _get_state(room)
+
+
+def get_pose_candidates(tilts, orientations):
+    """every (tilt, orientation) combination"""
+    return list(itertools.product(tilts, orientations))
+
+
+def optimize(room, objective="fluence", max_scale=1.0, poses=None, workers=None):
+    """
+    find the output of each lamp, and optionally its pose, that maximizes the
+    average fluence or eACH-UV without exceeding the weighted skin or eye dose
+    limits. The room must already be calculated.
+
+    `max_scale` caps each lamp's output relative to its photometry, so the
+    default of 1 never runs a lamp above its rated output. `poses` maps lamp
+    ids to lists of candidate (tilt, orientation) pairs; a lamp's present
+    pose is always a candidate. Lamps without known TLVs are left as they are.
+
+    Raises ValueError if the room can't be optimized as it stands.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"objective must be one of {list(OBJECTIVES)}")
+    ref_manager = room.ref_manager
+    if ref_manager.enabled and any(ref_manager.reflectances.values()):
+        raise ValueError("Luminaires can't be optimized with reflective surfaces.")
+    fluence = room.calc_zones["WholeRoomFluence"]
+    if not fluence.enabled:
+        raise ValueError("The WholeRoomFluence zone must be enabled to optimize.")
+    limit_zones = [
+        room.calc_zones[zone_id]
+        for zone_id in ["SkinLimits", "EyeLimits"]
+        if room.calc_zones[zone_id].enabled
+    ]
+    zones = [fluence] + limit_zones
+
+    lamps = {}
+    for lamp_id, lamp in room.scene.get_valid_lamps().items():
+        for zone in zones:
+            entry = zone.calculator.cache.lamp_cache.get(lamp_id)
+            if entry is None or entry.calc_state != lamp.calc_state:
+                raise ValueError("Calculate the room before optimizing.")
+        if None not in get_lamp_tlvs(lamp, room.standard):
+            lamps[lamp_id] = lamp
+    if len(lamps) == 0:
+        raise ValueError("There are no luminaires with known TLVs to optimize.")
+
+    columns = _get_columns(room, lamps, poses or {}, zones, workers)
+    groups = [lamp_id for lamp_id, _, _ in columns]
+    gains = _get_gains(room, objective, columns)
+    upper = np.array([max_scale / lamps[lamp_id].scaling_factor for lamp_id in groups])
+    lower = np.minimum(
+        [MIN_SCALE / lamps[lamp_id].scaling_factor for lamp_id in groups], upper
+    )
+
+    rows = []
+    for zone in limit_zones:
+        weighted = []
+        for lamp_id, _, values in columns:
+            skin_tlv, eye_tlv = get_lamp_tlvs(lamps[lamp_id], room.standard)
+            tlv = skin_tlv if zone.zone_id == "SkinLimits" else eye_tlv
+            dose = values[zone.zone_id].reshape(-1) * 3.6 * zone.hours
+            weighted.append(dose * WEIGHTED_LIMIT / tlv)
+        rows.append(np.stack(weighted, axis=1))
+    A = np.concatenate(rows) if rows else np.zeros((0, len(columns)))
+    A = A[A @ upper > TARGET]  # the rest can never exceed the limit
+
+    x, selected = _solve(gains, A, lower, upper, groups)
+
+    scales, new_poses = {}, {}
+    for i, (lamp_id, pose, _) in enumerate(columns):
+        if selected[i]:
+            scales[lamp_id] = float(x[i] * lamps[lamp_id].scaling_factor)
+            if pose is not None:
+                new_poses[lamp_id] = pose
+    present = [pose is None for _, pose, _ in columns]
+    return OptimizationResult(
+        scales=scales,
+        poses=new_poses,
+        objective=objective,
+        before=float(gains[present].sum()),
+        after=float(gains @ x),
+        state=_get_state(room),
+    )
+
+
+def apply_optimization(room, result, workers=None):
+    """move and scale the room's lamps as found by `optimize`"""
+    if not result.is_current(room):
+        raise ValueError("The room has changed since it was optimized.")
+    for lamp_id, (tilt, orientation) in result.poses.items():
+        set_pose(room.lamps[lamp_id], tilt, orientation, room.dimensions)
+    if len(result.poses) > 0:
+        calculate_room(room, workers=workers)  # from the result cache
+    for lamp_id, scale in result.scales.items():
+        lamp = room.lamps[lamp_id]
+        old_calc_state = lamp.calc_state
+        lamp.scale(scale)
+        rescale_lamp(room, lamp, old_calc_state)
+    return room
+
+
+def set_pose(lamp, tilt, orientation, dimensions):
+    """tilt and orient a lamp, as the tilt and orientation widgets do"""
+    lamp.set_tilt(tilt, dimensions=dimensions)
+    lamp.set_orientation(orientation, dimensions)
+    return lamp
+
+
+def _get_columns(room, lamps, poses, zones, workers):
+    """
+    a (lamp_id, pose, {zone_id: values}) column for the present pose of
+    every lamp, then one for every distinct candidate pose
+    """
+    columns = []
+    for lamp_id, lamp in lamps.items():
+        values = {zone.zone_id: get_lamp_entry(zone, lamp).values for zone in zones}
+        columns.append((lamp_id, None, values))
+
+    candidates = {}
+    for lamp_id, lamp in lamps.items():
+        seen = [lamp.calc_state]
+        for tilt, orientation in poses.get(lamp_id, []):
+            candidate = set_pose(
+                copy.deepcopy(lamp), tilt, orientation, room.dimensions
+            )
+            if candidate.calc_state in seen:
+                continue  # eg, any orientation of an untilted lamp
+            seen.append(candidate.calc_state)
+            candidates[f"{lamp_id}:{tilt}:{orientation}"] = (
+                lamp_id,
+                (tilt, orientation),
+                candidate,
+            )
+    if len(candidates) == 0:
+        return columns
+
+    views = {zone.zone_id: zone.to_view() for zone in zones}
+    pairs = [(key, zone_id) for key in candidates for zone_id in views]
+    base_values = calculate_pairs(
+        pairs,
+        {key: candidate for key, (_, _, candidate) in candidates.items()},
+        views,
+        workers=workers,
+    )
+    for key, (lamp_id, pose, candidate) in candidates.items():
+        values = {
+            zone.zone_id: zone.calculator.apply_filters(
+                candidate, base_values[(key, zone.zone_id)].copy(), views[zone.zone_id]
+            )
+            for zone in zones
+        }
+        columns.append((lamp_id, pose, values))
+    return columns
+
+
+def _get_gains(room, objective, columns):
+    """the objective per unit of each column's present output"""
+    gains = np.array(
+        [values["WholeRoomFluence"].mean() for _, _, values in columns],
+        dtype="float64",
+    )
+    if objective == "each":
+        gains *= [
+            _each_per_fluence(room.lamps[lamp_id].wavelength)
+            for lamp_id, _, _ in columns
+        ]
+    return gains
+
+
+@lru_cache(maxsize=None)
+def _each_per_fluence(wavelength):
+    """average eACH-UV per µW/cm² of fluence at this wavelength; 0 if unknown"""
+    if wavelength is None:
+        return 0.0
+    try:
+        data = Data(fluence={wavelength: 1.0}).subset(medium="Aerosol")
+        return float(data.average_value(function="each"))
+    except TypeError:  # no efficacy data at this wavelength
+        return 0.0
+
+
+def _solve(gains, A, lower, upper, groups):
+    """
+    maximize gains @ x subject to A @ x <= TARGET and lower <= x <= upper,
+    with exactly one column selected per group if any group has several.
+    Returns x and a boolean mask of the selected columns
+    """
+    n = len(gains)
+    names = list(dict.fromkeys(groups))
+    constraints = []
+    if n == len(names):  # one column per lamp: a plain linear program
+        if len(A) > 0:
+            constraints.append(LinearConstraint(A, -np.inf, TARGET))
+        res = milp(-gains, bounds=Bounds(lower, upper), constraints=constraints)
+        if not res.success:
+            raise ValueError(f"Optimization failed: {res.message}")
+        return np.clip(res.x, lower, upper), np.ones(n, dtype=bool)
+
+    # outputs x, then a binary per column: lower_j * y_j <= x_j <= upper_j * y_j,
+    # one y per lamp
+    membership = np.array([[g == name for g in groups] for name in names], dtype=float)
+    constraints.append(
+        LinearConstraint(np.hstack([np.eye(n), -np.diag(upper)]), -np.inf, 0)
+    )
+    constraints.append(
+        LinearConstraint(np.hstack([np.eye(n), -np.diag(lower)]), 0, np.inf)
+    )
+    constraints.append(
+        LinearConstraint(np.hstack([np.zeros((len(names), n)), membership]), 1, 1)
+    )
+    if len(A) > 0:
+        constraints.append(
+            LinearConstraint(np.hstack([A, np.zeros_like(A)]), -np.inf, TARGET)
+        )
+    res = milp(
+        np.concatenate([-gains, np.zeros(n)]),
+        integrality=np.concatenate([np.zeros(n), np.ones(n)]),
+        bounds=Bounds(0, np.concatenate([upper, np.ones(n)])),
+        constraints=constraints,
+    )
+    if not res.success:
+        raise ValueError(f"Optimization failed: {res.message}")
+    return np.clip(res.x[:n], 0, upper), res.x[n:] > 0.5
+
+
+def _get_state(room):
+    """everything an optimization result depends on"""
+    return room.get_calc_state(), room.get_update_state(), room.standard
@@ -0,0 +1,124 @@
+"""Download payloads, built at most once per change to what they contain."""
+
+import streamlit as st
+from app.perf import span
+
+ss = st.session_state
+
+
+def room_fingerprint(room):
+    """(key, pins) for everything a room's save file and exports depend on"""
+    keys, pins = [], []
+    keys.append(
+        (
+            room.dim.x,
+            room.dim.y,
+            room.dim.z,
+            room.units,
+            room.ref_manager.enabled,
+            room.ref_manager.max_num_passes,
+            room.ref_manager.threshold,
+            room.standard,
+            room.air_changes,
+            room.ozone_decay_constant,
+            room.precision,
+            room.scene.on_collision,
+            room.scene.colormap,
+        )
+    )
+    keys.append(repr({k: v.to_dict() for k, v in room.surfaces.items()}))
+    for lamp_id, lamp in room.lamps.items():
+        key, lamp_pins = lamp_fingerprint(lamp)
+        keys.append((lamp_id, key))
+        pins += lamp_pins
+    for zone_id, zone in room.calc_zones.items():
+        key, zone_pins = zone_fingerprint(zone)
+        keys.append((zone_id, key))
+        pins += zone_pins
+    return tuple(keys), pins
+
+
+def lamp_fingerprint(lamp):
+    pins = [lamp._base_ies, lamp.spectra, lamp.surface.intensity_map_orig]
+    key = (
+        lamp.name,
+        lamp.enabled,
+        str(lamp.filename),
+        lamp.calc_state,
+        lamp.update_state,
+        lamp.guv_type,
+        lamp.wavelength,
+        repr(lamp.surface.to_dict()),
+        tuple(id(obj) for obj in pins),
+    )
+    return key, pins
+
+
+def zone_fingerprint(zone):
+    pins = [zone.result.base_values, zone.result.reflected_values]
+    key = (repr(zone.to_dict()), tuple(id(obj) for obj in pins))
+    return key, pins
+
+
+def get_payload(name, build, fingerprint):
+    """
+    return the payload stored under `name` if it was built against this
+    fingerprint, otherwise build it with `build()` and store it
+    """
+    payload = peek_payload(name, fingerprint)
+    if payload is None:
+        payload = build_payload(name, build, fingerprint)
+    return payload
+
+
+def peek_payload(name, fingerprint):
+    """the stored payload if it is current, else None. never builds"""
+    entry = ss.setdefault("payloads", {}).get(name)
+    if entry is not None and entry[0] == fingerprint[0]:
+        return entry[2]
+    return None
+
+
+def build_payload(name, build, fingerprint):
+    """build and store a payload, regardless of what is stored"""
+    with span(f"build_{name}"):
+        payload = build()
+    ss.setdefault("payloads", {})[name] = (fingerprint[0], fingerprint[1], payload)
+    return payload
+
+
+def with_options(fingerprint, *options):
+    """a fingerprint that also covers the export options a payload was built with"""
+    key, pins = fingerprint
+    return key + (options,), pins
+
+
+def lazy_download_button(
+    container, label, name, build, fingerprint, file_name, key, **kwargs
+):
+    """
+    a button that builds the payload when clicked, then offers it for
+    download until the fingerprint changes. `fingerprint` is a function, so
+    that it is taken again when the build runs
+    """
+    data = peek_payload(name, fingerprint())
+    if data is None:
+        return container.button(
+            label,
+            on_click=_build_lazy_payload,
+            args=[name, build, fingerprint],
+            key=f"{key}_prepare",
+            **kwargs,
+        )
+    return container.download_button(
+        f"Download {file_name}",
+        data=data,
+        file_name=file_name,
+        key=key,
+        **kwargs,
+    )
+
+
+def _build_lazy_payload(name, build, fingerprint):
+    with st.spinner("Preparing export...", show_time=True):
+        build_payload(name, build, fingerprint())
@@ -0,0 +1,159 @@
+"""Timing of the app's hot paths, per rerun and across the process."""
+
+import os
+import time
+import bisect
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# reruns kept in each session's log
+RERUNS = int(os.environ.get("ILLUMINATE_PERF_RERUNS", 50))
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+
+class Histogram:
+    """thread-safe counts of durations by bucket"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last is unbounded
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Histogram(count={self.count}, sum={self.sum:.3f})"
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+            self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """an estimate of the q quantile, interpolated within its bucket"""
+        with self._lock:
+            counts, count, top = list(self.counts), self.count, self.max
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else top
+                return lower + (min(upper, top) - lower) * (rank - seen) / n
+            seen += n
+        return top
+
+    def snapshot(self):
+        """the counts, cumulative by bucket as prometheus has them"""
+        with self._lock:
+            counts = list(self.counts)
+            total = {"count": self.count, "sum": self.sum, "max": self.max}
+        cumulative = []
+        seen = 0
+        for bound, n in zip(self.buckets + [float("inf")], counts):
+            seen += n
+            cumulative.append((bound, seen))
+        return {"buckets": cumulative, **total}
+
+
+class Rerun:
+    """the spans of one script rerun"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.seconds = None
+        self.stages = {}  # name: seconds
+        self._start = time.perf_counter()
+
+    def __repr__(self):
+        return f"Rerun(seconds={self.seconds}, stages={list(self.stages)})"
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._start
+        return self
+
+
+class PerfLog:
+    """a session's last reruns"""
+
+    def __init__(self, maxlen=RERUNS):
+        self.reruns = deque(maxlen=maxlen)
+
+    def __repr__(self):
+        return f"PerfLog({len(self.reruns)} reruns)"
+
+    def __len__(self):
+        return len(self.reruns)
+
+    def __iter__(self):
+        return iter(self.reruns)
+
+    def add(self, rerun):
+        self.reruns.append(rerun)
+
+
+_histograms = {}
+_lock = threading.Lock()
+# the rerun this thread is running, and the log it goes to
+_current = contextvars.ContextVar("rerun", default=None)
+
+
+def get_histogram(name):
+    """the process-wide histogram of a span"""
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(name, Histogram())
+    return histogram
+
+
+def get_histograms():
+    """every span's histogram, by name"""
+    with _lock:
+        return dict(_histograms)
+
+
+@contextmanager
+def span(name):
+    """time a block of code, or a function"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        get_histogram(name).observe(seconds)
+        current = _current.get()
+        if current is not None:
+            current[0].add(name, seconds)
+
+
+def begin_rerun(state):
+    """start timing a rerun of the session, dropping any unfinished one"""
+    if "perf_log" not in state:
+        state["perf_log"] = PerfLog()
+    _current.set((Rerun(), state["perf_log"]))
+
+
+def end_rerun():
+    """finish timing the rerun, and add it to its log"""
+    current = _current.get()
+    if current is None:
+        return None
+    _current.set(None)
+    rerun, log = current
+    rerun.finish()
+    get_histogram("rerun").observe(rerun.seconds)
+    log.add(rerun)
+    return rerun
@@ -0,0 +1,43 @@
+import time
+import pandas as pd
+import streamlit as st
+from app.perf import get_histograms
+
+ss = st.session_state
+
+
+def perf_panel():
+    """timings of this session's last reruns, and of every session's, by stage"""
+    st.subheader("Performance", divider="grey")
+    rows = []
+    for rerun in reversed(list(ss.get("perf_log", []))):
+        row = {
+            "time": time.strftime("%H:%M:%S", time.localtime(rerun.started)),
+            "total": rerun.seconds,
+        }
+        row.update(rerun.stages)
+        rows.append(row)
+    st.caption(
+        f"Seconds taken by each stage of this session's last {len(rows)} reruns, "
+        "most recent first. Stages may be nested in others. The widget "
+        "callbacks that started a rerun are timed across all sessions only."
+    )
+    st.dataframe(pd.DataFrame(rows).round(3), hide_index=True, use_container_width=True)
+
+    rows = []
+    for name, histogram in sorted(get_histograms().items()):
+        rows.append(
+            {
+                "stage": name,
+                "count": histogram.count,
+                "mean": histogram.sum / histogram.count,
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "max": histogram.max,
+            }
+        )
+    st.caption(
+        "Seconds taken by each stage across all sessions since the server "
+        "started. Percentiles are estimated from histogram buckets."
+    )
+    st.dataframe(pd.DataFrame(rows).round(3), hide_index=True, use_container_width=True)
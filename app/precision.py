@@ -0,0 +1,131 @@
+"""Accuracy of single-precision results."""
+
+import sys
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+from guv_calcs import Room, Lamp
+from guv_calcs.lamp import VALID_LAMPS
+from guv_calcs.units import convert_units
+from guv_calcs.calc_manager import LightingCalculator
+from app.calculation import calculate_room
+
+
+def reference_values(lamp, zv):
+    """a lamp's filtered values in a zone, calculated and kept in float64"""
+    calculator = LightingCalculator()
+    rel_coords = zv.coords - lamp.surface.position
+    Theta, Phi, R = lamp.transform_to_lamp(rel_coords, which="polar")
+    if lamp.surface.units.lower() != "meters":
+        R = np.array(convert_units(lamp.surface.units, "meters", *R))
+    phot = lamp.ies.photometry.interpolated()
+    values = phot.get_intensity(Theta, Phi) / R**2
+    if lamp.surface.source_density > 0 and lamp.surface.photometric_distance:
+        values = calculator.calculate_nearfield(lamp, R, values, zv)
+    values = np.where(np.isfinite(values), values, 0).astype("float64")
+    return calculator.apply_filters(lamp, values, zv)
+
+
+def reference_zone(zone, lamps):
+    """the zone's values from `reference_values`, summed as guv-calcs does"""
+    zv = zone.to_view()
+    lamp_values = [reference_values(lamp, zv) for lamp in lamps.values()]
+    if zv.is_plane() and zv.fov_horiz < 360 and len(lamps) > 1:
+        values = LightingCalculator().calculate_horizontal_fov(lamps, lamp_values, zv)
+        values = values.reshape(zv.num_points)
+    else:
+        values = np.sum(lamp_values, axis=0)
+    if zone.dose:
+        values = values * 3.6 * zone.hours
+    return values
+
+
+def compare_room(room, label):
+    """one row per standard zone, comparing the app's results to the reference"""
+    calculate_room(room, workers=1)
+    lamps = room.scene.get_valid_lamps()
+    rows = []
+    for zone_id in ["WholeRoomFluence", "SkinLimits", "EyeLimits"]:
+        zone = room.calc_zones[zone_id]
+        single = np.ma.filled(zone.get_values(), 0).astype("float64")
+        double = reference_zone(zone, lamps)
+        scale = np.abs(double).max()
+        # the same sum, accumulated in float32 as guv-calcs does by default
+        unaccumulated = zone.calculator.aggregate(lamps, zone.to_view())
+        if zone.dose:
+            unaccumulated = unaccumulated * 3.6 * zone.hours
+        arrays = 2 * len(lamps) + 1  # base and filtered values per lamp, and the sum
+        rows.append(
+            {
+                "lamps": label,
+                "zone": zone_id,
+                "points": int(np.prod(zone.num_points)),
+                "max_error": float(np.abs(single - double).max() / scale),
+                "mean_error": float(abs(single.mean() - double.mean()) / double.mean()),
+                "peak_error": float(abs(single.max() - double.max()) / double.max()),
+                "float32_sum_error": float(
+                    np.abs(np.ma.filled(unaccumulated, 0) - double).max() / scale
+                ),
+                "float32_mb": zone.values.size * 4 * arrays / 1024**2,
+                "float64_mb": zone.values.size * 8 * arrays / 1024**2,
+            }
+        )
+    return rows
+
+
+def get_room(keys):
+    """the default room with the standard zones and the given vendored lamps"""
+    room = Room(standard="acgih", enable_reflectance=False)
+    room.add_standard_zones()
+    cols = int(np.ceil(np.sqrt(len(keys))))
+    rows = int(np.ceil(len(keys) / cols))
+    for i, key in enumerate(keys):
+        x = room.x * ((i % cols) + 0.5) / cols
+        y = room.y * ((i // cols) + 0.5) / rows
+        lamp = Lamp.from_keyword(key, lamp_id=f"Lamp{i + 1}")
+        lamp.move(x, y, room.z - 0.1)
+        room.add_lamp(lamp)
+    return room
+
+
+def run_report(keys=None):
+    """a DataFrame comparing single and double precision for each lamp"""
+    keys = VALID_LAMPS if keys is None else keys
+    rows = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for key in keys:
+            rows += compare_room(get_room([key]), key)
+        if len(keys) > 1:
+            rows += compare_room(get_room(keys), f"all {len(keys)}")
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.precision",
+        description="Compare float32 results to a float64 reference on the vendored lamps.",
+    )
+    parser.add_argument("-o", "--output", help="also write the report to .csv or .json")
+    parser.add_argument(
+        "--lamps",
+        nargs="+",
+        default=None,
+        help="vendored lamp keywords; all by default",
+    )
+    args = parser.parse_args(argv)
+
+    df = run_report(args.lamps)
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(df.to_string(index=False, float_format=lambda x: f"{x:.3g}"))
+    if args.output:
+        if args.output.lower().endswith(".json"):
+            df.to_json(args.output, orient="records", indent=2)
+        else:
+            df.to_csv(args.output, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Profiles of a single rerun or calculation, captured on demand."""
+
+import os
+import sys
+import time
+import cProfile
+import threading
+from pathlib import Path
+from collections import Counter
+
+PROFILE_DIR = Path(
+    os.environ.get(
+        "ILLUMINATE_PROFILE_DIR", Path.home() / ".cache" / "illuminate" / "profiles"
+    )
+)
+
+# seconds between stack samples
+INTERVAL = 0.005
+
+# captures kept in the profile directory
+KEEP = 20
+
+# what the next capture of a session is of, kept in its state
+RERUN = "rerun"
+CALCULATION = "calculation"
+
+# held by the capture running, if any; cProfile can only run one profiler at a
+# time from python 3.12
+_active = threading.Lock()
+
+
+class Capture:
+    """a cProfile run and stack samples of the thread that starts it"""
+
+    def __init__(self, label):
+        self.label = label
+        self.started = time.time()
+        self.seconds = None
+        self.samples = Counter()  # collapsed stack: count
+        self.profiler = cProfile.Profile()
+        self._thread_id = threading.get_ident()
+        self._done = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._start = None
+
+    def __repr__(self):
+        return f"Capture({self.label}, seconds={self.seconds})"
+
+    def start(self):
+        """start profiling, and return self, or None if another capture is running"""
+        if not _active.acquire(blocking=False):
+            return None
+        self._start = time.perf_counter()
+        self._sampler.start()
+        self.profiler.enable()
+        return self
+
+    def stop(self):
+        """stop profiling. may be called from another thread, if this one died"""
+        if self.seconds is not None:
+            return self
+        self.profiler.disable()
+        self.seconds = time.perf_counter() - self._start
+        self._done.set()
+        self._sampler.join()
+        _active.release()
+        return self
+
+    def _sample(self):
+        while not self._done.wait(INTERVAL):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                break
+            self.samples[collapse(frame)] += 1
+
+    def save(self, directory=None):
+        """write the .prof and collapsed stacks, and describe them"""
+        directory = Path(PROFILE_DIR if directory is None else directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        stem = f"{stamp}-{self.label}-{id(self):x}"
+        prof = directory / f"{stem}.prof"
+        stacks = directory / f"{stem}.txt"
+        self.profiler.dump_stats(prof)
+        stacks.write_text(
+            "".join(f"{stack} {n}\n" for stack, n in self.samples.most_common())
+        )
+        prune(directory)
+        return {
+            "label": self.label,
+            "seconds": self.seconds,
+            "prof": str(prof),
+            "stacks": str(stacks),
+        }
+
+
+def collapse(frame):
+    """a frame's stack, outermost first, as one line of a collapsed stack file"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def prune(directory, keep=KEEP):
+    """remove all but the last `keep` captures"""
+    profs = sorted(Path(directory).glob("*.prof"), key=lambda p: p.stat().st_mtime)
+    for prof in profs[:-keep] if keep else profs:
+        prof.unlink(missing_ok=True)
+        prof.with_suffix(".txt").unlink(missing_ok=True)
+
+
+def begin_profile(state):
+    """start profiling this rerun if the session asked for it"""
+    if "profile_next" in state and state["profile_next"] == RERUN:
+        capture = Capture(RERUN).start()
+        if capture is not None:
+            state["profile_next"] = None
+            state["profile_capture"] = capture
+
+
+def end_profile(state):
+    """finish profiling this rerun, if it was, and describe its files in `profile`"""
+    if "profile_capture" not in state or state["profile_capture"] is None:
+        return None
+    capture = state["profile_capture"]
+    state["profile_capture"] = None
+    state["profile"] = capture.stop().save()
+    return state["profile"]
@@ -0,0 +1,173 @@
+"""Adaptive refinement of the maxima of calc planes."""
+
+import numpy as np
+from scipy.ndimage import maximum_filter
+from guv_calcs import CalcPlane
+from app.calculation import calculate_pairs, get_lamp_entry
+
+# relative spread around a probe's maximum at which it stops being refined
+TOLERANCE = 1e-3
+# number of local maxima of the regular grid that are refined
+NUM_SEEDS = 4
+# number of times a probe may be halved
+MAX_DEPTH = 8
+# points per side of each probe; odd, so the probe is centered on a point
+PROBE_POINTS = 5
+
+
+class Refinement:
+    """
+    the values of each lamp at the points added around a plane's maxima
+
+    `values` is a (lamps x points) array of filtered irradiance, in the order
+    of `lamp_ids`, at `coords`. `maximum` is the largest weighted sum found,
+    on the regular grid or off it, and `location` is where it was found.
+    """
+
+    def __init__(self, lamp_ids, coords, values, maximum, location):
+        self.lamp_ids = lamp_ids
+        self.coords = coords
+        self.values = values
+        self.maximum = maximum
+        self.location = location
+
+    def __repr__(self):
+        return (
+            f"Refinement(points={len(self.coords)}, maximum={self.maximum:.6g}, "
+            f"location={tuple(np.round(self.location, 4))})"
+        )
+
+
+def refine_plane(
+    zone,
+    lamps,
+    weights=None,
+    tolerance=TOLERANCE,
+    num_seeds=NUM_SEEDS,
+    max_depth=MAX_DEPTH,
+    workers=None,
+):
+    """
+    refine the maxima of a calculated CalcPlane. `lamps` maps lamp ids to
+    lamps, each of which must have a current entry in the zone's lamp cache,
+    and `weights` maps the same ids to the weight of each lamp's contribution
+    to the sum being maximized; 1 by default.
+    """
+    if zone.calctype != "Plane":
+        raise ValueError("Only calc planes can be refined.")
+    lamp_ids = list(lamps)
+    w = np.array([1.0 if weights is None else weights[i] for i in lamp_ids])
+    geometry = zone.geometry
+    if len(lamp_ids) == 0:
+        return Refinement(lamp_ids, np.zeros((0, 3)), np.zeros((0, 0)), 0.0, None)
+
+    grid = np.stack(
+        [get_lamp_entry(zone, lamps[lamp_id]).values for lamp_id in lamp_ids]
+    )
+    field = np.tensordot(w, grid, axes=1)
+    i, j = np.unravel_index(np.argmax(field), field.shape)
+    maximum = float(field[i, j])
+    location = geometry.coords[np.ravel_multi_index((i, j), field.shape)]
+
+    # (s, t, half-width in s, half-width in t) of each seed, in the plane's
+    # own coordinates
+    spans = np.abs(geometry.spans)
+    s_points, t_points = geometry.points
+    seeds = [
+        [s_points[i], t_points[j], *geometry.spacing]
+        for i, j in _get_peaks(field, num_seeds)
+    ]
+
+    coords, values = [np.zeros((0, 3))], [np.zeros((len(lamp_ids), 0))]
+    for _ in range(max_depth):
+        if len(seeds) == 0:
+            break
+        probes = [_get_probe(zone, seed, spans, k) for k, seed in enumerate(seeds)]
+        views = {probe.zone_id: probe.to_view() for probe in probes}
+        pairs = [(lamp_id, zone_id) for zone_id in views for lamp_id in lamp_ids]
+        base_values = calculate_pairs(pairs, lamps, views, workers=workers)
+
+        next_seeds = []
+        for seed, probe in zip(seeds, probes):
+            zv = views[probe.zone_id]
+            probe_values = np.stack(
+                [
+                    zone.calculator.apply_filters(
+                        lamps[lamp_id],
+                        base_values[(lamp_id, zv.zone_id)].copy(),
+                        zv,
+                    ).reshape(-1)
+                    for lamp_id in lamp_ids
+                ]
+            )
+            coords.append(zv.coords)
+            values.append(probe_values)
+
+            probe_field = w @ probe_values
+            k = int(np.argmax(probe_field))
+            best = float(probe_field[k])
+            if best > maximum:
+                maximum, location = best, zv.coords[k]
+            index = np.unravel_index(k, probe.geometry.num_points)
+            rows = slice(max(index[0] - 1, 0), index[0] + 2)
+            cols = slice(max(index[1] - 1, 0), index[1] + 2)
+            neighbours = probe_field.reshape(probe.geometry.num_points)[rows, cols]
+            if best - neighbours.min() <= tolerance * best:
+                continue  # converged
+            s, t = (axis[i] for axis, i in zip(probe.geometry.points, index))
+            origin_s, origin_t = _get_probe_origin(probe, zone)
+            next_seeds.append([origin_s + s, origin_t + t, seed[2] / 2, seed[3] / 2])
+        seeds = next_seeds
+
+    return Refinement(
+        lamp_ids,
+        np.concatenate(coords),
+        np.concatenate(values, axis=1).astype("float32"),
+        maximum,
+        location,
+    )
+
+
+def _get_peaks(field, num_seeds):
+    """indices of the highest nonzero local maxima of a 2d array"""
+    peaks = (field == maximum_filter(field, size=3, mode="nearest")) & (field > 0)
+    indices = np.argwhere(peaks)
+    order = np.argsort(field[peaks])[::-1]
+    return [tuple(index) for index in indices[order][:num_seeds]]
+
+
+def _get_probe(zone, seed, spans, k):
+    """a small CalcPlane centered on a seed, clipped to the zone"""
+    s, t, ds, dt = seed
+    s1, s2 = max(s - ds, 0.0), min(s + ds, spans[0])
+    t1, t2 = max(t - dt, 0.0), min(t + dt, spans[1])
+    geometry = zone.geometry
+    origin = (
+        np.asarray(geometry.origin, float) + s1 * geometry.u_hat + t1 * geometry.v_hat
+    )
+    return CalcPlane(
+        zone_id=f"{zone.zone_id}:probe{k}",
+        geometry=geometry.update(
+            origin=tuple(origin),
+            spans=(s2 - s1, t2 - t1),
+            spacing_init=None,
+            num_points_init=(PROBE_POINTS, PROBE_POINTS),
+            offset=True,
+        ),
+        fov_vert=zone.fov_vert,
+        fov_horiz=zone.fov_horiz,
+        vert=zone.vert,
+        horiz=zone.horiz,
+        use_normal=zone.use_normal,
+    )
+
+
+def _get_probe_origin(probe, zone):
+    """the origin of a probe, in the plane coordinates of its zone"""
+    offset = np.asarray(probe.geometry.origin, float) - np.asarray(
+        zone.geometry.origin, float
+    )
+    return (
+        float(offset @ zone.geometry.u_hat),
+        float(offset @ zone.geometry.v_hat),
+    )
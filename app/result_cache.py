@@ -0,0 +1,86 @@
+"""Process-wide cache of lamp x zone results, shared by every session."""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# byte budget for all cached arrays, across every session in this process
+MAX_BYTES = int(float(os.environ.get("ILLUMINATE_RESULT_CACHE_MB", 256)) * 1024**2)
+
+
+class ResultCache:
+    """thread-safe LRU cache of numpy arrays with a byte budget"""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """return the cached array for this key, or None"""
+        with self._lock:
+            values = self._entries.get(key)
+            if values is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return values
+
+    def put(self, key, values):
+        """store a read-only copy of the array, evicting old entries if over budget"""
+        if values.nbytes > self.max_bytes:
+            return values
+        values = values.copy()
+        values.setflags(write=False)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key).nbytes
+            self._entries[key] = values
+            self.nbytes += values.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+        return values
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """counters for monitoring"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def result_key(lamp, zv):
+    """content hash of a lamp's contribution to a zone"""
+    state = (lamp.calc_state, zv.calc_state)
+    return hashlib.sha256(repr(state).encode()).hexdigest()
+
+
+def filtered_key(lamp, zv):
+    """content hash of a lamp's filtered values in a zone"""
+    state = (lamp.calc_state, lamp.update_state, zv.calc_state, zv.update_state)
+    return hashlib.sha256(repr(("filtered",) + state).encode()).hexdigest()
+
+
+RESULT_CACHE = ResultCache()
@@ -1,6 +1,25 @@
 import streamlit as st
-import numpy as np
-from app.widget import close_results, set_val, persistent_checkbox
+from app.widget import close_results, set_val, persistent_checkbox, show_results
+from app.calculation import calculate_by_id, held_lamp_cache
+from app.compliance import check_compliance
+from app.jobs import is_preliminary
+from app.memory import get_footprint
+from app.perf import span
+from app.room_utils import ozone_increase
+from app.lamp_utils import scale_lamp, update_lamp_aim_point
+from app.optimizer import (
+    OBJECTIVES,
+    optimize,
+    apply_optimization,
+    get_pose_candidates,
+)
+from app.payloads import (
+    room_fingerprint,
+    zone_fingerprint,
+    get_payload,
+    with_options,
+    lazy_download_button,
+)
 from guv_calcs import PhotStandard
 
 # from ._top_ribbon import check_recalculation
@@ -9,6 +28,7 @@ ss = st.session_state
 SPECIAL_ZONES = ["WholeRoomFluence", "SkinLimits", "EyeLimits"]
 
 
+@span("results_page")
 def results_page():
     """display results in the customizable panel"""
     cols = st.columns([15, 1])
@@ -39,6 +59,16 @@ def results_page():
             for obj_id, msg in msgs.items():
                 if msg is not None and room_dict[obj_type][obj_id]['enabled']:
                     st.warning(msg)
+    preliminary = [
+        zone.name for zone in ss.room.calc_zones.values() if is_preliminary(zone)
+    ]
+    if preliminary:
+        msg = f"Preliminary results for {', '.join(preliminary)}, calculated on a coarser grid and interpolated. "
+        if ss.get("calc_job") is not None:
+            msg += "They will be replaced with full-resolution results as soon as they are ready."
+        else:
+            msg += "Calculate again for full-resolution results."
+        st.info(msg)
     # if we're good print the results
     print_summary()
     zones = ss.room.calc_zones
@@ -51,12 +81,20 @@ def results_page():
     eye = ss.room.calc_zones["EyeLimits"]
     if skin.enabled or eye.enabled:
         print_safety()
+    print_dimming()
     print_efficacy()
     print_airchem()
 
     export_options()
 
+    footprint = get_footprint(ss.room)
+    st.caption(
+        f"Results in memory: {footprint.private / 1024**2:.1f} MB held by this session, "
+        f"and {footprint.shared / 1024**2:.1f} MB shared with other sessions."
+    )
+
 
+@span("print_summary")
 def print_summary():
     st.subheader("Summary", divider="grey")
     fluence_values = ss.room.calc_zones["WholeRoomFluence"].get_values()
@@ -94,11 +132,12 @@ def print_summary():
 
     st.download_button(
         "Generate Report",
-        data=ss.room.generate_report(),
+        data=get_payload("report", ss.room.generate_report, room_fingerprint(ss.room)),
         file_name="guv_report.csv",
     )
 
 
+@span("print_user_defined_zones")
 def print_user_defined_zones():
 
     """all user-defined calc zones, basic stats and"""
@@ -140,7 +179,9 @@ def print_user_defined_zones():
             try:
                 cols[1].download_button(
                     "Export Values",
-                    data=zone.export(),
+                    data=get_payload(
+                        f"zone_{zone_id}", zone.export, zone_fingerprint(zone)
+                    ),
                     file_name=zone.name + ".csv",
                     use_container_width=True,
                     disabled=True if zone.values is None else False,
@@ -149,6 +190,7 @@ def print_user_defined_zones():
                 pass
 
 
+@span("print_safety")
 def print_safety():
     """print photobiological safety results"""
     st.subheader(
@@ -163,6 +205,11 @@ def print_safety():
         key="room_standard_results",
         help="The ANSI IES RP 27.1-22 standard corresponds to the photobiological limits for UV exposure set by the American Conference of Governmental Industrial Hygienists (ACGIH). The IEC 62471-6:2022 standard corresponds to the limits set by the International Commission on Non-Ionizing Radiation Protection (ICNIRP). Both standards indicate that the measurement should be taken at 1.8 meters up from the floor, but UL8802 (Ultraviolet (UV) Germicidal Equipment and Systems) indicates that it should be taken at 1.9 meters instead. Additionally, though ANSI IES RP 27.1-22 indicates that eye exposure limits be taken with a 80 degere field of view parallel to the floor, considering only vertical irradiance, UL8802 indicates that measurements be taken in the 'worst case' direction, resulting in a stricter limit.",
     )
+    st.checkbox(
+        "Refine maxima",
+        key="refine_maxima",
+        help="Search between the points of the skin and eye planes for higher doses, refining the grid around each local maximum until the dose there varies by less than 0.1%. This finds the maximum weighted dose accurately without reducing the grid spacing. Plots still show the regular grid.",
+    )
 
     skin = ss.room.calc_zones["SkinLimits"]
     eye = ss.room.calc_zones["EyeLimits"]
@@ -238,11 +285,11 @@ def print_safety():
                 )
 
 
+@span("check_lamps")
 def check_lamps(room, warn=True):
     """
-    Iterate through every lamp in the Room object and assess whether it
-    individually exceeds the skin or eye limits.  If warn is True, print a
-    warning and dimming recommendation
+    Assess whether each lamp in the Room object individually exceeds the skin
+    or eye limits.  If warn is True, print a warning and dimming recommendation
 
     Then, check if the combination of all lamps exceeds the limits, even if no
     individual lamp does.
@@ -252,79 +299,41 @@ def check_lamps(room, warn=True):
 
     Return the weighted skin and eye dose, which must be < 3 mJ to be compliant.
 
-    TODO: Possibly worth moving this function into guv-calcs instead.
-
+    The numbers themselves come from `app.compliance`; this only renders them.
     """
 
-    skin = room.calc_zones["SkinLimits"]
-    eye = room.calc_zones["EyeLimits"]
-    skin_values = skin.get_values()
-    eye_values = eye.get_values()
-
-    skindims, eyedims = {}, {}
-    weighted_skin_dose = np.zeros(skin_values.shape)
-    weighted_eye_dose = np.zeros(eye_values.shape)
-
-    dimmed_weighted_skin_dose = np.zeros(skin_values.shape)
-    dimmed_weighted_eye_dose = np.zeros(eye_values.shape)
+    result = check_compliance(room, refine=ss.get("refine_maxima", False))
+    weighted_skin_dose = result.weighted_skin_dose
+    weighted_eye_dose = result.weighted_eye_dose
+    if not warn:
+        return weighted_skin_dose, weighted_eye_dose
 
     # check if any individual lamp exceeds the limits
+    lamp_dims = result.lamp_dims()
     for lampid, lamp in room.lamps.items():
-        if lampid in eye.lamp_cache.keys() and lampid in skin.lamp_cache.keys():
-            # fetch the limits for this specific lamp
-            skinmax, eyemax = room.lamps[lampid].get_tlvs(room.standard)
-            # these are irradiance values, not dose
-            skinrad, eyerad = skin.lamp_cache[lampid].values, eye.lamp_cache[lampid].values
-            # to dose
-            skinvals, eyevals = skinrad * 3.6 * skin.hours, eyerad * 3.6 * eye.hours
-            # weighting function for this specific lamp
-            skinweight, eyeweight = 3 / skinmax, 3 / eyemax
-            # % dimming required to be compliant
-            skindim, eyedim = skinmax / skinvals.max(), eyemax / eyevals.max()
-            # add to total dose
-            weighted_skin_dose += skinvals * skinweight
-            weighted_eye_dose += eyevals * eyeweight
-
-            skindims[lampid], eyedims[lampid] = skindim, eyedim
-            total_dim = min(skindim, eyedim, 1)
-            dimmed_weighted_eye_dose += eyevals * eyeweight * total_dim
-            dimmed_weighted_skin_dose += skinvals * skinweight * total_dim
-
+        if lampid in lamp_dims:
+            skindim, eyedim = lamp_dims[lampid]
             # individual lamp check
-            if min(skindim, eyedim, 1) < 1:
-                skindim, eyedim = round(skindim * 100, 1), round(eyedim * 100, 1)
+            skindim, eyedim = round(skindim * 100, 1), round(eyedim * 100, 1)
+            if min(skindim, eyedim) < 100:
                 if skindim < 100:
                     string = f"{lamp.name} must be dimmed to **{skindim}%** its present power to comply with selected skin TLVs"
                     if eyedim < 100:
                         string += f" and to **{eyedim}%** to comply with eye TLVs."
                 elif eyedim < 100:
                     string = f"{lamp.name} must be dimmed to **{eyedim}%** its present power comply with selected eye TLVs"
-                if warn:
-                    st.warning(string)
+                st.warning(string)
 
             if (
                 lamp.guv_type != "Low-pressure mercury (254 nm)"
                 and lamp.spectra is None
                 and lamp.filedata is not None
-                and warn
             ):
                 msg = f"{lamp.name} is missing a spectrum. Photobiological safety calculations may be inaccurate."
                 st.warning(msg)
 
     # Check if seemingly-compliant installations actually aren't
-    dimvals = list(skindims.values()) + list(eyedims.values())
-    DIMMING_NOT_REQUIRED = all([dim > 1 for dim in dimvals])
-    LAMPS_COMPLIANT = (
-        max(weighted_skin_dose.max().round(2), weighted_eye_dose.max().round(2)) <= 3
-    )
-    DIMMED_LAMPS_COMPLIANT = (
-        max(
-            dimmed_weighted_skin_dose.max().round(2),
-            dimmed_weighted_eye_dose.max().round(2),
-        )
-        <= 3
-    )
-    if DIMMING_NOT_REQUIRED and not LAMPS_COMPLIANT:
+    if result.dimming_not_required and not result.lamps_compliant:
         string = "Though all lamps are individually compliant, dose must be reduced to "
         skindim = round(3 / weighted_skin_dose.max() * 100, 1)
         eyedim = round(3 / weighted_eye_dose.max() * 100, 1)
@@ -338,30 +347,111 @@ def check_lamps(room, warn=True):
             string += (
                 f"**{eyedim}%** its present value to comply with selected eye TLVs"
             )
-        if warn:
-            st.warning(string)
+        st.warning(string)
 
     # check if dimming will make the installation compliant
-    if not DIMMED_LAMPS_COMPLIANT:
+    if not result.dimmed_lamps_compliant:
         string = "Even after applying dimming, this installation may not be compliant. Dose must be reduced to "
         skindim = round(3 / weighted_skin_dose.max() * 100, 1)
         eyedim = round(3 / weighted_eye_dose.max() * 100, 1)
-        if dimmed_weighted_skin_dose.max() > 3:
+        if result.dimmed_weighted_skin_dose.max() > 3:
             string += (
                 f"**{skindim}%** its present value to comply with selected skin TLVs"
             )
-            if dimmed_weighted_eye_dose.max() > 3:
+            if result.dimmed_weighted_eye_dose.max() > 3:
                 string += f" and to {eyedim}% to comply with eye TLVs."
-        elif dimmed_weighted_eye_dose.max() > 3:
+        elif result.dimmed_weighted_eye_dose.max() > 3:
             string += (
                 f"**{eyedim}%** its present value to comply with selected eye TLVs"
             )
-        if warn:
-            st.warning(string)
+        st.warning(string)
 
     return weighted_skin_dose, weighted_eye_dose
 
 
+@span("print_dimming")
+def print_dimming():
+    """per-luminaire dimming sliders, which rescale the results in place"""
+    lamps = ss.room.scene.get_valid_lamps()
+    zones = ss.room.calc_zones.values()
+    if len(lamps) == 0 or all(zone.values is None for zone in zones):
+        return
+    st.subheader(
+        "Luminaire Dimming",
+        divider="grey",
+        help="Dim or boost each luminaire's output relative to its photometry file. Results scale with luminaire output, so the doses, compliance and pathogen reduction above and below update without recalculating. This is the same as scaling the luminaire's photometry by a relative value in the luminaire editor.",
+    )
+    ref_manager = ss.room.ref_manager
+    if ref_manager.enabled and any(ref_manager.reflectances.values()):
+        st.caption(
+            "Reflectance is enabled, so results must be recalculated after dimming a luminaire."
+        )
+    cols = st.columns(min(len(lamps), 3))
+    for i, (lamp_id, lamp) in enumerate(lamps.items()):
+        power = round(lamp.scaling_factor * 100)
+        ss[f"dimming_{lamp_id}"] = power
+        cols[i % len(cols)].slider(
+            lamp.name,
+            min_value=1,
+            max_value=max(100, power),
+            format="%d%%",
+            key=f"dimming_{lamp_id}",
+            on_change=update_lamp_dimming,
+            args=[lamp],
+        )
+    print_optimizer()
+
+
+def print_optimizer():
+    """find and apply the dimming, and optionally poses, with the most fluence"""
+    st.write("**Optimize luminaires**")
+    cols = st.columns(3)
+    cols[0].selectbox(
+        "Maximize",
+        options=list(OBJECTIVES.keys()),
+        format_func=lambda x: OBJECTIVES[x],
+        key="optimize_objective",
+    )
+    cols[1].number_input(
+        "Maximum output (%)",
+        min_value=1,
+        value=100,
+        key="optimize_max_output",
+        help="The highest output any luminaire may be run at, relative to its photometry file.",
+    )
+    cols[2].checkbox(
+        "Also try tilts and orientations",
+        key="optimize_poses",
+        help="Each luminaire is also tried at every combination of the tilts and orientations below, and moved to the best one.",
+    )
+    if ss.get("optimize_poses"):
+        cols = st.columns(2)
+        cols[0].text_input("Tilts (°)", value="0, 15, 30, 45", key="optimize_tilts")
+        cols[1].text_input(
+            "Orientations (°)", value="0, 90, 180, 270", key="optimize_orientations"
+        )
+    st.button("Optimize", on_click=run_optimization)
+
+    if ss.get("optimization_error") is not None:
+        st.error(ss.optimization_error)
+    result = ss.get("optimization")
+    if result is None or not result.is_current(ss.room):
+        return
+    label = OBJECTIVES[result.objective]
+    st.write(f"{label}: **{result.before:.3f}** → **:violet[{result.after:.3f}]**")
+    for lamp_id, scale in result.scales.items():
+        lamp = ss.room.lamps[lamp_id]
+        msg = (
+            f"{lamp.name}: {round(lamp.scaling_factor * 100)}% → {round(scale * 100)}%"
+        )
+        if lamp_id in result.poses:
+            tilt, orientation = result.poses[lamp_id]
+            msg += f", tilted {tilt}° at {orientation}°"
+        st.write(msg)
+    st.button("Apply", on_click=apply_optimization_results, type="primary")
+
+
+@span("print_efficacy")
 def print_efficacy():
     """print germicidal efficacy results"""
     st.subheader(
@@ -399,6 +489,7 @@ def print_efficacy():
         )
 
 
+@span("print_airchem")
 def print_airchem():
     """display indoor air chemistry results"""
     st.subheader(
@@ -426,9 +517,11 @@ def print_airchem():
         help="An initial ozone decay constant of 2.7 is typical of indoor environments (Nazaroff and Weschler; DOI: 10.1111/ina.12942); ",
     )
     
-    fluence_values = ss.room.fluence_at(wavelength=222, zone_id="WholeRoomFluence")
-    if fluence_values is not None:
-        ozone_ppb = calculate_ozone_increase()
+    with held_lamp_cache(ss.room, "WholeRoomFluence"):
+        fluence_values = ss.room.fluence_at(wavelength=222, zone_id="WholeRoomFluence")
+    # the fluence zone may not be calculated yet if a calculation is in progress
+    ozone_ppb = ozone_increase(ss.room)
+    if fluence_values is not None and ozone_ppb is not None:
         ozone_color = "red" if ozone_ppb > 5 else "blue"
         ozone_str = f":{ozone_color}[**{round(ozone_ppb,2)} ppb**]"
     else:
@@ -436,20 +529,7 @@ def print_airchem():
     st.write(f"Estimated increase in indoor ozone from UV: {ozone_str}")
 
 
-def calculate_ozone_increase():
-    """
-    ozone generation constant is currently hardcoded to 10 for GUV222
-    this should really be based on spectra instead, but the dependence is not very strong
-    at least for GUV222 sources
-    """
-    avg_fluence = ss.room.calc_zones["WholeRoomFluence"].values.mean()
-    ozone_gen = 10  # hardcoded for now, eventually should be based on spectra
-    ach = ss.room.air_changes
-    ozone_decay = ss.room.ozone_decay_constant
-    ozone_increase = avg_fluence * ozone_gen / (ach + ozone_decay)
-    return ozone_increase
-
-
+@span("export_options")
 def export_options():
     """
     a results-page option for exporting all results
@@ -459,9 +539,12 @@ def export_options():
     col, col2 = st.columns(2)
     include_plots = col2.checkbox("Include result plots")
 
-    col.download_button(
+    lazy_download_button(
+        col,
         "Export All Results",
-        data=ss.room.export_zip(include_plots=include_plots),
+        name="results_zip",
+        build=lambda: ss.room.export_zip(include_plots=include_plots),
+        fingerprint=lambda: with_options(room_fingerprint(ss.room), include_plots),
         file_name="illuminate.zip",
         use_container_width=True,
         type="primary",
@@ -472,7 +555,9 @@ def export_options():
         if zone.calctype in ["Plane", "Volume"]:
             col.download_button(
                 zone.name,
-                data=zone.export(),
+                data=get_payload(
+                    f"zone_{zone_id}", zone.export, zone_fingerprint(zone)
+                ),
                 file_name=zone.name + ".csv",
                 use_container_width=True,
                 disabled=True if zone.values is None else False,
@@ -492,8 +577,60 @@ def update_standard_results():
     ss["room_standard"] = ss.room.standard
     # recalculate if necessary eg: if value has changed
     if RECALCULATE:
-        ss.room.calculate_by_id("EyeLimits")
-        ss.room.calculate_by_id("SkinLimits")
+        calculate_by_id(ss.room, "EyeLimits")
+        calculate_by_id(ss.room, "SkinLimits")
+
+
+def update_lamp_dimming(lamp):
+    """scale the lamp to the slider value, and keep its scaling widgets in step"""
+    scale_lamp(lamp, "factor", ss[f"dimming_{lamp.lamp_id}"] / 100)
+    if f"scale_method_{lamp.lamp_id}" in ss:
+        ss[f"scale_method_{lamp.lamp_id}"] = "factor"
+        ss[f"scale_value_{lamp.lamp_id}"] = lamp.scaling_factor
+
+
+def run_optimization():
+    """optimize the room's luminaires with the current settings"""
+    ss.optimization = None
+    ss.optimization_error = None
+    poses = None
+    if ss.get("optimize_poses"):
+        try:
+            tilts = [float(x) for x in ss["optimize_tilts"].split(",") if x.strip()]
+            orientations = [
+                float(x) for x in ss["optimize_orientations"].split(",") if x.strip()
+            ]
+        except ValueError:
+            ss.optimization_error = "Tilts and orientations must be lists of numbers."
+            return
+        candidates = get_pose_candidates(tilts, orientations)
+        poses = {lamp_id: candidates for lamp_id in ss.room.lamps.keys()}
+    try:
+        with st.spinner("Optimizing...", show_time=True):
+            ss.optimization = optimize(
+                ss.room,
+                objective=ss["optimize_objective"],
+                max_scale=ss["optimize_max_output"] / 100,
+                poses=poses,
+            )
+    except ValueError as e:
+        ss.optimization_error = str(e)
+
+
+def apply_optimization_results():
+    """apply the optimized dimming and poses, and keep the lamp widgets in step"""
+    apply_optimization(ss.room, ss.optimization)
+    for lamp_id in ss.optimization.scales.keys():
+        lamp = ss.room.lamps[lamp_id]
+        if f"scale_method_{lamp_id}" in ss:
+            ss[f"scale_method_{lamp_id}"] = "factor"
+            ss[f"scale_value_{lamp_id}"] = lamp.scaling_factor
+        if f"tilt_{lamp_id}" in ss:
+            ss[f"tilt_{lamp_id}"] = lamp.bank
+            ss[f"orientation_{lamp_id}"] = lamp.heading
+            update_lamp_aim_point(lamp)
+    ss.optimization = None
+    show_results()
 
 
 def update_ozone_results():
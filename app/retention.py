@@ -0,0 +1,121 @@
+"""How calc zones hold each lamp's results once they are summed."""
+
+import os
+import zlib
+import numpy as np
+from guv_calcs.calc_manager import LampCacheEntry, ZoneCache
+
+POLICIES = ["keep", "compress", "drop"]
+
+# zlib level; higher levels barely compress float32 results any further
+LEVEL = 1
+
+
+def parse_retention(text):
+    """parse a comma-separated list of zone type or zone id = policy"""
+    retention = {"plane": "keep", "volume": "keep"}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        target, _, policy = item.partition("=")
+        target, policy = target.strip(), policy.strip().lower()
+        if not target or policy not in POLICIES:
+            raise ValueError(
+                f"Invalid lamp cache retention {item.strip()!r}; "
+                f"expected zone type or id = one of {POLICIES}"
+            )
+        if target.lower() in ["plane", "volume"]:
+            target = target.lower()
+        retention[target] = policy
+    return retention
+
+
+RETENTION = parse_retention(os.environ.get("ILLUMINATE_LAMP_CACHE", ""))
+
+
+class PackedArray:
+    """
+    a compressed copy of an array. The bytes of each value are regrouped by
+    significance before compressing, so that exponents are stored together,
+    which shrinks float32 results by about 30%, where plain zlib manages
+    less than 20%
+    """
+
+    def __init__(self, array):
+        data = np.ascontiguousarray(np.ma.getdata(array))
+        mask = np.ma.getmask(array)
+        self.shape = data.shape
+        self.dtype = data.dtype
+        shuffled = data.view(np.uint8).reshape(-1, data.dtype.itemsize).T
+        self.data = zlib.compress(np.ascontiguousarray(shuffled).tobytes(), LEVEL)
+        self.mask = None
+        if mask is not np.ma.nomask and mask.any():
+            self.mask = zlib.compress(np.packbits(mask).tobytes(), LEVEL)
+
+    def __repr__(self):
+        return (
+            f"PackedArray(shape={self.shape}, dtype={self.dtype}, nbytes={self.nbytes})"
+        )
+
+    @property
+    def nbytes(self):
+        return len(self.data) + (0 if self.mask is None else len(self.mask))
+
+    def unpack(self):
+        """a new, writeable array equal to the packed one"""
+        raw = np.frombuffer(zlib.decompress(self.data), dtype=np.uint8)
+        data = raw.reshape(self.dtype.itemsize, -1).T.copy().view(self.dtype)
+        data = data.reshape(self.shape)
+        if self.mask is None:
+            return data
+        size = int(np.prod(self.shape))
+        bits = np.frombuffer(zlib.decompress(self.mask), dtype=np.uint8)
+        mask = np.unpackbits(bits, count=size).astype(bool).reshape(self.shape)
+        return np.ma.masked_array(data, mask=mask)
+
+
+def get_policy(zone):
+    """the retention policy of a calc zone"""
+    if zone.zone_id in RETENTION:
+        return RETENTION[zone.zone_id]
+    return RETENTION.get(zone.calctype.lower(), "keep")
+
+
+def retain(zone, cache):
+    """
+    a copy of a ZoneCache with the arrays of each entry held as the zone's
+    policy says. Entries that are already packed or dropped are left alone
+    """
+    policy = get_policy(zone)
+    if policy == "keep":
+        return cache
+    lamp_cache = {
+        lamp_id: _retain_entry(entry, policy)
+        for lamp_id, entry in cache.lamp_cache.items()
+    }
+    return ZoneCache(
+        lamp_cache=lamp_cache,
+        calc_state=cache.calc_state,
+        update_state=cache.update_state,
+    )
+
+
+def is_held(entry):
+    """true if an entry's arrays are held as arrays, rather than packed or dropped"""
+    return isinstance(entry.values, np.ndarray)
+
+
+def _retain_entry(entry, policy):
+    if not is_held(entry):
+        return entry
+    if policy == "compress":
+        base_values = PackedArray(entry.base_values)
+        values = PackedArray(entry.values)
+    else:
+        base_values, values = None, None
+    return LampCacheEntry(
+        base_values=base_values,
+        values=values,
+        calc_state=entry.calc_state,
+        update_state=entry.update_state,
+    )
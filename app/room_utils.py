@@ -0,0 +1,81 @@
+"""Room-level logic shared by the app and by headless tools."""
+
+from app.compliance import check_compliance
+
+# ozone generation constant, hardcoded for GUV222 for now
+OZONE_GENERATION = 10
+
+
+def limits_height(room):
+    """height, in room units, at which the skin and eye limits are evaluated"""
+    if "UL8802" in room.standard.upper():
+        return 1.9 if room.units == "meters" else 6.25
+    return 1.8 if room.units == "meters" else 5.9
+
+
+def disable_irrelevant_limits(room):
+    """disable the skin and eye limit zones if the room is too low for them"""
+    if room.z < limits_height(room):
+        room.calc_zones["SkinLimits"].enabled = False
+        room.calc_zones["EyeLimits"].enabled = False
+    return room
+
+
+def ozone_increase(room):
+    """
+    estimated increase in indoor ozone from UV, in ppb, or None if the
+    fluence has not been calculated.
+
+    ozone generation constant is currently hardcoded to 10 for GUV222
+    this should really be based on spectra instead, but the dependence is not very strong
+    at least for GUV222 sources
+    """
+    values = room.calc_zones["WholeRoomFluence"].values
+    if values is None:
+        return None
+    avg_fluence = values.mean()
+    ach = room.air_changes
+    ozone_decay = room.ozone_decay_constant
+    return avg_fluence * OZONE_GENERATION / (ach + ozone_decay)
+
+
+def summarize_room(room, refine=False):
+    """
+    headline results of a calculated room, as a flat dict. If `refine` is
+    True, the weighted dose maxima are refined off the regular grid
+    """
+    fluence = room.calc_zones["WholeRoomFluence"].get_values()
+    skin = room.calc_zones["SkinLimits"]
+    eye = room.calc_zones["EyeLimits"]
+    skin_values = skin.get_values() if skin.enabled else None
+    eye_values = eye.get_values() if eye.enabled else None
+
+    summary = {
+        "standard": room.standard.label,
+        "units": room.units,
+        "num_lamps": len(room.scene.get_valid_lamps()),
+        "mean_fluence": _number(fluence.mean()) if fluence is not None else None,
+        "skin_max": _number(skin_values.max()) if skin_values is not None else None,
+        "eye_max": _number(eye_values.max()) if eye_values is not None else None,
+        "weighted_skin_dose_max": None,
+        "weighted_eye_dose_max": None,
+        "compliant": None,
+        "compliant_after_dimming": None,
+        "lamps_needing_dimming": None,
+        "ozone_increase_ppb": _number(ozone_increase(room)),
+    }
+    if skin_values is not None and eye_values is not None:
+        result = check_compliance(room, refine=refine)
+        dims = result.lamp_dims()
+        summary["weighted_skin_dose_max"] = _number(result.weighted_skin_dose.max())
+        summary["weighted_eye_dose_max"] = _number(result.weighted_eye_dose.max())
+        summary["compliant"] = result.lamps_compliant
+        summary["compliant_after_dimming"] = result.dimmed_lamps_compliant
+        summary["lamps_needing_dimming"] = sum(
+            min(skin_dim, eye_dim) < 1 for skin_dim, eye_dim in dims.values()
+        )
+    return summary
+
+
+def _number(value):
+    return None if value is None else float(value)
@@ -0,0 +1,370 @@
+"""Memory budget for sessions, with the results of idle sessions spilled to disk."""
+
+import os
+import time
+import pickle
+import logging
+import weakref
+import threading
+from pathlib import Path
+from guv_calcs.calc_manager import LampCacheEntry, ZoneCache
+from streamlit.runtime.scriptrunner_utils.script_run_context import (
+    get_script_run_ctx,
+)
+from app.calculation import get_lamp_entry
+from app.retention import retain, is_held, get_policy
+from app.memory import get_footprint
+from app.jobs import is_preliminary
+
+logger = logging.getLogger(__name__)
+
+# bytes of private session state held in memory across all sessions before
+# idle sessions are spilled. 0 for no budget
+BUDGET = int(float(os.environ.get("ILLUMINATE_SESSION_BUDGET_MB", 2048)) * 1024**2)
+# seconds without a script run before a session may be spilled
+IDLE_SECONDS = float(os.environ.get("ILLUMINATE_SESSION_IDLE", 300))
+SPILL_DIR = Path(
+    os.environ.get(
+        "ILLUMINATE_SPILL_DIR", Path.home() / ".cache" / "illuminate" / "sessions"
+    )
+)
+
+# session state that is rebuilt on demand, so is simply dropped
+DROPPED_KEYS = ["payloads"]
+
+
+class SessionRecord:
+    """what the manager knows about one session"""
+
+    def __init__(self, session_id, state):
+        self.session_id = session_id
+        self.state = weakref.ref(state)
+        self.nbytes = 0
+        self.last_active = time.monotonic()
+        self.running = False
+        self.results = None  # parked results, until spilled or restored
+        self.path = None  # spill file, while the session is spilled
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        status = "spilled" if self.path is not None else "held"
+        return (
+            f"SessionRecord({self.session_id!r}, {status}, "
+            f"nbytes={self.nbytes}, idle={self.idle:.0f}s)"
+        )
+
+    @property
+    def idle(self):
+        """seconds since the session's last script run finished"""
+        return 0.0 if self.running else time.monotonic() - self.last_active
+
+
+class SessionManager:
+    """
+    thread-safe registry of sessions, which spills the idlest to disk when
+    those in memory exceed `budget` bytes. over budget, each session parks its
+    results with its record at the end of its script run, so that the spill
+    thread writes out only what was parked, and never touches session state
+    """
+
+    def __init__(self, budget=BUDGET, idle_seconds=IDLE_SECONDS, spill_dir=SPILL_DIR):
+        self.budget = budget
+        self.idle_seconds = idle_seconds
+        self.spill_dir = Path(spill_dir)
+        self.spills = 0
+        self.restores = 0
+        self._records = {}
+        self._lock = threading.Lock()
+        self._pending = threading.Event()
+        self._spiller = None
+
+    def enter(self, session_id, state):
+        """record the start of a script run, restoring any parked results"""
+        record = self._get_record(session_id, state)
+        with record.lock:
+            record.running = True
+            record.last_active = time.monotonic()
+            if record.results is not None or record.path is not None:
+                self._restore(record, state)
+
+    def leave(self, session_id, state):
+        """
+        record the end of a script run, and if over budget, park the session's
+        results and have the spill thread spill the idlest, so that this run
+        doesn't wait on it
+        """
+        record = self._get_record(session_id, state)
+        nbytes = get_session_bytes(state)
+        with record.lock:
+            record.nbytes = nbytes
+            record.last_active = time.monotonic()
+            record.running = False
+        if self.budget > 0 and self._get_held_bytes() > self.budget:
+            self._park(record, state)
+            self._start_spiller()
+            self._pending.set()
+
+    def enforce(self):
+        """spill the idlest sessions until those in memory are within budget"""
+        if self.budget <= 0:
+            return []
+        with self._lock:
+            records = [r for r in self._records.values() if r.path is None]
+        total = sum(record.nbytes for record in records)
+        spilled = []
+        for record in sorted(records, key=lambda record: record.last_active):
+            if total <= self.budget:
+                break
+            if self._spill(record):
+                total -= record.nbytes
+                spilled.append(record.session_id)
+        return spilled
+
+    def stats(self):
+        """counters for monitoring"""
+        with self._lock:
+            records = list(self._records.values())
+        held = [record for record in records if record.path is None]
+        return {
+            "sessions": len(records),
+            "held": len(held),
+            "spilled": len(records) - len(held),
+            "nbytes": sum(record.nbytes for record in held),
+            "budget": self.budget,
+            "spills": self.spills,
+            "restores": self.restores,
+        }
+
+    def _get_held_bytes(self):
+        with self._lock:
+            return sum(
+                record.nbytes
+                for record in self._records.values()
+                if record.path is None
+            )
+
+    def _start_spiller(self):
+        with self._lock:
+            if self._spiller is None:
+                self._spiller = threading.Thread(
+                    target=self._spill_forever, name="illuminate-spill", daemon=True
+                )
+                self._spiller.start()
+
+    def _spill_forever(self):
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            try:
+                self.enforce()
+            except Exception:
+                logger.exception("Could not enforce the session budget")
+
+    def _get_record(self, session_id, state):
+        with self._lock:
+            record = self._records.get(session_id)
+            if record is None or record.state() is not state:
+                record = SessionRecord(session_id, state)
+                self._records[session_id] = record
+                weakref.finalize(state, self._forget, record)
+            return record
+
+    def _forget(self, record):
+        """drop a closed session, and its spill file if it has one"""
+        with self._lock:
+            if self._records.get(record.session_id) is record:
+                del self._records[record.session_id]
+        if record.path is not None:
+            record.path.unlink(missing_ok=True)
+
+    def _park(self, record, state):
+        """
+        move a session's results out of its room and into its record. called
+        on the session's own script thread, so no callback is reading them
+        """
+        if "room" not in state or _is_busy(state):
+            return
+        room = state["room"]
+        with record.lock:
+            if record.results is not None or record.path is not None:
+                return
+            record.results = _get_private_results(room)
+            _drop_results(room)
+            for key in DROPPED_KEYS:
+                if key in state:
+                    del state[key]
+
+    def _spill(self, record):
+        """write an idle session's parked results to disk, releasing them"""
+        if not record.lock.acquire(blocking=False):
+            return False  # being entered
+        try:
+            if (
+                record.results is None
+                or record.running
+                or record.idle < self.idle_seconds
+            ):
+                return False
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            path = self.spill_dir / f"{os.getpid()}-{record.session_id}.pkl"
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(pickle.dumps(record.results, pickle.HIGHEST_PROTOCOL))
+            tmp.replace(path)
+            record.results = None
+            record.path = path
+            self.spills += 1
+            return True
+        except Exception:
+            logger.exception(f"Could not spill session {record.session_id}")
+            return False
+        finally:
+            record.lock.release()
+
+    def _restore(self, record, state):
+        """put parked results back, or leave them to be recalculated"""
+        if record.results is not None:
+            results = record.results
+            record.results = None
+        else:
+            try:
+                results = pickle.loads(record.path.read_bytes())
+            except Exception:
+                logger.exception(f"Could not restore session {record.session_id}")
+                results = {}
+            else:
+                self.restores += 1
+            finally:
+                record.path.unlink(missing_ok=True)
+                record.path = None
+        if "room" in state:
+            _restore_results(state["room"], results)
+
+
+SESSIONS = SessionManager()
+
+
+def enter_session():
+    """call at the start of every script run"""
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        SESSIONS.enter(ctx.session_id, ctx.session_state._state)
+
+
+def leave_session():
+    """call at the end of every script run, however it ends"""
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        SESSIONS.leave(ctx.session_id, ctx.session_state._state)
+
+
+def get_session_bytes(state):
+    """approximate private bytes held by a session's state"""
+    nbytes = get_footprint(state["room"]).private if "room" in state else 0
+    for _, _, payload in state["payloads"].values() if "payloads" in state else []:
+        nbytes += len(payload)
+    return nbytes
+
+
+def _is_busy(state):
+    """true if a session has work in flight that a spill would lose track of"""
+    if "calc_job" in state and state["calc_job"] is not None:
+        return True
+    room = state["room"] if "room" in state else None
+    return room is not None and any(
+        is_preliminary(zone) for zone in room.calc_zones.values()
+    )
+
+
+def _is_shared(entry):
+    """true if an entry's arrays are held in the result cache anyway"""
+    return (
+        is_held(entry)
+        and not entry.values.flags.writeable
+        and not entry.base_values.flags.writeable
+    )
+
+
+def _get_private_results(room):
+    """the per-lamp results only this room holds, by zone and lamp id"""
+    results = {}
+    for zone_id, zone in room.calc_zones.items():
+        results[zone_id] = {
+            lamp_id: (
+                entry.base_values,
+                entry.values,
+                entry.calc_state,
+                entry.update_state,
+            )
+            for lamp_id, entry in zone.calculator.cache.lamp_cache.items()
+            if entry.values is not None and not _is_shared(entry)
+        }
+    return results
+
+
+def _drop_results(room):
+    """drop every per-lamp result, leaving entries to be recalculated on demand"""
+    for zone in room.calc_zones.values():
+        cache = zone.calculator.cache
+        zone.calculator.cache = ZoneCache(
+            lamp_cache={
+                lamp_id: LampCacheEntry(
+                    base_values=None,
+                    values=None,
+                    calc_state=entry.calc_state,
+                    update_state=entry.update_state,
+                )
+                for lamp_id, entry in cache.lamp_cache.items()
+            },
+            calc_state=cache.calc_state,
+            update_state=cache.update_state,
+        )
+
+
+def _restore_results(room, results):
+    """
+    put back the results dropped by `_drop_results` in every zone whose policy
+    isn't to drop them: from `results` if they were written out, or else from
+    the result cache. Out of date results are left dropped, since they'll be
+    recalculated anyway
+    """
+    lamps = room.scene.get_valid_lamps()
+    for zone_id, zone in room.calc_zones.items():
+        cache = zone.calculator.cache
+        if (
+            get_policy(zone) == "drop"
+            or cache.calc_state != zone.calc_state
+            or cache.update_state != zone.update_state
+        ):
+            continue
+        spilled = results.get(zone_id, {})
+        lamp_cache = dict(cache.lamp_cache)
+        for lamp_id, entry in cache.lamp_cache.items():
+            if entry.values is not None:
+                continue  # recalculated since it was dropped
+            saved = spilled.get(lamp_id)
+            lamp = lamps.get(lamp_id)
+            if saved is not None and saved[2:] == (
+                entry.calc_state,
+                entry.update_state,
+            ):
+                base_values, values, calc_state, update_state = saved
+                lamp_cache[lamp_id] = LampCacheEntry(
+                    base_values=base_values,
+                    values=values,
+                    calc_state=calc_state,
+                    update_state=update_state,
+                )
+            elif (
+                lamp is not None
+                and entry.calc_state == lamp.calc_state
+                and entry.update_state == lamp.update_state
+            ):
+                lamp_cache[lamp_id] = get_lamp_entry(zone, lamp)
+        zone.calculator.cache = retain(
+            zone,
+            ZoneCache(
+                lamp_cache=lamp_cache,
+                calc_state=cache.calc_state,
+                update_state=cache.update_state,
+            ),
+        )
@@ -1,7 +1,17 @@
 import streamlit as st
 import json
 import guv_calcs
+from pathlib import Path
 from guv_calcs import Room
+from app.calculation import calculate_room
+from app.room_utils import disable_irrelevant_limits
+from app.profiling import RERUN, CALCULATION
+from app.payloads import (
+    room_fingerprint,
+    get_payload,
+    with_options,
+    lazy_download_button,
+)
 from app.widget import (
     initialize_room,
     initialize_zone,
@@ -29,11 +39,14 @@ def project_sidebar():
 
     st.download_button(
         label="Save Project",
-        data=ss.room.save(),
+        data=get_payload("project", ss.room.save, room_fingerprint(ss.room)),
         file_name="illuminate.guv",
         use_container_width=True,
         key="download_project",
     )
+    # hidden, so that a profile can be sent in with the project it was taken on
+    if st.query_params.get("profile") == "1":
+        profile_options()
     st.header("Load", divider="grey", help="Load a previously created .guv file")
 
     st.file_uploader(
@@ -59,19 +72,57 @@ def project_sidebar():
     col3, col4 = st.columns(2)
     plots = st.checkbox("Include plots")
     lampfiles = st.checkbox("Include lamp photometric (.ies) and spectrum (.csv) files")
-    col3.download_button(
+    lazy_download_button(
+        col3,
         "Export All",
-        data=ss.room.export_zip(
+        name="project_zip",
+        build=lambda: ss.room.export_zip(
             include_plots=plots,
             include_lamp_plots=plots,
             include_lamp_files=lampfiles,
         ),
+        fingerprint=lambda: with_options(room_fingerprint(ss.room), plots, lampfiles),
         file_name="illuminate.zip",
         use_container_width=True,
         key="export_all_project",
     )
 
 
+def profile_options():
+    """buttons to profile the next rerun or calculation, and the last profile"""
+    # set here rather than in a callback, which would run before this rerun
+    # started and so have it profile the click's own rerun
+    cols = st.columns(2)
+    if cols[0].button(
+        "Profile Next Rerun", key="profile_rerun", use_container_width=True
+    ):
+        ss.profile_next = RERUN
+    if cols[1].button(
+        "Profile Next Calculation", key="profile_calculation", use_container_width=True
+    ):
+        ss.profile_next = CALCULATION
+    if ss.get("profile_next") is not None:
+        st.caption(f"The next {ss.profile_next} will be profiled.")
+
+    profile = ss.get("profile")
+    if profile is None or not Path(profile["prof"]).exists():
+        return
+    st.caption(f"Last profile: a {profile['label']} of {profile['seconds']:.2f} s")
+    cols = st.columns(2)
+    for col, kind, label in [
+        (cols[0], "prof", "Download Profile"),
+        (cols[1], "stacks", "Download Stacks"),
+    ]:
+        path = Path(profile[kind])
+        col.download_button(
+            label=label,
+            data=path.read_bytes(),
+            file_name=path.name,
+            use_container_width=True,
+            key=f"download_profile_{kind}",
+        )
+
+
 def upload():
     """
     callback for uploading a .guv file
@@ -93,20 +144,18 @@ def upload():
             initialize_lamp(lamp)
             # make lampfile options
             if lamp.filename not in ss.vendored_lamps.keys():
-                ss.uploaded_files[lamp.filename] = lamp.filedata
+                fdata = lamp.filedata
+                if isinstance(fdata, str):
+                    fdata = fdata.encode()
+                if fdata is not None:
+                    ss.uploaded_files.add(lamp.filename, fdata)
 
         # disable standard calc zones if they're irrelevant
-        if "UL8802" in ss.room.standard:
-            height = 1.9 if ss.room.units == "meters" else 6.25
-        else:
-            height = 1.8 if ss.room.units == "meters" else 5.9
-        if ss.room.z < height:
-            ss.room.calc_zones["SkinLimits"].enabled = False
-            ss.room.calc_zones["EyeLimits"].enabled = False
+        disable_irrelevant_limits(ss.room)
 
         # update_calc_zones()
         if ss["calculate_after_loading"]:
-            ss.room.calculate()
+            calculate_room(ss.room)
             show_results()
         else:
             close_results()
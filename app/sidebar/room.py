@@ -3,6 +3,8 @@ import numpy as np
 from matplotlib import colormaps
 from app.widget import close_sidebar, set_val, add_keys, persistent_checkbox
 from guv_calcs import PhotStandard
+from app.room_utils import disable_irrelevant_limits
+from app.calculation import calculate_by_id
 
 ss = st.session_state
 
@@ -309,13 +311,7 @@ def update_room_z():
     ss.room.set_dimensions(z=z, preserve_spacing=False)
 
     # disable the standard zones
-    if "UL8802" in ss.room.standard.upper():
-        height = 1.9 if ss.room.units == "meters" else 6.25
-    else:
-        height = 1.8 if ss.room.units == "meters" else 5.9
-    if ss.room.z < height:
-        ss.room.calc_zones["SkinLimits"].enabled = False
-        ss.room.calc_zones["EyeLimits"].enabled = False
+    disable_irrelevant_limits(ss.room)
 
     # ss.room.calc_zones["WholeRoomFluence"].set_dimensions(
     # z2=ss.room.z,
@@ -420,5 +416,5 @@ def update_standard():
     ss["room_standard_results"] = ss.room.standard
     # recalculate if necessary eg: if value has changed
     if RECALCULATE:
-        ss.room.calculate_by_id("EyeLimits")
-        ss.room.calculate_by_id("SkinLimits")
+        calculate_by_id(ss.room, "EyeLimits")
+        calculate_by_id(ss.room, "SkinLimits")
@@ -0,0 +1,120 @@
+import streamlit as st
+import pandas as pd
+from app.sweep import (
+    ATTRIBUTES,
+    SweepParameter,
+    parse_values,
+    count_combinations,
+    run_sweep,
+    sweep_table,
+)
+from app.widget import close_sidebar
+
+ss = st.session_state
+
+
+def sweep_sidebar():
+    """sidebar content for sweeping lamp pose, room size and grid spacing"""
+
+    cols = st.columns([10, 1])
+    cols[0].header(
+        "Parameter Sweep",
+        divider="grey",
+        help="Calculate every combination of the values below, and tabulate the average fluence, maximum skin and eye dose, compliance and ozone increase of each. The room itself is not changed.",
+    )
+    cols[1].button(
+        "X",
+        on_click=close_sidebar,
+        key="close_sweep",
+        use_container_width=True,
+    )
+
+    options = get_sweep_options()
+    if "sweep_parameters" not in ss:
+        first = next(iter(options))
+        ss.sweep_parameters = pd.DataFrame({"Parameter": [first], "Values": [""]})
+    edited = st.data_editor(
+        ss.sweep_parameters,
+        num_rows="dynamic",
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "Parameter": st.column_config.SelectboxColumn(
+                options=list(options.keys()), required=True
+            ),
+            "Values": st.column_config.TextColumn(
+                help="Either a list, eg `0, 15, 45`, or an inclusive range given as start:stop:step, eg `0:45:15`. Lengths are in room units, angles in degrees."
+            ),
+        },
+        key="sweep_editor",
+    )
+
+    parameters, errors = [], []
+    for label, text in zip(edited["Parameter"], edited["Values"]):
+        if label not in options or not text:
+            continue
+        kind, attribute, target = options[label]
+        try:
+            parameters.append(
+                SweepParameter(kind, attribute, parse_values(text), target=target)
+            )
+        except ValueError as e:
+            errors.append(f"{label}: {e}")
+    for error in errors:
+        st.error(error)
+
+    num = count_combinations(parameters) if parameters else 0
+    cols = st.columns([2, 1])
+    cols[0].write(f"{num} combinations")
+    cols[1].button(
+        "Run Sweep",
+        on_click=request_sweep,
+        disabled=num == 0 or len(errors) > 0,
+        use_container_width=True,
+    )
+
+    if ss.get("sweep_requested"):
+        ss.sweep_requested = False
+        run_sweep_panel(parameters, num)
+
+    if ss.get("sweep_rows"):
+        table = sweep_table(ss.sweep_rows)
+        st.dataframe(table, hide_index=True, use_container_width=True)
+        st.download_button(
+            "Download Results",
+            data=table.to_csv(index=False),
+            file_name="sweep.csv",
+            use_container_width=True,
+        )
+
+
+def run_sweep_panel(parameters, num):
+    """run the sweep, streaming rows into the table as they are finished"""
+    ss.sweep_rows = []
+    progress = st.progress(0.0)
+    placeholder = st.empty()
+    for i, row in enumerate(run_sweep(ss.room, parameters)):
+        ss.sweep_rows.append(row)
+        progress.progress((i + 1) / num, text=f"{i + 1} of {num} combinations")
+        placeholder.dataframe(
+            sweep_table(ss.sweep_rows), hide_index=True, use_container_width=True
+        )
+    progress.empty()
+    placeholder.empty()
+
+
+def request_sweep():
+    ss.sweep_requested = True
+
+
+def get_sweep_options():
+    """map of display label to (kind, attribute, target) for every sweepable value"""
+    options = {}
+    for attribute in ATTRIBUTES["room"]:
+        options[f"Room {attribute}"] = ("room", attribute, None)
+    for lamp_id, lamp in ss.room.lamps.items():
+        for attribute in ATTRIBUTES["lamp"]:
+            options[f"{lamp.name} {attribute}"] = ("lamp", attribute, lamp_id)
+    for zone_id, zone in ss.room.calc_zones.items():
+        options[f"{zone.name} spacing"] = ("zone", "spacing", zone_id)
+    return options
@@ -0,0 +1,205 @@
+"""Parameter sweeps over lamp pose, room size and grid spacing."""
+
+import math
+import itertools
+import pandas as pd
+from app.calculation import (
+    calculate_room,
+    calculate_pairs,
+    plan_calculation,
+    NUM_WORKERS,
+)
+from app.result_cache import result_key
+from app.memory import copy_room
+from app.room_utils import disable_irrelevant_limits, summarize_room
+
+# what may be swept, by kind of target
+ATTRIBUTES = {
+    "room": ["x", "y", "z"],
+    "lamp": ["x", "y", "z", "tilt", "orientation"],
+    "zone": ["spacing"],
+}
+
+# the columns of summarize_room that make up a sweep row
+SUMMARY_FIELDS = [
+    "mean_fluence",
+    "skin_max",
+    "eye_max",
+    "weighted_skin_dose_max",
+    "weighted_eye_dose_max",
+    "compliant",
+    "ozone_increase_ppb",
+]
+
+# room dimensions first, since they move the standard zones; then lamp
+# positions, then aim, which depends on both
+_ORDER = {"room": 0, "lamp": 1, "zone": 3}
+
+
+class SweepParameter:
+    """
+    one swept quantity. `kind` is "room", "lamp" or "zone"; `target` is the
+    lamp or zone id, and is not needed for the room
+    """
+
+    def __init__(self, kind, attribute, values, target=None):
+        if kind not in ATTRIBUTES:
+            raise ValueError(f"kind must be one of {list(ATTRIBUTES)}")
+        if attribute not in ATTRIBUTES[kind]:
+            raise ValueError(f"{kind} attribute must be one of {ATTRIBUTES[kind]}")
+        if kind != "room" and target is None:
+            raise ValueError(f"a {kind} parameter needs a target id")
+        if len(values) == 0:
+            raise ValueError("a parameter needs at least one value")
+        self.kind = kind
+        self.attribute = attribute
+        self.values = [float(value) for value in values]
+        self.target = target
+
+    def __repr__(self):
+        return f"SweepParameter({self.name!r}, values={self.values})"
+
+    @property
+    def name(self):
+        """column name in the sweep table"""
+        return f"{self.target or self.kind} {self.attribute}"
+
+    @property
+    def order(self):
+        if self.kind == "lamp" and self.attribute in ["tilt", "orientation"]:
+            return 2
+        return _ORDER[self.kind]
+
+    def check(self, room):
+        """raise ValueError if this parameter doesn't apply to the room"""
+        if self.kind == "lamp" and self.target not in room.lamps:
+            raise ValueError(f"no luminaire {self.target!r}")
+        if self.kind == "zone" and self.target not in room.calc_zones:
+            raise ValueError(f"no calculation zone {self.target!r}")
+
+    def apply(self, room, value):
+        """set this parameter to `value` in the room"""
+        if self.kind == "room":
+            room.set_dimensions(**{self.attribute: value}, preserve_spacing=False)
+            if self.attribute == "z":
+                disable_irrelevant_limits(room)
+        elif self.kind == "lamp":
+            lamp = room.lamps[self.target]
+            if self.attribute == "tilt":
+                lamp.set_tilt(value, dimensions=room.dimensions)
+            elif self.attribute == "orientation":
+                lamp.set_orientation(value, room.dimensions)
+            else:
+                lamp.move(**{self.attribute: value})
+        else:
+            zone = room.calc_zones[self.target]
+            spacing = {"x_spacing": value, "y_spacing": value}
+            if zone.calctype == "Volume":
+                spacing["z_spacing"] = value
+            zone.set_spacing(**spacing)
+        return room
+
+
+def parse_values(text):
+    """
+    parse a comma-separated list of numbers, or an inclusive range given as
+    start:stop:step, eg "0, 15, 45" or "0:45:15"
+    """
+    text = text.strip()
+    if ":" in text:
+        start, stop, step = (float(part) for part in text.split(":"))
+        if step <= 0 or stop < start:
+            raise ValueError("ranges must be start:stop:step, with a positive step")
+        num = math.floor((stop - start) / step + 1e-9) + 1
+        return [round(start + i * step, 10) for i in range(num)]
+    return [float(part) for part in text.split(",") if part.strip()]
+
+
+def count_combinations(parameters):
+    return math.prod(len(parameter.values) for parameter in parameters)
+
+
+def run_sweep(room, parameters, workers=None, batch_size=None):
+    """
+    yield one row per combination of parameter values, in order. The room
+    itself is not changed.
+
+    Combinations are set up `batch_size` at a time, and the lamp x zone pairs
+    they need are spread over `workers` processes (NUM_WORKERS by default).
+    The rows are the same for any number of workers.
+    """
+    for parameter in parameters:
+        parameter.check(room)
+    workers = NUM_WORKERS if workers is None else workers
+    batch_size = batch_size or max(1, 2 * workers)
+    base = copy_room(room)
+    combinations = itertools.product(*[parameter.values for parameter in parameters])
+    while True:
+        batch = list(itertools.islice(combinations, batch_size))
+        if len(batch) == 0:
+            return
+        rooms = [set_combination(base, parameters, values) for values in batch]
+        if workers > 1:
+            precalculate([r for r in rooms if not isinstance(r, Exception)], workers)
+        for values, r in zip(batch, rooms):
+            yield summarize_combination(r, parameters, values)
+
+
+def set_combination(base, parameters, values):
+    """a copy of `base` with the parameters set to `values`, or the exception"""
+    try:
+        room = copy_room(base)
+        order = sorted(range(len(parameters)), key=lambda i: parameters[i].order)
+        for i in order:
+            parameters[i].apply(room, values[i])
+        return room
+    except Exception as e:
+        return e
+
+
+def precalculate(rooms, workers):
+    """
+    calculate the stale lamp x zone pairs of several rooms at once, over a
+    process pool, into the result cache. Pairs shared by several rooms are
+    only calculated once
+    """
+    pairs, lamps, views, seen = [], {}, {}, set()
+    for i, room in enumerate(rooms):
+        valid_lamps = room.scene.get_valid_lamps()
+        zone_views = {}
+        for lamp_id, zone_id in plan_calculation(room)[1]:
+            if zone_id not in zone_views:
+                zone_views[zone_id] = room.calc_zones[zone_id].to_view()
+            key = result_key(valid_lamps[lamp_id], zone_views[zone_id])
+            if key in seen:
+                continue
+            seen.add(key)
+            pair = (f"{i}/{lamp_id}", f"{i}/{zone_id}")
+            lamps[pair[0]] = valid_lamps[lamp_id]
+            views[pair[1]] = zone_views[zone_id]
+            pairs.append(pair)
+    calculate_pairs(pairs, lamps, views, workers=workers)
+
+
+def summarize_combination(room, parameters, values):
+    """calculate a room set up by `set_combination`, and reduce it to a row"""
+    row = {parameter.name: value for parameter, value in zip(parameters, values)}
+    try:
+        if isinstance(room, Exception):
+            raise room
+        calculate_room(room, workers=1)
+        summary = summarize_room(room)
+        row.update({field: summary[field] for field in SUMMARY_FIELDS})
+        row["error"] = None
+    except Exception as e:
+        row.update({field: None for field in SUMMARY_FIELDS})
+        row["error"] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def sweep_table(rows):
+    """a DataFrame of sweep rows, with the error column dropped if empty"""
+    df = pd.DataFrame(rows)
+    if "error" in df and df["error"].isna().all():
+        df = df.drop(columns="error")
+    return df
@@ -1,6 +1,11 @@
+import os
 import streamlit as st
 from guv_calcs.calc_zone import CalcPlane, CalcVol
 from app.lamp_utils import add_new_lamp
+from app.calculation import calculate_room, get_stale_pairs, get_stale_zones
+from app.jobs import submit_calculation, FAILED
+from app.perf import span
+from app.profiling import Capture, CALCULATION
 from app.widget import (
     initialize_lamp,
     initialize_zone,
@@ -15,11 +20,13 @@ from app.widget import (
 ss = st.session_state
 ADD_LAMP = "Add new luminaire"
 ADD_ZONE = "Add new calculation zone"
+# run calculations in the background and show progress, rather than blocking
+BACKGROUND_CALC = os.environ.get("ILLUMINATE_BACKGROUND_CALC", "1") == "1"
 
 
 def top_ribbon():
 
-    c = st.columns([1, 1, 1, 2, 2, 1])
+    c = st.columns([1, 1, 1, 1, 2, 2, 1])
 
     # with c[0]:
     c[0].button("About", on_click=show_about, use_container_width=True)
@@ -27,6 +34,7 @@ def top_ribbon():
         "Project", disabled=False, on_click=show_project, use_container_width=True
     )
     c[2].button("Edit Room", on_click=show_room, use_container_width=True)
+    c[3].button("Sweep", on_click=show_sweep, use_container_width=True)
     # c[3].button(
     # "Add Luminaire", on_click=add_new_lamp, use_container_width=True
     # )
@@ -37,7 +45,7 @@ def top_ribbon():
     lamp_sel_idx = lamp_ids.index(ss.selected_lamp_id)
     # if 'lamp_select' not in ss:
     # ss['lamp_select']=lamp_sel_idx
-    c[3].selectbox(
+    c[4].selectbox(
         "Select luminaire to edit",
         options=range(len(lamp_names)),
         format_func=lambda x: lamp_names[x],
@@ -60,7 +68,7 @@ def top_ribbon():
         zone_sel_idx = zone_ids.index(ss.selected_zone_id)
     else:
         zone_sel_idx = 0
-    c[4].selectbox(
+    c[5].selectbox(
         "Select calculation zone to edit",
         options=range(len(zone_names)),
         format_func=lambda x: zone_names[x],
@@ -71,27 +79,29 @@ def top_ribbon():
         key="zone_select",
     )
 
-    if check_recalculation():
+    recalc, update = check_recalculation()
+    if recalc or update or get_stale_zones(ss.room):
         button_type = "primary"
     else:
         button_type = "secondary"
 
-    c[5].button(
+    num_lamps = len(ss.room.scene.get_valid_lamps())
+    num_zones = len([zone for zone in ss.room.calc_zones.values() if zone.enabled])
+    c[6].button(
         "Calculate!",
         on_click=calculate,
         type=button_type,
         use_container_width=True,
+        help=f"{len(recalc)} of {num_lamps * num_zones} luminaire / calculation zone pairs need recalculating, and {len(update)} only need updating",
     )
 
 
 def check_recalculation():
-    recalculate = False
-    # if any([v.enabled and v.filedata is not None for v in ss.room.lamps.values()]):
-    CALC = ss.room.calc_state != ss.room.get_calc_state()
-    UPDATE = ss.room.update_state != ss.room.get_update_state()
-    if CALC or UPDATE:
-        recalculate = True
-    return recalculate
+    """
+    return the (lamp_id, zone_id) pairs that need recalculating, and those
+    that only need updating
+    """
+    return get_stale_pairs(ss.room)
 
 
 def show_about():
@@ -109,6 +119,13 @@ def show_project():
     clear_zone_cache()
 
 
+def show_sweep():
+    """update sidebar to show the parameter sweep panel"""
+    ss.editing = "sweep"
+    clear_lamp_cache()
+    clear_zone_cache()
+
+
 def show_room():
     """update sidebar to show room editing interface"""
     ss.editing = "room"
@@ -164,13 +181,74 @@ def update_zone_select(zone_ids):
         clear_lamp_cache()
 
 
+@span("calculate")
 def calculate():
     """calculate and show results in right pane"""
-    with st.spinner("Calculating...", show_time=True):
-        ss.room.calculate()
+    capture = None
+    if ss.get("profile_next") == CALCULATION:
+        capture = Capture(CALCULATION).start()
+    if capture is not None:
+        # in the foreground, so that all of the calculation is profiled
+        ss.profile_next = None
+        if ss.get("calc_job") is not None:
+            ss.calc_job.cancel()
+            ss.calc_job = None
+        try:
+            with st.spinner("Calculating and profiling...", show_time=True):
+                calculate_room(ss.room)
+        finally:
+            ss.profile = capture.stop().save()
+    elif BACKGROUND_CALC:
+        if ss.get("calc_job") is not None:
+            ss.calc_job.cancel()
+        ss.calc_job = submit_calculation(ss.room)
+    else:
+        with st.spinner("Calculating...", show_time=True):
+            calculate_room(ss.room)
     show_results()
 
 
+@st.fragment(run_every=1)
+def calculation_progress():
+    """poll the background calculation, and publish zones as they finish"""
+    job = ss.calc_job
+    published = job.publish(ss.room)
+    if job.status == FAILED:
+        cols = st.columns([5, 1])
+        cols[0].error(f"Calculation failed: {job.error}")
+        cols[1].button("Dismiss", on_click=clear_calculation, use_container_width=True)
+        return
+    if job.finished:
+        ss.calc_job = None
+    if published or job.finished:
+        show_results()
+        st.rerun()
+
+    zones_done = len(job.zones_done)
+    text = (
+        f"Calculating... {zones_done} of {job.zones_total} calculation zones, "
+        f"{job.pairs_done} of {job.pairs_total} luminaire / calculation zone pairs done"
+    )
+    if job.preview:
+        text = (
+            f"Calculating a preview... {job.pairs_done} of {job.pairs_total} "
+            "luminaire / calculation zone pairs done"
+        )
+    cols = st.columns([5, 1])
+    cols[0].progress(job.progress, text=text)
+    cols[1].button("Cancel", on_click=cancel_calculation, use_container_width=True)
+
+
+def cancel_calculation():
+    """stop the background calculation. zones already finished are kept"""
+    if ss.get("calc_job") is not None:
+        ss.calc_job.cancel()
+
+
+def clear_calculation():
+    ss.calc_job = None
+
+
 def add_new_zone():
     """necessary logic for adding new calc zone to room and to state"""
     # clear_zone_cache()
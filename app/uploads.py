@@ -0,0 +1,148 @@
+"""Process-wide store of uploaded lamp files, addressed by content."""
+
+import copy
+import hashlib
+import weakref
+import threading
+
+
+class Upload:
+    """an uploaded file and the object parsed from it. treat as read-only"""
+
+    def __init__(self, digest, data, parsed):
+        self.digest = digest
+        self.data = data
+        self.parsed = parsed
+        self.refs = 0
+
+    def __repr__(self):
+        return f"Upload({self.digest[:12]}, nbytes={len(self.data)}, refs={self.refs})"
+
+    def get_parsed(self):
+        """a private copy of the parsed object"""
+        return copy.deepcopy(self.parsed)
+
+
+class UploadStore:
+    """
+    thread-safe, reference counted store of uploads by the SHA-256 digest of
+    their bytes and of how they are parsed, so that the same bytes uploaded
+    as two kinds of file are stored apart
+    """
+
+    def __init__(self):
+        self.parses = 0
+        self.hits = 0
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._uploads)
+
+    def add(self, data, parse):
+        """
+        take a reference to an upload, storing it and parsing it with
+        `parse(data)` only if it isn't stored already, and return its digest.
+        Parse errors are raised, and nothing is stored
+        """
+        digest = _get_digest(data, parse)
+        with self._lock:
+            upload = self._uploads.get(digest)
+            if upload is not None:
+                upload.refs += 1
+                self.hits += 1
+                return digest
+        parsed = parse(data)
+        with self._lock:
+            upload = self._uploads.setdefault(digest, Upload(digest, data, parsed))
+            upload.refs += 1
+            self.parses += 1
+        return digest
+
+    def get(self, digest):
+        """the stored upload, or None"""
+        with self._lock:
+            return self._uploads.get(digest)
+
+    def release(self, digest):
+        """drop a reference to an upload, and the upload with the last one"""
+        with self._lock:
+            upload = self._uploads.get(digest)
+            if upload is None:
+                return
+            upload.refs -= 1
+            if upload.refs <= 0:
+                del self._uploads[digest]
+
+    def stats(self):
+        """counters for monitoring"""
+        with self._lock:
+            uploads = list(self._uploads.values())
+        return {
+            "entries": len(uploads),
+            "nbytes": sum(len(upload.data) for upload in uploads),
+            "refs": sum(upload.refs for upload in uploads),
+            "parses": self.parses,
+            "hits": self.hits,
+        }
+
+
+UPLOADS = UploadStore()
+
+
+class UploadIndex:
+    """
+    one session's uploads of one kind, by filename. `parse` turns the bytes
+    of a file into the object lamps are loaded from. References into the
+    store are released when the index is garbage collected
+    """
+
+    def __init__(self, parse, store=None):
+        self.parse = parse
+        self.store = UPLOADS if store is None else store
+        self._digests = {}
+        weakref.finalize(self, _release_all, self.store, self._digests)
+
+    def __repr__(self):
+        return f"UploadIndex({list(self._digests)})"
+
+    def __contains__(self, fname):
+        return fname in self._digests
+
+    def __iter__(self):
+        return iter(self._digests)
+
+    def __len__(self):
+        return len(self._digests)
+
+    def keys(self):
+        return self._digests.keys()
+
+    def add(self, fname, data):
+        """store a file under this name, replacing any file of the same name"""
+        digest = self.store.add(data, self.parse)
+        old = self._digests.get(fname)
+        self._digests[fname] = digest
+        if old is not None:
+            self.store.release(old)
+        return digest
+
+    def get(self, fname):
+        """the Upload stored under this name"""
+        return self.store.get(self._digests[fname])
+
+    def get_parsed(self, fname):
+        """a private copy of the object parsed from the file under this name"""
+        return self.get(fname).get_parsed()
+
+
+def _release_all(store, digests):
+    for digest in digests.values():
+        store.release(digest)
+
+
+def _get_digest(data, parse):
+    """the key of an upload in the store"""
+    digest = hashlib.sha256(f"{parse.__module__}.{parse.__qualname__}\0".encode())
+    digest.update(data)
+    return digest.hexdigest()
@@ -1,6 +1,8 @@
 import streamlit as st
 import warnings
 from guv_calcs import CalcPlane, CalcVol
+from app.calculation import held_lamp_cache
+from app.perf import span
 
 ss = st.session_state
 SELECT_LOCAL = "Select local file..."
@@ -341,5 +343,6 @@ def show_results():
     # format the figure and disinfection table now so we don't redo it later
     fluence = ss.room.calc_zones["WholeRoomFluence"]
     if fluence.values is not None:
-        ss.kdf = ss.room.disinfection_table(zone_id="WholeRoomFluence")
-        ss.kfig = ss.room.disinfection_plot(zone_id="WholeRoomFluence")
+        with span("disinfection_table"), held_lamp_cache(ss.room, "WholeRoomFluence"):
+            ss.kdf = ss.room.disinfection_table(zone_id="WholeRoomFluence")
+            ss.kfig = ss.room.disinfection_plot(zone_id="WholeRoomFluence")
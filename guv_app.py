@@ -1,15 +1,27 @@
+import logging
 import streamlit as st
 from app.init_app import initialize, room_plot
-from app.top_ribbon import top_ribbon
+from app.sessions import enter_session, leave_session
+from app.metrics import start_metrics_server
+from app.perf import begin_rerun, end_rerun
+from app.profiling import begin_profile, end_profile
+from app.perf_panel import perf_panel
+from app.top_ribbon import top_ribbon, calculation_progress
 from app.results import results_page
 from app.sidebar.lamp import lamp_sidebar
 from app.sidebar.zone import zone_sidebar
 from app.sidebar.room import room_sidebar
 from app.sidebar.project import project_sidebar
+from app.sidebar.sweep import sweep_sidebar
 from app.sidebar.default import default_sidebar
 
 # from app._widget import show_results
 
+# show the app's own info messages, such as how long startup took; nothing
+# else logs to the root logger, so this only adds a handler the first time
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger("app").setLevel(logging.INFO)
+
 # layout / page setup
 st.set_page_config(
     page_title="Illuminate",
@@ -46,53 +58,72 @@ CONTACT_STR = "Questions? Comments? Found a bug? Want a feature? E-mail contact@
 
 # Check and initialize session state variables
 ss = st.session_state
-if "init" not in ss:
-    ss.init = True
-    initialize()
-
-top_ribbon()
-if ss.show_results or ss.editing is not None:
-    left_pane, right_pane = st.columns([2, 3])
-else:
-    left_pane, right_pane = st.columns([1, 100])
+start_metrics_server()  # once per process
+enter_session()
+begin_rerun(ss)
+begin_profile(ss)
+try:
+    if "init" not in ss:
+        ss.init = True
+        initialize()
 
+    top_ribbon()
+    if ss.get("calc_job") is not None:
+        calculation_progress()
+    if ss.show_results or ss.editing is not None:
+        left_pane, right_pane = st.columns([2, 3])
+    else:
+        left_pane, right_pane = st.columns([1, 100])
 
-with left_pane:
-    if ss.editing is not None:
-        if ss.editing == "lamps" and ss.selected_lamp_id is not None:
-            lamp_sidebar()
-        elif ss.editing in ["zones", "planes", "volumes"] and ss.selected_zone_id:
-            zone_sidebar()
-        elif ss.editing == "room":
-            room_sidebar()
-        elif ss.editing == "about":
-            default_sidebar()
-        elif ss.editing == "project":
-            project_sidebar()
+    with left_pane:
+        if ss.editing is not None:
+            if ss.editing == "lamps" and ss.selected_lamp_id is not None:
+                lamp_sidebar()
+            elif ss.editing in ["zones", "planes", "volumes"] and ss.selected_zone_id:
+                zone_sidebar()
+            elif ss.editing == "room":
+                room_sidebar()
+            elif ss.editing == "about":
+                default_sidebar()
+            elif ss.editing == "project":
+                project_sidebar()
+            elif ss.editing == "sweep":
+                sweep_sidebar()
+            else:
+                st.write("")
+            if ss.show_results:
+                # add this here since it'll look nicer than on the results side
+                st.markdown(CONTACT_STR)
         else:
-            st.write("")
-        if ss.show_results:
-            # add this here since it'll look nicer than on the results side
-            st.markdown(CONTACT_STR)
-    else:
+            if ss.show_results:
+                room_plot()
+                st.markdown(CONTACT_STR)
+            # if not ss.show_results, then this is an empty panel
+
+    with right_pane:
+        cols = st.columns(2)
+        show_room = st.button("Show Updated Room", use_container_width=True)
         if ss.show_results:
-            room_plot()
+            if show_room and ss.editing is not None:
+                room_plot()
+                ss.show_room = False
+            results_page()
+        else:
+            if show_room or ss.show_room:
+                room_plot()
+                ss.show_room = False
             st.markdown(CONTACT_STR)
-        # if not ss.show_results, then this is an empty panel
 
-with right_pane:
-    cols = st.columns(2)
-    show_room = st.button("Show Updated Room", use_container_width=True)
-    if ss.show_results:
-        if show_room and ss.editing is not None:
-            room_plot()
-            ss.show_room = False
-        results_page()
-    else:
-        if show_room or ss.show_room:
-            room_plot()
-            ss.show_room = False
-        st.markdown(CONTACT_STR)
+    # hidden breakdown of earlier rerun timings, for finding slowdowns
+    if st.query_params.get("perf") == "1":
+        perf_panel()
+finally:
+    # however the run ends, even if it raises or is cut short by st.rerun() or
+    # st.stop(), so that neither its timing, its profile nor its session is
+    # left running
+    end_rerun()
+    end_profile(ss)
+    leave_session()
 
 
 def room_plot():
@@ -0,0 +1,40 @@
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+from app import top_ribbon, profiling
+
+
+def click(at, label):
+    next(button for button in at.button if button.label == label).click()
+    return at.run()
+
+
+def run_app(**query_params):
+    at = AppTest.from_file("guv_app.py", default_timeout=120)
+    at.query_params.update(query_params)
+    return at.run()
+
+
+def test_reruns_cut_short_are_timed(monkeypatch):
+    at = run_app()
+    assert len(at.session_state["perf_log"]) == 1
+
+    def stop():
+        st.stop()
+
+    monkeypatch.setattr(top_ribbon, "top_ribbon", stop)
+    at.run()
+    assert not at.exception
+    assert len(at.session_state["perf_log"]) == 2
+
+
+def test_profile_next_rerun_captures_the_one_after_the_click(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path)
+    at = click(run_app(profile="1"), "Project")
+    click(at, "Profile Next Rerun")
+    assert at.session_state["profile"] is None
+    assert "The next rerun will be profiled." in [c.value for c in at.caption]
+
+    at.run()
+    assert at.session_state["profile_next"] is None
+    assert at.session_state["profile"]["label"] == profiling.RERUN
+    assert len(list(tmp_path.glob("*.prof"))) == 1
@@ -0,0 +1,160 @@
+import warnings
+import pytest
+import numpy as np
+from guv_calcs import Room, Lamp
+from app import calculation
+from app.calculation import (
+    calculate_room,
+    get_stale_pairs,
+    get_stale_zones,
+    plan_calculation,
+    rescale_lamp,
+)
+from app.result_cache import RESULT_CACHE, result_key
+
+# edits to a calculated room, by name
+EDITS = {
+    "move": lambda room: room.lamps["Lamp1"].move(1, 1, 2),
+    "tilt": lambda room: room.lamps["Lamp1"].set_tilt(30),
+    "disable": lambda room: setattr(room.lamps["Lamp2"], "enabled", False),
+    "remove": lambda room: room.remove_lamp("Lamp2"),
+    "scale": lambda room: room.lamps["Lamp1"].scale(0.5),
+    "spacing": lambda room: room.calc_zones["SkinLimits"].set_spacing(0.2, 0.25),
+    "fov": lambda room: setattr(room.calc_zones["EyeLimits"], "fov_horiz", 180),
+}
+
+
+def make_room(num_lamps=3, reflectance=False):
+    """
+    the default room with its standard zones and vendored lamps, the last of
+    which sits exactly on a point of the WholeRoomFluence grid
+    """
+    room = Room(enable_reflectance=reflectance)
+    if reflectance:
+        room.set_reflectance(0.078)
+    room.add_standard_zones()
+    for i in range(num_lamps):
+        lamp = Lamp.from_keyword("ushio_b1", lamp_id=f"Lamp{i + 1}")
+        lamp.move((i + 1) * room.x / (num_lamps + 1), room.y / 2, room.z - 0.1)
+        room.add_lamp(lamp)
+    coords = room.calc_zones["WholeRoomFluence"].coords
+    room.lamps[f"Lamp{num_lamps}"].move(*coords[len(coords) // 2])
+    return room
+
+
+def calculated(calculate):
+    """a new room calculated with `calculate`, doing all of its own ray work"""
+    room = make_room()
+    RESULT_CACHE.clear()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        calculate(room)
+    RESULT_CACHE.clear()
+    return room
+
+
+def assert_same_values(room, other, rtol=0):
+    """
+    every zone of two rooms has the same values, masked at the same points.
+    `rtol` allows for sums over lamps rounded differently
+    """
+    for zone_id, zone in room.calc_zones.items():
+        values, expected = zone.get_values(), other.calc_zones[zone_id].get_values()
+        assert values is not None and expected is not None
+        assert np.array_equal(np.ma.getmaskarray(values), np.ma.getmaskarray(expected))
+        values, expected = np.ma.compressed(values), np.ma.compressed(expected)
+        if rtol:
+            np.testing.assert_allclose(values, expected, rtol=rtol)
+        else:
+            assert np.array_equal(values, expected)
+
+
+def test_workers_match_serial_and_guv_calcs():
+    serial = calculated(lambda room: calculate_room(room, workers=1))
+    parallel = calculated(lambda room: calculate_room(room, workers=2))
+    reference = calculated(lambda room: room.calculate())
+    assert_same_values(serial, parallel)
+    # guv-calcs sums lamps in float32, where these are accumulated in float64
+    assert_same_values(serial, reference, rtol=1e-6)
+
+
+def test_lamp_on_a_grid_point_is_masked():
+    room = calculated(lambda room: calculate_room(room, workers=1))
+    values = room.calc_zones["WholeRoomFluence"].get_values()
+    assert np.ma.is_masked(values)
+    assert np.isfinite(values.mean())
+
+
+def count_ray_work(monkeypatch):
+    """a list that every (lamp_id, zone_id) pair calculated from scratch is added to"""
+    pairs = []
+    calculate_lamp = calculation.calculate_lamp
+
+    def counted(lamp, zv):
+        pairs.append((lamp.lamp_id, zv.zone_id))
+        return calculate_lamp(lamp, zv)
+
+    monkeypatch.setattr(calculation, "calculate_lamp", counted)
+    RESULT_CACHE.clear()
+    return pairs
+
+
+@pytest.mark.parametrize("reflectance", [False, True])
+@pytest.mark.parametrize("edit", EDITS)
+def test_only_stale_pairs_are_recalculated(edit, reflectance, monkeypatch):
+    room = make_room(reflectance=reflectance)
+    reference = make_room(reflectance=reflectance)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        calculate_room(room, workers=1)
+        reference.calculate()
+        assert get_stale_pairs(room) == ([], []) and get_stale_zones(room) == []
+
+        EDITS[edit](room)
+        EDITS[edit](reference)
+        recalc, update = get_stale_pairs(room)
+        assert recalc or update or get_stale_zones(room)
+        assert sorted(plan_calculation(room)[1]) == sorted(recalc)
+        # zones with the same points share their results
+        keys = {
+            result_key(room.lamps[lamp_id], room.calc_zones[zone_id].to_view())
+            for lamp_id, zone_id in recalc
+        }
+
+        calculated = count_ray_work(monkeypatch)
+        calculate_room(room, workers=1)
+        reference.calculate()
+    assert set(calculated) <= set(recalc) and len(calculated) == len(keys)
+    assert get_stale_pairs(room) == ([], []) and get_stale_zones(room) == []
+    assert_same_values(room, reference, rtol=1e-6)
+
+
+def test_rescaled_lamp_matches_a_full_recalculation(monkeypatch):
+    room, reference = make_room(), make_room()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        calculate_room(room, workers=1)
+        lamp = room.lamps["Lamp1"]
+        old_calc_state = lamp.calc_state
+        lamp.scale(0.7)
+        reference.lamps["Lamp1"].scale(0.7)
+
+        calculated = count_ray_work(monkeypatch)
+        assert rescale_lamp(room, lamp, old_calc_state)
+        assert get_stale_pairs(room) == ([], []) and get_stale_zones(room) == []
+        calculate_room(room, workers=1)
+        reference.calculate()
+    assert calculated == []
+    assert_same_values(room, reference, rtol=1e-6)
+
+
+def test_rescaling_a_reflective_room_falls_back_to_recalculation():
+    room = make_room(reflectance=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        calculate_room(room, workers=1)
+    lamp = room.lamps["Lamp1"]
+    old_calc_state = lamp.calc_state
+    lamp.scale(0.7)
+    assert not rescale_lamp(room, lamp, old_calc_state)
+    assert len(get_stale_pairs(room)[0]) == len(room.calc_zones)
@@ -0,0 +1,34 @@
+import pytest
+from app import catalog
+from app.catalog import Catalog, get_catalog
+
+
+@pytest.fixture
+def current(monkeypatch):
+    """the local catalog, with the index file stale"""
+    index = Catalog.from_file().index
+    old = Catalog(index, source=catalog.INDEX_PATH, version=-1)
+    monkeypatch.setitem(catalog._catalogs, False, old)
+    return old
+
+
+def test_refreshed_when_the_file_changes(current):
+    refreshed = get_catalog()
+    assert refreshed is not current
+    assert refreshed.index == current.index
+    assert get_catalog() is refreshed
+
+
+def test_failed_refresh_keeps_the_old_index(current, monkeypatch):
+    def from_file():
+        raise ValueError("half-written file")
+
+    monkeypatch.setattr(Catalog, "from_file", from_file)
+    loaded_at = current.loaded_at
+    refreshed = get_catalog()
+    # as a new catalog, leaving the old one as it was
+    assert refreshed is not current and current.loaded_at == loaded_at
+    assert refreshed.index is current.index
+    assert refreshed.loaded_at > loaded_at
+    # and not retried until the file changes again
+    assert get_catalog() is refreshed
@@ -0,0 +1,118 @@
+import warnings
+import pytest
+import numpy as np
+from guv_calcs import Room, Lamp
+from app import results
+from app.calculation import calculate_room
+from app.compliance import check_compliance
+
+
+def make_room(keywords=("ushio_b1", "aerolamp", "beacon"), standard="ACGIH"):
+    """a calculated room with a vendored lamp of each keyword, low enough to dim"""
+    room = Room(standard=standard)
+    room.add_standard_zones()
+    for i, keyword in enumerate(keywords):
+        lamp = Lamp.from_keyword(keyword, lamp_id=f"Lamp{i + 1}")
+        lamp.move(1 + 1.5 * i, 2, 2.2)
+        room.add_lamp(lamp)
+    return calculate(room)
+
+
+def calculate(room):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        calculate_room(room, workers=1)
+    return room
+
+
+def per_lamp(room):
+    """the compliance numbers as check_lamps worked them out, one lamp at a time"""
+    skin = room.calc_zones["SkinLimits"]
+    eye = room.calc_zones["EyeLimits"]
+    weighted_skin_dose = np.zeros(skin.get_values().shape)
+    weighted_eye_dose = np.zeros(eye.get_values().shape)
+    dimmed_weighted_skin_dose = np.zeros(skin.get_values().shape)
+    dimmed_weighted_eye_dose = np.zeros(eye.get_values().shape)
+    dims = {}
+    for lamp_id, lamp in room.lamps.items():
+        skinmax, eyemax = lamp.get_tlvs(room.standard)
+        skinvals = skin.calculator.cache.values(lamp_id) * 3.6 * skin.hours
+        eyevals = eye.calculator.cache.values(lamp_id) * 3.6 * eye.hours
+        skindim, eyedim = skinmax / skinvals.max(), eyemax / eyevals.max()
+        weighted_skin_dose += skinvals * 3 / skinmax
+        weighted_eye_dose += eyevals * 3 / eyemax
+        total_dim = min(skindim, eyedim, 1)
+        dimmed_weighted_skin_dose += skinvals * 3 / skinmax * total_dim
+        dimmed_weighted_eye_dose += eyevals * 3 / eyemax * total_dim
+        dims[lamp_id] = (skindim, eyedim)
+    return {
+        "weighted_skin_dose": weighted_skin_dose,
+        "weighted_eye_dose": weighted_eye_dose,
+        "dimmed_weighted_skin_dose": dimmed_weighted_skin_dose,
+        "dimmed_weighted_eye_dose": dimmed_weighted_eye_dose,
+        "dims": dims,
+    }
+
+
+def check_lamps_warnings(room, monkeypatch):
+    """the warnings check_lamps shows for a room"""
+    shown = []
+
+    class St:
+        def warning(self, message):
+            shown.append(message)
+
+    monkeypatch.setattr(results, "st", St())
+    monkeypatch.setattr(results, "ss", {})
+    results.check_lamps(room, warn=True)
+    return shown
+
+
+@pytest.mark.parametrize("standard", ["ACGIH", "ICNIRP"])
+def test_matches_the_per_lamp_calculation(standard):
+    room = make_room(standard=standard)
+    result = check_compliance(room)
+    expected = per_lamp(room)
+    for name in [
+        "weighted_skin_dose",
+        "weighted_eye_dose",
+        "dimmed_weighted_skin_dose",
+        "dimmed_weighted_eye_dose",
+    ]:
+        np.testing.assert_allclose(getattr(result, name), expected[name], rtol=1e-6)
+    assert result.lamp_dims().keys() == expected["dims"].keys()
+    for lamp_id, dims in result.lamp_dims().items():
+        np.testing.assert_allclose(dims, expected["dims"][lamp_id], rtol=1e-6)
+    all_dims = [dim for dims in expected["dims"].values() for dim in dims]
+    assert result.dimming_not_required == all(dim > 1 for dim in all_dims)
+
+
+def test_is_memoized_until_the_room_changes():
+    room = make_room()
+    result = check_compliance(room)
+    assert check_compliance(room) is result
+    room.lamps["Lamp1"].move(1, 3, 2.2)
+    calculate(room)
+    assert check_compliance(room) is not result
+
+
+def test_dose_at_the_limit(monkeypatch):
+    room = make_room(keywords=["ushio_b1"])
+    skin_dim, eye_dim = check_compliance(room).lamp_dims()["Lamp1"]
+    assert skin_dim < 1
+
+    # scaled to exactly the limit, the lamp complies, and needs no dimming
+    limit = min(skin_dim, eye_dim)
+    room.lamps["Lamp1"].scale(limit)
+    result = check_compliance(calculate(room))
+    assert round(min(result.lamp_dims()["Lamp1"]) * 100, 1) == 100
+    assert result.weighted_skin_dose.max().round(2) == 3
+    assert result.lamps_compliant and result.dimmed_lamps_compliant
+    assert check_lamps_warnings(room, monkeypatch) == []
+
+    # and 1% over it, it must be dimmed back down
+    room.lamps["Lamp1"].scale(limit * 1.01)
+    result = check_compliance(calculate(room))
+    assert not result.lamps_compliant and result.dimmed_lamps_compliant
+    (shown,) = check_lamps_warnings(room, monkeypatch)
+    assert "must be dimmed to **99.0%**" in shown
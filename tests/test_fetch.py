@@ -0,0 +1,122 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import requests
+from app import fetch as fetch_module
+from app.fetch import fetch, prefetch, prune
+
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+class AssetServer:
+    """a stand-in for reports.osluv.org, serving `assets` by path"""
+
+    def __init__(self):
+        self.assets = {}  # path: (body, etag)
+        self.requests = []  # (path, headers) of every request
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers)))
+                if self.path not in server.assets:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body, etag = server.assets[self.path]
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", LAST_MODIFIED)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread = None
+
+
+@pytest.fixture
+def server():
+    server = AssetServer()
+    server.assets["/lamp.ies"] = (b"IESNA:LM-63-2002 v1", '"v1"')
+    yield server
+    server.stop()
+
+
+def test_fresh_copy_is_served_without_a_request(server, tmp_path):
+    url = f"{server.url}/lamp.ies"
+    assert fetch(url, cache_dir=tmp_path) == b"IESNA:LM-63-2002 v1"
+    assert fetch(url, max_age=300, cache_dir=tmp_path) == b"IESNA:LM-63-2002 v1"
+    assert len(server.requests) == 1
+
+
+def test_stale_copy_is_revalidated(server, tmp_path):
+    url = f"{server.url}/lamp.ies"
+    fetch(url, cache_dir=tmp_path)
+    assert fetch(url, max_age=0, cache_dir=tmp_path) == b"IESNA:LM-63-2002 v1"
+    assert len(server.requests) == 2
+    headers = server.requests[1][1]
+    assert headers["If-None-Match"] == '"v1"'
+    assert headers["If-Modified-Since"] == LAST_MODIFIED
+
+
+def test_changed_asset_is_downloaded_again(server, tmp_path):
+    url = f"{server.url}/lamp.ies"
+    fetch(url, cache_dir=tmp_path)
+    server.assets["/lamp.ies"] = (b"IESNA:LM-63-2002 v2", '"v2"')
+    assert fetch(url, max_age=0, cache_dir=tmp_path) == b"IESNA:LM-63-2002 v2"
+    # and the new copy is what's cached
+    assert fetch(url, max_age=300, cache_dir=tmp_path) == b"IESNA:LM-63-2002 v2"
+    assert len(server.requests) == 2
+
+
+def test_cached_copy_is_served_during_an_outage(server, tmp_path):
+    url = f"{server.url}/lamp.ies"
+    fetch(url, cache_dir=tmp_path)
+    server.stop()
+    assert fetch(url, max_age=0, cache_dir=tmp_path) == b"IESNA:LM-63-2002 v1"
+
+
+def test_uncached_failure_raises(server, tmp_path):
+    with pytest.raises(requests.HTTPError):
+        fetch(f"{server.url}/missing.ies", cache_dir=tmp_path)
+    url = f"{server.url}/lamp.ies"
+    server.stop()
+    with pytest.raises(requests.ConnectionError):
+        fetch(url, cache_dir=tmp_path)
+
+
+def test_prefetch_reports_each_url(server, tmp_path):
+    good, bad = f"{server.url}/lamp.ies", f"{server.url}/missing.ies"
+    assert prefetch([good, bad, good], cache_dir=tmp_path) == {good: True, bad: False}
+    assert fetch(good, max_age=300, cache_dir=tmp_path) == b"IESNA:LM-63-2002 v1"
+    assert len(server.requests) == 2
+
+
+def test_cache_is_kept_within_its_size(server, tmp_path, monkeypatch):
+    for name in ["a", "b", "c"]:
+        server.assets[f"/{name}.ies"] = (name.encode() * 100, f'"{name}"')
+    monkeypatch.setattr(fetch_module, "MAX_BYTES", 250)
+    for name in ["a", "b", "c"]:
+        fetch(f"{server.url}/{name}.ies", cache_dir=tmp_path)
+    assert len(list(tmp_path.glob("*.body"))) == 2
+    # the asset checked least recently went first
+    fetch(f"{server.url}/a.ies", max_age=300, cache_dir=tmp_path)
+    assert len(server.requests) == 4
+    prune(tmp_path, max_bytes=0)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,24 @@
+from app import lamp_library
+from app.catalog import Catalog
+from app.lamp_library import get_library
+
+
+def test_rebuilt_when_the_catalog_is_refreshed(monkeypatch):
+    catalogs = [Catalog.from_file()]
+    monkeypatch.setattr(lamp_library, "get_catalog", lambda online: catalogs[-1])
+    monkeypatch.setattr(lamp_library, "_library", None)
+    library = get_library()
+    assert get_library() is library
+
+    # the same index, less its first lamp
+    index = dict(list(catalogs[0].index.items())[1:])
+    catalogs.append(Catalog(index, source="refreshed"))
+    refreshed = get_library()
+    assert refreshed is not library
+    assert (
+        refreshed.names.keys() == catalogs[-1].ies_files.keys() & library.names.keys()
+    )
+    assert len(refreshed) < len(library)
+    # and its lamps were parsed only once
+    for name in refreshed.names:
+        assert refreshed[name] is library[name]
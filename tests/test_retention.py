@@ -0,0 +1,83 @@
+import warnings
+import pytest
+import numpy as np
+from app import retention
+from app.retention import PackedArray, parse_retention
+from app.calculation import calculate_room, get_lamp_entry
+from app.result_cache import RESULT_CACHE
+from tests.test_calculation import make_room
+
+rng = np.random.default_rng(0)
+volume = rng.random((5, 6, 7), dtype="float32")
+ARRAYS = {
+    "float32": volume,
+    "float64": rng.random(50),
+    "masked": np.ma.masked_array(volume, mask=volume > 0.9),
+    "masked, nothing masked": np.ma.masked_array(volume),
+    "inf under the mask": np.ma.masked_invalid(np.array([1, np.inf, 3], "float32")),
+}
+
+
+def assert_same(values, expected):
+    """equal values, masked at the same points"""
+    assert np.array_equal(np.ma.getmaskarray(values), np.ma.getmaskarray(expected))
+    assert np.array_equal(np.ma.compressed(values), np.ma.compressed(expected))
+
+
+@pytest.mark.parametrize("name", ARRAYS)
+def test_packed_array_round_trips(name):
+    array = ARRAYS[name]
+    unpacked = PackedArray(array).unpack()
+    assert unpacked.dtype == array.dtype and unpacked.shape == array.shape
+    assert unpacked.flags.writeable
+    assert_same(unpacked, array)
+
+
+def test_packed_array_is_smaller():
+    values = np.linspace(0, 1, 10000, dtype="float32")
+    assert PackedArray(values).nbytes < values.nbytes
+
+
+def test_parse_retention():
+    assert parse_retention("volume=compress, WholeRoomFluence=DROP") == {
+        "plane": "keep",
+        "volume": "compress",
+        "WholeRoomFluence": "drop",
+    }
+    with pytest.raises(ValueError):
+        parse_retention("volume=forget")
+
+
+def calculated(policy, monkeypatch):
+    """a room calculated and then edited under a retention policy for every zone"""
+    monkeypatch.setattr(retention, "RETENTION", {"plane": policy, "volume": policy})
+    room = make_room()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        calculate_room(room, workers=1)
+        # an incremental recalculation reuses the entries of the other lamps
+        room.lamps["Lamp1"].move(1, 1, 2)
+        calculate_room(room, workers=1)
+    return room
+
+
+@pytest.mark.parametrize(
+    "policy, held", [("keep", np.ndarray), ("compress", PackedArray), ("drop", None)]
+)
+def test_policies_keep_values(policy, held, monkeypatch):
+    reference = calculated("keep", monkeypatch)
+    room = calculated(policy, monkeypatch)
+    RESULT_CACHE.clear()  # so that dropped results are calculated again
+    for zone_id, zone in room.calc_zones.items():
+        expected = reference.calc_zones[zone_id]
+        assert_same(zone.get_values(), expected.get_values())
+        for lamp_id, lamp in room.lamps.items():
+            entry = zone.calculator.cache.lamp_cache[lamp_id]
+            if held is None:
+                assert entry.values is None and entry.base_values is None
+            else:
+                assert isinstance(entry.values, held)
+            resolved = get_lamp_entry(zone, lamp)
+            reference_entry = expected.calculator.cache.lamp_cache[lamp_id]
+            assert_same(resolved.base_values, reference_entry.base_values)
+            assert_same(resolved.values, reference_entry.values)
@@ -0,0 +1,74 @@
+import time
+import numpy as np
+from streamlit.runtime.state.session_state import SessionState
+from app.calculation import calculate_room
+from app.sessions import SessionManager
+from tests.test_calculation import calculated
+
+
+def lamp_values(room):
+    """every zone's per-lamp values, by zone and lamp id"""
+    return {
+        zone_id: {
+            lamp_id: entry.values
+            for lamp_id, entry in zone.calculator.cache.lamp_cache.items()
+        }
+        for zone_id, zone in room.calc_zones.items()
+    }
+
+
+def wait_for_spill(manager, timeout=10):
+    deadline = time.monotonic() + timeout
+    while manager.stats()["spilled"] == 0:
+        assert time.monotonic() < deadline, "the session was never spilled"
+        time.sleep(0.01)
+
+
+def test_under_budget_sessions_keep_their_results(tmp_path):
+    manager = SessionManager(budget=1024**3, idle_seconds=0, spill_dir=tmp_path)
+    state = SessionState()
+    state["room"] = calculated(calculate_room)
+    expected = lamp_values(state["room"])
+    manager.enter("a", state)
+    manager.leave("a", state)
+    for zone_id, zone_values in lamp_values(state["room"]).items():
+        for lamp_id, values in zone_values.items():
+            assert values is expected[zone_id][lamp_id]
+    assert manager.enforce() == []
+
+
+def test_spilled_results_are_restored_on_the_next_run(tmp_path):
+    manager = SessionManager(budget=1, idle_seconds=0, spill_dir=tmp_path)
+    state = SessionState()
+    room = state["room"] = calculated(calculate_room)
+    state["payloads"] = {}
+    expected = lamp_values(room)
+    caches = {
+        zone_id: zone.calculator.cache for zone_id, zone in room.calc_zones.items()
+    }
+
+    manager.enter("a", state)
+    manager.leave("a", state)
+    # parked on this thread, at the end of the run, as callbacks would then see it
+    parked = {
+        zone_id: zone.calculator.cache for zone_id, zone in room.calc_zones.items()
+    }
+    assert all(parked[zone_id] is not caches[zone_id] for zone_id in caches)
+    assert "payloads" not in state
+    for zone_values in lamp_values(room).values():
+        assert all(values is None for values in zone_values.values())
+
+    # and the spill thread writes them out without touching the session
+    wait_for_spill(manager)
+    assert len(list(tmp_path.glob("*.pkl"))) == 1
+    assert all(
+        zone.calculator.cache is parked[zone_id]
+        for zone_id, zone in room.calc_zones.items()
+    )
+
+    manager.enter("a", state)
+    assert manager.stats()["restores"] == 1
+    assert list(tmp_path.iterdir()) == []
+    for zone_id, zone_values in lamp_values(room).items():
+        for lamp_id, values in zone_values.items():
+            assert np.array_equal(values, expected[zone_id][lamp_id])
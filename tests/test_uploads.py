@@ -0,0 +1,43 @@
+import gc
+from app.uploads import UploadStore, UploadIndex
+
+
+def parse_ies(data):
+    return {"ies": data}
+
+
+def parse_spectrum(data):
+    return {"spectrum": data}
+
+
+def test_same_file_is_stored_and_parsed_once():
+    store = UploadStore()
+    a, b = UploadIndex(parse_ies, store), UploadIndex(parse_ies, store)
+    a.add("lamp.ies", b"photometry")
+    b.add("other name.ies", b"photometry")
+    assert len(store) == 1 and store.parses == 1 and store.hits == 1
+    assert a.get("lamp.ies") is b.get("other name.ies")
+    assert a.get_parsed("lamp.ies") is not b.get_parsed("other name.ies")
+
+
+def test_same_bytes_of_another_kind_are_stored_apart():
+    store = UploadStore()
+    ies, spectra = UploadIndex(parse_ies, store), UploadIndex(parse_spectrum, store)
+    ies.add("lamp", b"same bytes")
+    spectra.add("lamp", b"same bytes")
+    assert len(store) == 2
+    assert ies.get_parsed("lamp") == {"ies": b"same bytes"}
+    assert spectra.get_parsed("lamp") == {"spectrum": b"same bytes"}
+
+
+def test_uploads_are_released_with_the_last_index():
+    store = UploadStore()
+    a, b = UploadIndex(parse_ies, store), UploadIndex(parse_ies, store)
+    a.add("lamp.ies", b"photometry")
+    b.add("lamp.ies", b"photometry")
+    a.add("lamp.ies", b"new photometry")  # replaces the file of the same name
+    assert len(store) == 2
+    del b
+    gc.collect()
+    assert len(store) == 1
+    assert a.get_parsed("lamp.ies") == {"ies": b"new photometry"}